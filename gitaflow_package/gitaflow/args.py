@@ -26,6 +26,17 @@ learn more about using subcommands listed below')
     main_parser.add_argument(
         '--version', action='version', version='%(prog)s ' + VERSION)
     main_parser.add_argument('--log-file', '-l')
+    main_parser.add_argument(
+        '--stats', action='store_true',
+        help='Print number of git calls and time spent in them at exit')
+    cassette_mode = main_parser.add_mutually_exclusive_group()
+    cassette_mode.add_argument(
+        '--record', metavar='FILE',
+        help='Write outputs of all git calls to FILE')
+    cassette_mode.add_argument(
+        '--replay', metavar='FILE',
+        help='Take outputs of git calls from FILE written by --record '
+             'instead of calling git')
     output_mode = main_parser.add_mutually_exclusive_group()
     output_mode.add_argument(
         '-v', '--verbosity', action='count', default=0,
@@ -74,6 +74,16 @@ def consistency_check(list_of_treeish):
                 else:
                     merges[m.rev.topic].append(m)
 
+    # newer revisions based on elder ones are checked by a single query
+    pairs = []
+    for topic in merges.keys():
+        for m1, m2 in itertools.combinations(merges[topic], 2):
+            if m1.rev.version != m2.rev.version:
+                if m1.rev.version > m2.rev.version:
+                    m1, m2 = m2, m1
+                pairs.append((m1.rev.SHA, m2.rev.SHA))
+    based = commit.is_based_on_many(pairs)
+
     # do checks
     result = True
     for topic in merges.keys():
@@ -90,7 +100,7 @@ def consistency_check(list_of_treeish):
                 if m1.rev.version > m2.rev.version:
                     m1, m2 = m2, m1
                 # assuming m2 is the newer revision as we got here
-                if not commit.is_based_on(m1.rev.SHA, m2.rev.SHA):
+                if not based[(m1.rev.SHA, m2.rev.SHA)]:
                     say(m2.rev.get_branch_name(), 'merged into', m2.origin +
                         '(merge SHA: ' + m2.SHA + ') is newer version of',
                         m1.rev.get_branch_name(), 'merged into',
@@ -1,5 +1,6 @@
 """Process args for git af"""
 
+import atexit
 import logging
 import sys
 import traceback
@@ -9,6 +10,7 @@ from gitaflow import init, merge, start, rebase, continue_, checkout, finish,\
 from gitaflow.common import die
 from gitaflow.constants import VERSION
 from thingitwrapper.cached import misc
+from thingitwrapper import cassette, trace
 
 
 def log_unhandled_exception(type_, value, traceback_):
@@ -47,6 +49,13 @@ def execute(cli_args=sys.argv[1:]):
     args_namespace = args.parse_args(cli_args)
     if args_namespace:
         setup_logging(args_namespace.verbosity, args_namespace.log_file)
+        if args_namespace.stats:
+            trace.collect()
+            atexit.register(trace.print_summary)
+        if args_namespace.record:
+            cassette.record(args_namespace.record)
+        elif args_namespace.replay:
+            cassette.replay(args_namespace.replay)
         logging.info(
             'Git aflow ' + VERSION + '. Processing args ' + str(args_namespace))
 
@@ -7,7 +7,7 @@ from gitaflow.common import die, say, consistency_check, check_iteration, \
     check_working_tree_clean, check_untracked_not_differ, check_topic_name_valid
 from gitaflow.constants import RELEASE_NAME, DEVELOP_NAME, MASTER_NAME, \
     STAGING_NAME, EUF_NAME
-from gitaflow.topic import TopicRevision, TopicMerge, \
+from gitaflow.topic import TopicRevision, TopicMerge, RevisionSet, \
     MergeNonConflictError
 from thingitwrapper.cached import misc, branch, commit
 
@@ -126,41 +126,45 @@ def finish(description, type_, name):
     # on elder.
     # If this revision was ever merged into cd, its sha is same as cr.SHA
     # We are not based on other topics
-    for merge in all_m_cd:
-        if not merge.is_fake():
-            if merge.rev.topic == cr.topic:
-                if (merge.rev.version < cr.version and
-                        not commit.is_based_on(merge.rev.SHA, cr.SHA)):
-                    die('Cannot finish. There is elder revision of this '
-                        'topic in', cd, 'and SHA you are '
-                        'trying to finish is not based on it. Please rebase '
-                        'your work on', merge.rev.get_branch_name())
-                elif (merge.rev.version > cr.version and
-                        not commit.is_based_on(cr.SHA, merge.rev.SHA)):
-                    die('Cannot finish. Newer revision',
-                        merge.rev.get_branch_name(),
-                        'was merged into', cd, 'and it is '
-                        'not based on revision you are trying to finish.')
-                elif merge.rev == cr and not merge.rev.SHA == cr.SHA:
-                    die(cr.get_branch_name(), 'was already merged in',
-                        cd, 'with different head SHA. Finish failed.')
-            elif commit.is_based_on(merge.rev.SHA, cr.SHA):
-                die('TB of current topic is based on another topic, which is '
-                    'illegal. You should either merge other topic instead of '
-                    'basing on it or name topic you are finishing '
-                    'appropriately.')
-            elif commit.is_based_on(cr.SHA, merge.rev.SHA):
-                die('Finish failed. There is another topic (' +
-                    merge.rev.get_branch_name() + ') in', cd,
-                    'which is based on one you are trying to finish.')
+    real_m_cd = [merge for merge in all_m_cd if not merge.is_fake()]
+    based = commit.is_based_on_many(
+        [(merge.rev.SHA, cr.SHA) for merge in real_m_cd] +
+        [(cr.SHA, merge.rev.SHA) for merge in real_m_cd])
+    for merge in real_m_cd:
+        if merge.rev.topic == cr.topic:
+            if (merge.rev.version < cr.version and
+                    not based[(merge.rev.SHA, cr.SHA)]):
+                die('Cannot finish. There is elder revision of this '
+                    'topic in', cd, 'and SHA you are '
+                    'trying to finish is not based on it. Please rebase '
+                    'your work on', merge.rev.get_branch_name())
+            elif (merge.rev.version > cr.version and
+                    not based[(cr.SHA, merge.rev.SHA)]):
+                die('Cannot finish. Newer revision',
+                    merge.rev.get_branch_name(),
+                    'was merged into', cd, 'and it is '
+                    'not based on revision you are trying to finish.')
+            elif merge.rev == cr and not merge.rev.SHA == cr.SHA:
+                die(cr.get_branch_name(), 'was already merged in',
+                    cd, 'with different head SHA. Finish failed.')
+        elif based[(merge.rev.SHA, cr.SHA)]:
+            die('TB of current topic is based on another topic, which is '
+                'illegal. You should either merge other topic instead of '
+                'basing on it or name topic you are finishing '
+                'appropriately.')
+        elif based[(cr.SHA, merge.rev.SHA)]:
+            die('Finish failed. There is another topic (' +
+                merge.rev.get_branch_name() + ') in', cd,
+                'which is based on one you are trying to finish.')
 
     logging.info('Topic branch was started from correct place. About to '
                  'finish revision ' + cr.get_branch_name() +
                  '. Checking dependencies...')
 
     revs_cd = tuple(m.rev for m in eff_m_cd)
+    revs_cd_set = RevisionSet(revs_cd)
     for dep in cr.get_own_effective_merges(recursive=True):
-        if not dep.rev.topic == cr.topic and dep.rev.is_newest_in(revs_cd):
+        if not dep.rev.topic == cr.topic and revs_cd_set.is_newest(dep):
             die('Finish failed. Your topic depends on',
                 dep.rev.get_branch_name(), 'which is absent in', cd)
 
@@ -14,18 +14,27 @@ class Iteration(collections.namedtuple('IterationT', ('name',))):
         return super().__new__(cls, name)
 
     @classmethod
-    @cache('branches', 'rags')
+    @cache('branches', 'tags')
     def get_all(cls, sort=False):
         """ Returns tuple of all iterations. If sort==True descendants are
         put after ancestors.
         """
-        iters = (t for t in tag.get_list() if cls(t).valid_and_exists())
+        # valid_and_exists() for every tag, batched. Tags are listed, so there
+        # is no need to check if they exist
+        candidates = [cls(t) for t in tag.get_list() if '/' not in t]
+        valid = misc.is_valid_ref_name_many(
+            name for c in candidates
+            for name in (c.name, c.get_develop(), c.get_staging()))
+        candidates = [c for i, c in enumerate(candidates)
+                      if all(valid[3 * i:3 * i + 3])]
+        have_develop = branch.exists_many(c.get_develop() for c in candidates)
+        iters = [c.name for c, has in zip(candidates, have_develop) if has]
         if sort:
             iters = misc.sort(iters, reverse=True)
         return tuple(Iteration(i) for i in iters)
 
     @classmethod
-    @cache('branches', 'rags')
+    @cache('branches', 'tags')
     def from_branch_name(cls, branch_name):
         if '/' not in branch_name:
             return None
@@ -50,14 +59,20 @@ class Iteration(collections.namedtuple('IterationT', ('name',))):
         return (self.name_valid() and tag.exists(self.name) and
                 branch.exists(self.get_develop()))
 
+    @classmethod
+    @cache('branches', 'tags')
+    def _get_positions(cls):
+        """Returns {iteration: its index in get_all(True)}"""
+        return {i: n for n, i in enumerate(cls.get_all(True))}
+
     def next(self):
         all_iterations = Iteration.get_all(True)
-        ind = all_iterations.index(self) + 1
+        ind = Iteration._get_positions()[self] + 1
         return all_iterations[ind] if ind < len(all_iterations) else None
 
     def prev(self):
         all_iterations = Iteration.get_all(True)
-        ind = all_iterations.index(self) - 1
+        ind = Iteration._get_positions()[self] - 1
         return all_iterations[ind] if ind >= 0 else None
 
     def get_master_head(self):
@@ -3,7 +3,7 @@ import itertools
 
 from gitaflow.constants import MASTER_NAME
 from gitaflow.iteration import Iteration
-from gitaflow.topic import TopicRevision, TopicMerge, \
+from gitaflow.topic import TopicRevision, TopicMerge, RevisionSet, \
     MergeNonConflictError
 from gitaflow.common import say, die, consistency_check, check_iteration, \
     check_working_tree_clean, default_sources, complete_branch_name, \
@@ -48,32 +48,29 @@ def merge(sources=None, merge_type=None, dependencies=False, merge_object=None,
                 logging.info('Excluding from merge: ' + str(m.rev))
 
     merges_to_commit = []
+    # own_merges + merges_to_commit
+    have = RevisionSet(own_merges)
     source_merges = list(itertools.chain.from_iterable(
         [TopicMerge.get_effective_merges_in(s) for s in sources]))
     if merge_object == 'all':
         for m in source_merges:
-            if m.is_newest_in(own_merges + merges_to_commit):
+            if have.is_newest(m):
                 merges_to_commit.append(m)
+                have.add(m)
                 logging.info('Adding to merge ' + str(m))
             else:
                 logging.info('Already have this version of ' + str(m))
     elif merge_object == 'update':
         for m in source_merges:
-            add = False
-            for already_have in own_merges + merges_to_commit:
-                if m.rev.topic == already_have.rev.topic:
-                    if m.rev.version > already_have.rev.version:
-                        add = True
-                    else:
-                        logging.info('Already have this version of ' +
-                                     already_have.rev.topic.name +
-                                     '. Ours: ' + str(already_have) +
-                                     ' theirs: ' + str(m))
-                        break
-            else:
-                if add:  # if no break and this one (m) is newer then ours
-                    merges_to_commit.append(m)
-                    logging.info('Adding to merge ' + str(m))
+            ours = have.get_latest_version(m.rev.topic)
+            if ours >= m.rev.version:
+                logging.info('Already have this version of ' +
+                             m.rev.topic.name + '. Ours: v' + str(ours) +
+                             ' theirs: ' + str(m))
+            elif ours:  # this one (m) is newer then ours
+                merges_to_commit.append(m)
+                have.add(m)
+                logging.info('Adding to merge ' + str(m))
     elif merge_object is None:
         logging.info('Source merges: ' +
                      ', '.join(str(m) for m in source_merges))
@@ -83,8 +80,9 @@ def merge(sources=None, merge_type=None, dependencies=False, merge_object=None,
             if revision.default_version:
                 last_merge = revision.topic.get_latest_merge(source_merges)
                 if last_merge:
-                    if last_merge.is_newest_in(own_merges + merges_to_commit):
+                    if have.is_newest(last_merge):
                         merges_to_commit.append(last_merge)
+                        have.add(last_merge)
                     else:
                         say('Latest revision of', topic, 'in sources is',
                             last_merge.rev.get_branch_name() + '. We '
@@ -95,8 +93,9 @@ def merge(sources=None, merge_type=None, dependencies=False, merge_object=None,
             else:
                 for m in source_merges:
                     if m.rev == revision:
-                        if m.is_newest_in(own_merges + merges_to_commit):
+                        if have.is_newest(m):
                             merges_to_commit.append(m)
+                            have.add(m)
                         else:
                             say('We already have this version of', topic, 'in',
                                 cb + '. Skipping..')
@@ -115,14 +114,17 @@ def merge(sources=None, merge_type=None, dependencies=False, merge_object=None,
         '. Checking dependencies now...')
 
     merges_with_deps = []
+    own_set = RevisionSet(own_merges)
+    with_deps = RevisionSet(own_merges)  # own_merges + merges_with_deps
     for m in merges_to_commit:
         logging.info('Dependency search for ' + m.rev.get_branch_name())
         for dependency in m.rev.get_own_effective_merges(True):
             logging.info('Processing dependency ' +
                          dependency.rev.get_branch_name())
-            if dependency.is_newest_in(own_merges + merges_with_deps):
+            if with_deps.is_newest(dependency):
                 if dependencies:
                     merges_with_deps.append(dependency)
+                    with_deps.add(dependency)
                 elif m.rev.topic != dependency.rev.topic:
                     # merging some version of topic we don't depend on its elder
                     # versions
@@ -131,25 +133,28 @@ def merge(sources=None, merge_type=None, dependencies=False, merge_object=None,
                         '. Try merge it first or use "git af merge -d" to '
                         'merge dependencies automatically')
         merges_with_deps.append(m)
+        with_deps.add(m)
 
     # add elder versions of topics being merged
     merges_with_versions = []
-    own_revisions = tuple(m.rev for m in own_merges)
+    with_versions = RevisionSet(own_merges)  # own + merges_with_versions
     for m in merges_with_deps:
         for v in range(1, m.rev.version):
             rev = TopicRevision(m.rev.topic, None, v, ci)
-            if not rev.is_in_merges(merges_with_versions + own_merges):
+            if rev not in with_versions:
                 for sm in source_merges:
                     if sm.rev == rev:
                         merges_with_versions.append(sm)
+                        with_versions.add(sm)
                         break
                 else:
-                    if rev.is_newest_in(own_revisions):
+                    if own_set.is_newest(rev):
                         die('Merge failed. We should merge',
                             m.rev.get_branch_name(), 'along with',
                             rev.get_branch_name() + ', but',
                             rev.get_branch_name(), 'is absent in sources.')
         merges_with_versions.append(m)
+        with_versions.add(m)
 
     logging.info(
         'Revisions to merge with dependencies and elder versions: ' +
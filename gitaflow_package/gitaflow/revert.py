@@ -4,7 +4,7 @@ from gitaflow.common import say, die, check_iteration, check_current_branch, \
     consistency_check
 from gitaflow.constants import MASTER_NAME
 from gitaflow.iteration import Iteration
-from gitaflow.topic import TopicMerge, TopicRevision
+from gitaflow.topic import TopicMerge, TopicRevision, RevisionSet
 from thingitwrapper import commit
 
 
@@ -74,11 +74,14 @@ def revert(names, dependencies):
 
     # check dependencies and make merges_to_revert_with_deps
     merges_to_revert_with_deps = []
+    to_revert = RevisionSet(merges_to_revert)
+    to_revert_with_deps = RevisionSet()
     for m in merges_to_revert:
         for d in find_dependent_topic_merges(m, own_merges) + [m]:
-            if not d.rev.is_in_merges(merges_to_revert_with_deps):
-                if d.rev.is_in_merges(merges_to_revert) or dependencies:
+            if d not in to_revert_with_deps:
+                if d in to_revert or dependencies:
                     merges_to_revert_with_deps.append(d)
+                    to_revert_with_deps.add(d)
                 else:
                     die('Unable to revert', m.rev.get_branch_name(),
                         'since', d.rev.get_branch_name(),
@@ -103,8 +106,9 @@ def revert(names, dependencies):
     else:
         upstream = upstream_merges = None
     if upstream:
+        upstream_set = RevisionSet(upstream_merges)
         for m in merges_to_revert_with_deps:
-            if m.rev.is_in_merges(upstream_merges):
+            if m in upstream_set:
                 die('Error:', m.rev.get_branch_name(), 'is merged in',
                     upstream + '. In git-aflow you cannot revert a topic until '
                     'it is reverted from the upstream branch.')
@@ -4,8 +4,11 @@ import logging
 from os import linesep
 import re
 import collections
+import threading
 
-from thingitwrapper.grouped_cache import cache
+from thingitwrapper import repo, shared_cache
+from thingitwrapper.grouped_cache import cache, register_store
+from thingitwrapper.shared_cache import ShaSet
 from thingitwrapper.cached import misc, branch, commit
 from gitaflow.iteration import Iteration
 from gitaflow.constants import FIX_NAME, DEV_NAME, EUF_NAME, MASTER_NAME
@@ -19,14 +22,237 @@ class IncompleteMergeObjectError(Exception):
     """ Merge object is not complete enough to execute called method."""
 
 
+# SHAs of commits which are neither topic merges nor reverts of them, though
+# their headlines look like ones. Hand-made merges, for instance.
+not_aflow_records = ShaSet('gitaflow.topic.not_aflow_records')
+
+
+def _remember_if_not_record(treeish, message):
+    """ Called when commit failed to parse as merge or revert. Marks it as
+    not an aflow record if it fails to parse as the other type too.
+    """
+    revert_headline, _ = TopicRevert.parse_message(message)
+    if revert_headline and TopicMerge.parse_headline(revert_headline,
+                                                     False)[0]:
+        return
+    headline = TopicMerge.parse_message(message)[0]
+    if headline and TopicMerge.parse_headline(headline, False)[0]:
+        return
+    logging.debug('Not an aflow record: ' + treeish)
+    not_aflow_records.add(treeish)
+
+
+REVERT_REGEXP = '^Revert "Merge branch .*"$'
+MERGE_REGEXP = "^Merge branch .*$"
+
+
+def __get_forget(store, lock):
+    """ Returns forget function of store keyed by (git dir, ...) tuples, see
+    grouped_cache.register_store
+    """
+    def forget(git_dir=None):
+        with lock:
+            for key in [k for k in store if git_dir in (None, k[0])]:
+                del store[key]
+    return forget
+
+
+# Index of records found on first-parent path of branches:
+# {(git dir, start SHA, branch name): (tip SHA, records)}. Persisted as
+# shared cache states if they are enabled.
+__records = dict()
+# Records of the same ranges grouped by topics:
+# {(git dir, start SHA, branch name): (records count, last SHA, topics)}
+__topics = dict()
+__records_lock = threading.Lock()
+register_store(__get_forget(__records, __records_lock))
+# parsing depends on iterations
+register_store(__get_forget(__topics, __records_lock), 'branches', 'tags')
+
+# Merges effective at iteration tags:
+# {(git dir, start SHA, iteration tag SHA): merge SHAs}. Persisted in shared
+# cache if it is enabled.
+_checkpoints = dict()
+_checkpoints_lock = threading.Lock()
+register_store(__get_forget(_checkpoints, _checkpoints_lock))
+
+
+def __find_records(start, tip):
+    if start:
+        shas = commit.get_commits_between(start, tip, True,
+                                          [REVERT_REGEXP, MERGE_REGEXP])
+    else:
+        shas = commit.find([tip], True, [REVERT_REGEXP, MERGE_REGEXP])[::-1]
+    # git greps every line of message, merges may have a line looking like
+    # revert in the body
+    return tuple((sha, commit.get_headline(sha).startswith('Revert "Merge'))
+                 for sha in shas)
+
+
+def get_records_between(treeish1, treeish2):
+    """ Returns ((SHA, is_revert), ...) of commits looking like topic merges
+    and reverts in treeish1..treeish2 (first-parent path), elder first.
+    Whole first-parent history of treeish2 is searched if treeish1 is None.
+    Records found for a branch are kept along with the tip they were found
+    for. When the branch moves forward only commits between the old and the
+    new tip are searched, if the old tip isn't on first-parent path of the new
+    one (branch was reset) the whole range is searched again. Other treeish
+    are searched directly.
+    """
+    start = misc.rev_parse(treeish1) if treeish1 else None
+    tip = misc.rev_parse(treeish2)
+    if not branch.exists(treeish2):
+        return __find_records(start, tip)
+    key = (repo.get_git_dir(), start, treeish2)
+    state = 'gitaflow.topic.records ' + repr((start, treeish2))
+    with __records_lock:
+        known = __records.get(key)
+    if known is None:
+        known = shared_cache.get_state(state)[1]
+    if known and known[0] == tip:
+        return known[1]
+    # records found mean start is on the path to the old tip, so commits
+    # between old and new tips are the only ones to add. With no records old
+    # tip may be aside of start, search again then, it's cheap
+    if (known and (known[1] or not start) and
+            commit.is_based_on(known[0], tip)):
+        records = known[1] + __find_records(known[0], tip)
+    else:
+        records = __find_records(start, tip)
+    with __records_lock:
+        __records[key] = (tip, records)
+    shared_cache.put_state(state, (tip, records))
+    return records
+
+
+TopicRecord = collections.namedtuple('TopicRecord', (
+    'SHA', 'version', 'iteration', 'target', 'is_revert'))
+
+
+def __parse_record(sha, is_revert):
+    parsed = (TopicRevert if is_revert else TopicMerge).from_treeish(sha)
+    if not parsed:
+        return None, None
+    iteration = parsed.rev.iteration.name if parsed.rev.iteration else None
+    return parsed.rev.topic.name, TopicRecord(sha, parsed.rev.version,
+                                              iteration, parsed.merge_target,
+                                              is_revert)
+
+
+def get_topic_index(treeish1, treeish2):
+    """ Returns {topic name: (TopicRecord, ...)} of merges and reverts in
+    treeish1..treeish2 (see get_records_between), records are elder first.
+    Index is updated along with records, so only new ones are parsed.
+    Parsing depends on iterations, so parsed records are kept by this process
+    only, other processes parse persisted SHAs again.
+    """
+    records = get_records_between(treeish1, treeish2)
+    start = misc.rev_parse(treeish1) if treeish1 else None
+    key = (repo.get_git_dir(), start, treeish2)
+    with __records_lock:
+        known = __topics.get(key)
+    # records are only appended while the branch moves forward
+    if known and known[0] <= len(records) and (
+            not known[0] or records[known[0] - 1][0] == known[1]):
+        if known[0] == len(records):
+            return known[2]
+        count, topics = known[0], dict(known[2])
+    else:
+        count, topics = 0, dict()
+    for sha, is_revert in records[count:]:
+        topic_name, record = __parse_record(sha, is_revert)
+        if record:
+            topics[topic_name] = topics.get(topic_name, ()) + (record,)
+    if branch.exists(treeish2):
+        with __records_lock:
+            __topics[key] = (len(records),
+                             records[-1][0] if records else None, topics)
+    return topics
+
+
+# {(git dir, topic revision head SHA, iteration tag SHA):
+#  (direct SHAs, transitive SHAs)}
+__dependencies = dict()
+__dependencies_lock = threading.Lock()
+register_store(__get_forget(__dependencies, __dependencies_lock))
+
+
+def __get_dependencies_key(sha):
+    iteration = Iteration.get_by_treeish(sha)
+    return (repo.get_git_dir(), sha,
+            misc.rev_parse(iteration.name) if iteration else None)
+
+
+def __get_known_dependencies(key):
+    with __dependencies_lock:
+        known = __dependencies.get(key)
+    if known is None:
+        found, known = shared_cache.get('gitaflow.topic.dependencies',
+                                        repr(key[1:]))
+        if found:
+            with __dependencies_lock:
+                __dependencies[key] = known
+    return known
+
+
+def get_dependencies(sha):
+    """ Returns (direct, transitive) SHAs of merges topic revision with head
+    sha depends on. Direct ones are merges effective in its history,
+    transitive ones include dependencies of direct ones, see
+    TopicMerge.get_effective_merges_in with recursive=True.
+    Dependencies of a SHA change only if its iteration is tagged again, so
+    they are computed once per iteration tag SHA, shared by all dependent
+    revisions and persisted in shared cache.
+    """
+    keys = dict()
+    pending = [sha]
+    directs = dict()
+    # depth first, without recursion: a revision is resolved when all of its
+    # direct dependencies are
+    while pending:
+        current = pending[-1]
+        if current not in keys:
+            keys[current] = __get_dependencies_key(current)
+        if __get_known_dependencies(keys[current]) is not None:
+            pending.pop()
+            continue
+        if current not in directs:
+            directs[current] = TopicMerge.get_effective_merges_in(current)
+        for m in directs[current]:
+            if m.rev.SHA and m.rev.SHA not in keys:
+                keys[m.rev.SHA] = __get_dependencies_key(m.rev.SHA)
+        unresolved = [m.rev.SHA for m in directs[current] if m.rev.SHA and
+                      __get_known_dependencies(keys[m.rev.SHA]) is None]
+        if unresolved:
+            pending.extend(unresolved)
+            continue
+        transitive = []
+        transitive_set = RevisionSet()
+        for m in directs[current]:
+            dependencies = __get_known_dependencies(
+                keys[m.rev.SHA])[1] if m.rev.SHA else ()
+            for merge in (tuple(TopicMerge.from_treeish(s)
+                                for s in dependencies) + (m,)):
+                if transitive_set.is_newest(merge):
+                    transitive.append(merge)
+                    transitive_set.add(merge)
+        value = (tuple(m.SHA for m in directs[current]),
+                 tuple(m.SHA for m in transitive))
+        with __dependencies_lock:
+            __dependencies[keys[current]] = value
+        shared_cache.put('gitaflow.topic.dependencies',
+                         repr(keys[current][1:]), value)
+        pending.pop()
+    return __get_known_dependencies(keys[sha])
+
+
 def get_merges_and_reverts(treeish1, treeish2, reduce=False):
     """ Returns a list of merges and reverts parse starts from treeish1 and
     ends on treeish2"""
     result = []
-    commits = commit.get_commits_between(treeish1, treeish2, True,
-                                         ['^Revert "Merge branch .*"$',
-                                          "^Merge branch .*$"])
-    for sha in commits:
+    for sha, _ in get_records_between(treeish1, treeish2):
+        if sha in not_aflow_records:
+            continue
         revert = TopicRevert.from_treeish(sha)
         if revert:
             if reduce:
@@ -50,6 +276,70 @@ def get_merges_and_reverts(treeish1, treeish2, reduce=False):
     return tuple(result)
 
 
+# Integer ids of topics and revisions RevisionSet is built of
+_topic_ids = dict()  # {topic name: id}
+_revision_ids = dict()  # {(topic id, iteration, version): id}
+_ids_lock = threading.Lock()
+
+
+class RevisionSet:
+    """ Set of topic revisions. Revisions are interned to integer ids, set
+    keeps them as bits of an int along with the latest version of every
+    topic, so membership and "is newest" tests take constant time and sets
+    are joined with bitwise or.
+    Items added and looked up are revisions or anything having one in rev
+    attribute: merges and reverts.
+    """
+    def __init__(self, items=()):
+        self.bits = 0
+        self.versions = dict()  # {topic id: latest version}
+        for item in items:
+            self.add(item)
+
+    @staticmethod
+    def _get_ids(item):
+        revision = item if isinstance(item, TopicRevision) else item.rev
+        with _ids_lock:
+            topic_id = _topic_ids.setdefault(revision.topic.name,
+                                             len(_topic_ids))
+            revision_id = _revision_ids.setdefault(
+                (topic_id, revision.iteration, revision.version),
+                len(_revision_ids))
+        return topic_id, revision_id, revision.version
+
+    def add(self, item):
+        topic_id, revision_id, version = self._get_ids(item)
+        self.bits |= 1 << revision_id
+        if self.versions.get(topic_id, 0) < version:
+            self.versions[topic_id] = version
+
+    def __contains__(self, item):
+        return bool(self.bits >> self._get_ids(item)[1] & 1)
+
+    def __or__(self, other):
+        result = RevisionSet()
+        result.bits = self.bits | other.bits
+        result.versions = dict(self.versions)
+        for topic_id, version in other.versions.items():
+            if result.versions.get(topic_id, 0) < version:
+                result.versions[topic_id] = version
+        return result
+
+    def is_newest(self, item):
+        """ True if set has no revision of the same topic with the same or
+        greater version
+        """
+        topic_id, _, version = self._get_ids(item)
+        return self.versions.get(topic_id, 0) < version
+
+    def get_latest_version(self, topic):
+        """ Returns the greatest version of topic in set, 0 if there is none
+        """
+        with _ids_lock:
+            topic_id = _topic_ids.get(topic.name)
+        return self.versions.get(topic_id, 0)
+
+
 class Topic(collections.namedtuple('TopicT', ('name',))):
     """ This class represents topic. Topic is a sequence of commits merged
     one or multiple times somewhere in history into develop, staging or master.
@@ -79,6 +369,11 @@ class Topic(collections.namedtuple('TopicT', ('name',))):
         iter_name = Iteration.get_by_treeish(treeish)
         assert iter_name
         logging.debug('Searching ' + self.name + ' in ' + str(treeish))
+        if not shared_cache.is_sha(treeish):
+            records = get_topic_index(iter_name.name, treeish).get(self.name,
+                                                                   ())
+            return [TopicMerge.from_treeish(r.SHA) for r in records
+                    if not r.is_revert]
         shas = commit.get_commits_between(
             iter_name, treeish, True,
             ["^Merge branch '([^/]+/)?" + self.name + "(_v[0-9]+)?'.*$"])
@@ -94,31 +389,37 @@ class Topic(collections.namedtuple('TopicT', ('name',))):
         master branches
         """
         iters = Iteration.get_all()
-        heads = ['master']
-        heads.extend(i.get_develop() for i in iters)
-        heads.extend(i.get_staging() for i in iters if i.has_staging())
-        logging.info('Searching ' + self.name + ' in branches ' + str(heads))
-        shas = commit.find(heads, True, ["^Merge branch '([^/]+/)?" +
-                                         self.name + "(_v[0-9]+)?'.*$"])
+        # iteration branches start on master, so their history below
+        # iteration tag is a part of master's one
+        heads = [(None, 'master')]
+        heads.extend((i.name, i.get_develop()) for i in iters)
+        heads.extend((i.name, i.get_staging()) for i in iters
+                     if i.has_staging())
+        logging.info('Searching ' + self.name + ' in branches ' +
+                     str([head for _, head in heads]))
+        shas = []
+        for start, head in heads:
+            for record in reversed(get_topic_index(start, head).get(self.name,
+                                                                    ())):
+                if not record.is_revert and record.SHA not in shas and (
+                        MASTER_NAME == record.target or
+                        Iteration.is_develop(record.target) or
+                        Iteration.is_staging(record.target)):
+                    shas.append(record.SHA)
+        # newer first, as git rev-list lists them: get_latest_merge takes the
+        # first one of merges of the same version
+        shas = misc.sort(shas, by_date=True) if len(shas) > 1 else shas
         logging.debug('Found: ' + ', '.join(shas))
-        result = []
-        for sha in shas:
-            m = TopicMerge.from_treeish(sha)
-            if (m and (m.rev.topic == self) and (
-                    MASTER_NAME == m.merge_target or
-                    Iteration.is_develop(m.merge_target) or
-                    Iteration.is_staging(m.merge_target))):
-                result.append(m)
+        result = [TopicMerge.from_treeish(sha) for sha in shas]
         logging.debug('After checks: ' + str(result))
         return result
 
-    branch_name_regexp = None
+    # regexps are compiled in advance, so parsing is safe to do from
+    # multiple threads
+    branch_name_regexp = re.compile('^(?:[^/]+/)?.+?(?:_v(\d+))?$')
 
     @classmethod
     def is_valid_tb_name(cls, branch_name):
-        if cls.branch_name_regexp is None:
-            cls.branch_name_regexp = re.compile(
-                '^(?:[^/]+/)?.+?(?:_v(\d+))?$')
         result = cls.branch_name_regexp.search(branch_name)
         if result:
             groups = result.groups()[0]
@@ -203,8 +504,11 @@ class TopicRevision(collections.namedtuple('TopicRevisionT', (
         return not self.__eq__(other)
 
     def get_own_effective_merges(self, recursive=False):
-        if self.SHA:
-            return TopicMerge.get_effective_merges_in(self.SHA, recursive)
+        if self.SHA and recursive:
+            return tuple(TopicMerge.from_treeish(sha)
+                         for sha in get_dependencies(self.SHA)[1])
+        elif self.SHA:
+            return TopicMerge.get_effective_merges_in(self.SHA)
         else:
             logging.critical('Searching for merges it topic w/o Topic.SHA')
             return None
@@ -228,9 +532,8 @@ class TopicRevision(collections.namedtuple('TopicRevisionT', (
         Returns None if conflict happened, TopicMerge otherwise.
         Raises MergeNonConflictError for other errors
         """
-        commits = commit.get_commits_between(
-            Iteration.get_current().name, commit.get_current_sha(), False,
-            ['^Revert "Merge branch .*"$', "^Merge branch .*$"])
+        records = get_records_between(Iteration.get_current().name,
+                                      commit.get_current_sha())
 
         # Before merging new revision we should merge revisions that:
         #  - are revisions of self.topic
@@ -240,8 +543,10 @@ class TopicRevision(collections.namedtuple('TopicRevisionT', (
         reverts = []  # one revert object for each revision of self.topic that
                       # was ever reverted
         last_effect_m = None
-        for sha in commits:
-            if commit.get_headline(sha).startswith('Revert'):
+        for sha, is_revert in reversed(records):
+            if sha in not_aflow_records:
+                continue
+            if is_revert:
                 revert = TopicRevert.from_treeish(sha)
                 if (revert and revert.rev.topic == self.topic and
                         not revert.rev.is_in_reverts(reverts)):
@@ -313,7 +618,7 @@ class TopicRevision(collections.namedtuple('TopicRevisionT', (
                 return False
         return True
 
-    branch_name_regexp = None
+    branch_name_regexp = re.compile('^(?:([^/]+)/)?(.+?)(?:_v(\d+))?$')
 
     @classmethod
     def from_branch_name(cls, branch_name, sha=None, default_iteration=None):
@@ -324,9 +629,6 @@ class TopicRevision(collections.namedtuple('TopicRevisionT', (
     @classmethod
     def parse_branch_name(cls, branch_name):
         """Returns (name, version, iteration)"""
-        if cls.branch_name_regexp is None:
-            cls.branch_name_regexp = re.compile(
-                '^(?:([^/]+)/)?(.+?)(?:_v(\d+))?$')
         result = cls.branch_name_regexp.search(branch_name)
         logging.debug('Parsing branch name ' + branch_name + ' result: ' +
                       (str(result.groups()) if result else ' failed'))
@@ -375,38 +677,38 @@ class TopicMerge(collections.namedtuple(
                 return False
         return True
 
-    headline_regexp = None
+    headline_regexp = re.compile(
+        "^Merge branch '((?:[^/]*/)?.*)'(?: into ([^/]*/.*))?$")
 
     @classmethod
-    def parse_headline(cls, headline):
-        if cls.headline_regexp is None:
-            cls.headline_regexp = re.compile(
-                "^Merge branch '((?:[^/]*/)?.*)'(?: into ([^/]*/.*))?$")
+    def parse_headline(cls, headline, warn=True):
+        """Returns (branch name, merge target). Both are None if headline
+        isn't a merge headline"""
         # if branch is merged into master headline doesn't contain "into.." part
         re_result = cls.headline_regexp.search(headline)
         if not re_result:
             re_result = re.search("^Merge branch '((?:[^/]*/)?.*)' into (.*)?$",
                                   headline)
             if not re_result:
-                logging.warning('Failed to parse merge headline: ' + headline)
-                return None, None, None, None
-            else:
+                if warn:
+                    logging.warning('Failed to parse merge headline: ' +
+                                    headline)
+                return None, None
+            elif warn:
                 logging.warning('Warning: incorrect branch name: ' +
                                 re_result.groups()[1] +
                                 '. Which iteration does this branch belong to?')
         branch_name, target = re_result.groups()
         return branch_name, target if target else 'master'
 
-    message_regexp = None
+    message_regexp = re.compile(
+        '\A(^.+?$)(?:[\r\n]+^({}|{}|{})$)?(?:[\r\n]+(^.*?))?\Z'.format(
+            DEV_NAME, FIX_NAME, EUF_NAME),
+        re.MULTILINE | re.DOTALL)
 
     @classmethod
     def parse_message(cls, message):
         """Returns (headline, type, description)"""
-        if not cls.message_regexp:
-            cls.message_regexp = re.compile(
-                '\A(^.+?$)(?:[\r\n]+^({}|{}|{})$)?(?:[\r\n]+(^.*?))?\Z'.format(
-                    DEV_NAME, FIX_NAME, EUF_NAME),
-                re.MULTILINE | re.DOTALL)
         result = cls.message_regexp.search(message)
         if result:
             headline, type_, d = result.groups()
@@ -419,10 +721,15 @@ class TopicMerge(collections.namedtuple(
     @classmethod
     @cache('branches', 'tags')
     def from_treeish(cls, treeish):
-        headline, type_, d = cls.parse_message(commit.get_full_message(treeish))
-        if not headline:
+        if treeish in not_aflow_records:
+            return None
+        message = commit.get_full_message(treeish)
+        headline, type_, d = cls.parse_message(message)
+        branch_name, target = (cls.parse_headline(headline) if headline
+                               else (None, None))
+        if not branch_name:
+            _remember_if_not_record(treeish, message)
             return None
-        branch_name, target = cls.parse_headline(headline)
         default_i = Iteration.from_branch_name(target) if target else None
         if not default_i:
             default_i = Iteration.get_by_treeish(treeish)
@@ -437,18 +744,18 @@ class TopicMerge(collections.namedtuple(
         """ Returns all (including reverted) in BP..treeish"""
         iteration = Iteration.get_by_treeish(treeish)
         assert iteration
-        shas = commit.get_commits_between(iteration.name, treeish, True,
-                                          ["^Merge branch .*$"])
-        return tuple(m for m in (cls.from_treeish(sha) for sha in shas) if m)
+        records = get_records_between(iteration.name, treeish)
+        return tuple(m for m in (cls.from_treeish(sha)
+                                 for sha, is_revert in records
+                                 if not is_revert) if m)
 
     @staticmethod
     def get_reverted_merges_in(treeish, original_only=False):
         result = []
         iteration = Iteration.get_by_treeish(treeish)
         assert iteration
-        commits = commit.get_commits_between(iteration.name, treeish, False,
-                                             ['^Revert "Merge branch .*"$'])
-        for sha in commits:
+        records = get_records_between(iteration.name, treeish)
+        for sha in (sha for sha, is_revert in reversed(records) if is_revert):
             revert = TopicRevert.from_treeish(sha)
             if revert:
                 merge = revert.get_reverted_merge()
@@ -469,12 +776,30 @@ class TopicMerge(collections.namedtuple(
         if not treeish1:
             treeish1 = Iteration.get_by_treeish(treeish2).name
         assert treeish1
-        result = []
-        commits = commit.get_commits_between(treeish1, treeish2, True,
-                                             ['^Revert "Merge branch .*"$',
-                                              "^Merge branch .*$"])
-        for sha in commits:
-            if commit.get_headline(sha).startswith('Revert "Merge'):
+        result, position = cls._get_checkpoint_before(treeish1, treeish2)
+        cls._reduce(result, position, treeish2)
+
+        if recursive:
+            recursive_result = []
+            recursive_set = RevisionSet()
+            for m in result:
+                for merge2 in m.rev.get_own_effective_merges(True) + (m,):
+                    if recursive_set.is_newest(merge2):
+                        recursive_result.append(merge2)
+                        recursive_set.add(merge2)
+            return tuple(recursive_result)
+        else:
+            return tuple(result)
+
+    @classmethod
+    def _reduce(cls, result, treeish1, treeish2):
+        """ Updates list of effective merges result with merges and reverts
+        in treeish1..treeish2
+        """
+        for sha, is_revert in get_records_between(treeish1, treeish2):
+            if sha in not_aflow_records:
+                continue
+            if is_revert:
                 revert = TopicRevert.from_treeish(sha)
                 if revert:
                     for merge in reversed(result):
@@ -485,22 +810,63 @@ class TopicMerge(collections.namedtuple(
                                           ' Removing ' + str(merge))
                             break
             else:
-                merge = TopicMerge.from_treeish(sha)
+                merge = cls.from_treeish(sha)
                 if merge:
                     result.append(merge)
                     logging.debug('Searching for topics in ' +
                                   treeish1 + '..' + treeish2 +
                                   ' Adding ' + str(merge))
 
-        if recursive:
-            recursive_result = []
-            for m in result:
-                for merge2 in m.rev.get_own_effective_merges(True) + (m,):
-                    if merge2.is_newest_in(recursive_result):
-                        recursive_result.append(merge2)
-            return tuple(recursive_result)
+    @classmethod
+    def _get_checkpoint(cls, start, position, shas, name):
+        """ Returns SHAs of merges effective in start..name, where name is an
+        iteration tag. shas are the ones effective in start..position.
+        """
+        sha = misc.rev_parse(name)
+        key = (repo.get_git_dir(), start, sha)
+        with _checkpoints_lock:
+            if key in _checkpoints:
+                return _checkpoints[key]
+        found, value = shared_cache.get('gitaflow.topic.checkpoints',
+                                        repr((start, sha)))
+        if not found:
+            merges = [cls.from_treeish(s) for s in shas]
+            cls._reduce(merges, position, name)
+            value = tuple(m.SHA for m in merges)
+            shared_cache.put('gitaflow.topic.checkpoints', repr((start, sha)),
+                             value)
+        with _checkpoints_lock:
+            _checkpoints[key] = value
+        return value
+
+    @classmethod
+    def _get_checkpoint_before(cls, treeish1, treeish2):
+        """ Returns (merges, treeish) where merges are effective in
+        treeish1..treeish and treeish is the latest iteration tag on
+        first-parent path from treeish1 to treeish2, treeish1 if there is none.
+        So queries starting from early iterations only search history of the
+        last one.
+        """
+        iterations = [i.name for i in Iteration.get_all(True)]
+        if treeish2 in iterations:
+            last = treeish2
         else:
-            return tuple(result)
+            last = Iteration.get_by_treeish(treeish2)
+            last = last.name if last else None
+        if (treeish1 not in iterations or last not in iterations or
+                iterations.index(last) <= iterations.index(treeish1)):
+            return [], treeish1
+        start = misc.rev_parse(treeish1)
+        position, shas = treeish1, ()
+        for name in iterations[iterations.index(treeish1) + 1:
+                               iterations.index(last) + 1]:
+            # skip iterations which aren't on the path, if there are any
+            if commit.is_based_on(position, name):
+                shas = cls._get_checkpoint(start, position, shas, name)
+                position = name
+        if position != treeish2 and not commit.is_based_on(position, treeish2):
+            return [], treeish1
+        return [cls.from_treeish(sha) for sha in shas], position
 
     def merge(self, set_description=None, set_type=None):
         return self.rev.merge(
@@ -546,10 +912,22 @@ class TopicMerge(collections.namedtuple(
             raise IncompleteMergeObjectError(
                 'Unable to find iteration of merge ' + str(self))
 
-        for sha in commit.get_commits_between(
+        # merge is usually in history of iteration branch, merges made before
+        # it are taken from the index then
+        heads = [ci.get_develop()] + ([ci.get_staging()]
+                                      if ci.has_staging() else [])
+        for head in heads:
+            shas = [r.SHA for r in get_topic_index(ci.name, head).get(
+                self.rev.topic.name, ()) if not r.is_revert]
+            if self.SHA in shas:
+                shas = shas[:shas.index(self.SHA) + 1]
+                break
+        else:
+            shas = commit.get_commits_between(
                 ci.name, self.SHA, True, ["^Merge branch '([^/]+/)?" +
                                           self.rev.topic.name +
-                                          "(_v[0-9]+)?'.*$"]):
+                                          "(_v[0-9]+)?'.*$"])
+        for sha in shas:
             merge = self.__class__.from_treeish(sha)
             if merge and merge.rev == self.rev and merge.rev.SHA:
                 return merge
@@ -586,10 +964,15 @@ class TopicRevert(collections.namedtuple('TopicRevertT', (
     @classmethod
     @cache('branches', 'tags')
     def from_treeish(cls, treeish):
-        headline, sha = cls.parse_message(commit.get_full_message(treeish))
-        if not headline:
+        if treeish in not_aflow_records:
+            return None
+        message = commit.get_full_message(treeish)
+        headline, sha = cls.parse_message(message)
+        branch_name, target = (TopicMerge.parse_headline(headline) if headline
+                               else (None, None))
+        if not branch_name:
+            _remember_if_not_record(treeish, message)
             return None
-        branch_name, target = TopicMerge.parse_headline(headline)
         return TopicRevert(
             TopicRevision.from_branch_name(
                 branch_name,
@@ -598,7 +981,8 @@ class TopicRevert(collections.namedtuple('TopicRevertT', (
             target,
             sha)
 
-    message_regexp = None
+    message_regexp = re.compile(
+        '\ARevert "(.*?)"[\n\r]+This reverts commit (.*?)[.,].*', re.DOTALL)
 
     @classmethod
     def parse_message(cls, message):
@@ -606,10 +990,6 @@ class TopicRevert(collections.namedtuple('TopicRevertT', (
         info
         TODO: it's also possible to found commit revert was made relative to
         """
-        if cls.message_regexp is None:
-            cls.message_regexp = re.compile(
-                '\ARevert "(.*?)"[\n\r]+This reverts commit (.*?)[.,].*',
-                re.DOTALL)
         result = cls.message_regexp.search(message)
         if result:
             return result.groups()
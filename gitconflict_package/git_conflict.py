@@ -13,6 +13,7 @@ import itertools
 from sys import argv
 
 from thingitwrapper.cached import misc
+from thingitwrapper.shared_cache import persistent
 
 
 def _hunk_to_scope(hunk):
@@ -23,6 +24,7 @@ def _hunk_to_scope(hunk):
         return int(hunk[2]), 1
 
 
+@persistent(0, 1)
 def _get_scopes(base, head, file):
     diff = misc.get_diff(base, head, files=[file],
                          working_dir=misc.get_root_dir())
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""Measures pure-Python cost of aflow queries on a large synthetic history.
+History is kept in memory by thingitwrapper.memory, so no git process is run
+and timings show costs of algorithms themselves. Run:
+    PYTHONPATH=../thingitwrapper_package:../gitaflow_package \\
+        python3 bench_aflow.py [commits] [topics per iteration]
+History consists of iterations, topics of each iteration have several
+commits and are merged into develop, every tenth topic gets second version
+and every seventh merge is reverted. Surviving topics are merged into
+master before next iteration starts.
+Every run starts cold: caches are invalidated, which drops indexes and
+first-parent chains too, and shared cache is disabled. The first run is
+reported along with the best one.
+"""
+
+import logging
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+from thingitwrapper import aux, backend, memory, grouped_cache, shared_cache
+from gitaflow import common, revert
+from gitaflow.iteration import Iteration
+from gitaflow.topic import Topic, TopicMerge
+
+
+def build(commits, topics):
+    """Returns MemoryBackend with history of about commits commits"""
+    history = memory.MemoryBackend()
+    history.commit('Initial commit')
+    iterations = max(1, commits // (topics * 50))
+    topic_commits = max(1, commits // (iterations * topics) - 3)
+    for i in range(iterations):
+        iteration = 'iter' + str(i)
+        develop = iteration + '/develop'
+        history.set_tag(iteration, 'master')
+        history.set_branch(develop, 'master')
+        survived = []
+        for t in range(topics):
+            name = iteration + '/topic' + str(t)
+            history.set_branch(name, iteration)
+            for c in range(topic_commits):
+                history.commit(name + ' commit ' + str(c), branch=name)
+            merge = history.merge(name, "Merge branch '" + name + "' into " +
+                                  develop + '\n\nDEV', develop)
+            if t % 7 == 3:
+                history.commit('Revert "Merge branch \'' + name + "' into " +
+                               develop + '"\n\nThis reverts commit ' + merge +
+                               ', reversing\nchanges.', branch=develop)
+                continue
+            if t % 10 == 5:
+                history.set_branch(name + '_v2', name)
+                history.commit(name + '_v2 commit', branch=name + '_v2')
+                name += '_v2'
+                history.merge(name, "Merge branch '" + name + "' into " +
+                              develop + '\n\nFIX', develop)
+            survived.append(name)
+        for name in survived:
+            history.merge(name, "Merge branch '" + name + "'\n\nDEV", 'master')
+    return history
+
+
+def measure(title, function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        grouped_cache.invalidate(dont_print_info=True)
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    print('{:<40}{:>10.3f} s first{:>10.3f} s best'.format(title, times[0],
+                                                           min(times)))
+
+
+if __name__ == '__main__':
+    commits = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    topics = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    logging.basicConfig(level=logging.ERROR)
+    # values persisted by the first run would answer the others
+    shared_cache.enabled = False
+    with TemporaryDirectory() as path:
+        # fake git dir, so repository is told apart from others
+        for directory in 'objects', 'refs':
+            os.makedirs(os.path.join(path, '.git', directory))
+        with open(os.path.join(path, '.git', 'HEAD'), 'w') as head:
+            head.write('ref: refs/heads/master\n')
+        with aux.working_dir(path):
+            start = time.perf_counter()
+            history = build(commits, topics)
+            print('Built {} commits in {:.3f} s'.format(
+                len(history.commits), time.perf_counter() - start))
+            backend.use(history)
+            last = Iteration.get_last()
+            develop = last.get_develop()
+            topic = Topic('topic' + str(topics // 2))
+            measure('Iteration.get_all(sort=True)',
+                    lambda: Iteration.get_all(True))
+            measure('TopicMerge.get_all_merges_in(develop)',
+                    lambda: TopicMerge.get_all_merges_in(develop))
+            measure('TopicMerge.get_effective_merges_in',
+                    lambda: TopicMerge.get_effective_merges_in(develop))
+            measure('Topic.get_all_merges', topic.get_all_merges)
+            measure('common.consistency_check',
+                    lambda: common.consistency_check(('master', develop)))
+
+            def dependents():
+                merges = TopicMerge.get_effective_merges_in(develop)
+                for merge in merges:
+                    revert.find_dependent_topic_merges(merge, merges)
+            measure('revert.find_dependent_topic_merges', dependents)
+            backend.use(None)
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+"""Measures per-call cost of running git through thingitwrapper.aux with and
+without fast spawn mode. Run from a git repository:
+    PYTHONPATH=../thingitwrapper_package python3 bench_spawn.py [calls] [rounds]
+Modes are measured in interleaved rounds, so noise affects both of them.
+Fast spawn only changes how read-only commands are run, both measured
+commands are such.
+"""
+
+import sys
+import time
+
+from thingitwrapper import aux
+
+
+def measure(calls):
+    start = time.time()
+    for _ in range(calls):
+        aux.get_output(['git', 'rev-parse', 'HEAD'])
+        aux.check_01(['git', 'show-ref', '--verify', '-q', 'refs/heads/x'])
+    return (time.time() - start) / calls / 2
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    results = {}
+    for fast in (False, True) * rounds:  # interleave to even out noise
+        aux.fast_spawn = fast
+        results.setdefault(fast, []).append(measure(calls))
+    # medians, minimums are decided by a single lucky round
+    default, fast = (sorted(results[mode])[rounds // 2]
+                     for mode in (False, True))
+    print('default:    %.3f ms per call' % (default * 1000))
+    print('fast spawn: %.3f ms per call' % (fast * 1000))
+    print('saving:     %.3f ms (%.1f%%)' % ((default - fast) * 1000,
+                                            (default - fast) / default * 100))
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import threading
+import time
+import unittest
+
+from thingitwrapper import aux, cassette, trace
+from thingitwrapper.grouped_cache import cache
+
+# aux_async uses async/await of Python 3.5
+if sys.version_info >= (3, 5):
+    import asyncio
+    from thingitwrapper import aux_async
+
+
+class AuxTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory(prefix=self.id() + '_')
+        self.path = self.temp_dir.name
+        with aux.working_dir(self.path):
+            aux.call(['git', 'init'])
+            for message in 'first', 'second':
+                aux.call(['git', 'commit', '--allow-empty', '-m', message])
+            self.head = aux.get_output(['git', 'rev-parse', 'HEAD'])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+
+def run_concurrently(*coroutines):
+    """Returns results of coroutines run at once by a new event loop"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(asyncio.gather(*coroutines))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'aux_async needs Python 3.5+')
+class AsyncTests(AuxTest):
+    def run_in_repo(self, *coroutines):
+        with aux.working_dir(self.path):
+            return run_concurrently(*coroutines)
+
+    def test_gather(self):
+        head, subject, missing, is_ancestor, is_not, (output, code) = \
+            self.run_in_repo(
+                aux_async.get_output(['git', 'rev-parse', 'HEAD']),
+                aux_async.get_output(['git', 'log', '-n1', '--format=%s']),
+                aux_async.get_output_01(['git', 'rev-parse', '-q', '--verify',
+                                         'HEAD~5']),
+                aux_async.check_01(['git', 'merge-base', '--is-ancestor',
+                                    'HEAD~1', 'HEAD']),
+                aux_async.check_01(['git', 'merge-base', '--is-ancestor',
+                                    'HEAD', 'HEAD~1']),
+                aux_async.get_output_and_exit_code(['git', 'rev-parse',
+                                                    'missing']))
+        self.assertEqual((head, subject, missing, is_ancestor, is_not, code),
+                         (self.head, 'second', None, True, False, 128))
+        self.assertIn('missing', output)
+
+    def test_errors(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_in_repo(aux_async.get_output(['git', 'rev-parse', 'x']))
+        with self.assertRaises(aux.GitUnexpectedError):
+            self.run_in_repo(aux_async.check_01(['git', 'rev-parse', 'x']))
+
+
+class RunManyTests(AuxTest):
+    def test_order_and_codes(self):
+        commands = [['git', 'rev-parse', 'HEAD~' + str(i)] for i in range(3)]
+        with aux.working_dir(self.path):
+            batch = aux.run_many(commands, max_workers=2)
+            self.assertEqual(batch.results[0], (self.head, 0))
+            self.assertEqual(batch.results[1][0],
+                             aux.get_output(['git', 'rev-parse', 'HEAD~1']))
+            self.assertEqual(batch.results[2][1], 128)
+            self.assertGreaterEqual(batch.busy_time, 0)
+            self.assertEqual(aux.check_01_many(
+                ['git', 'merge-base', '--is-ancestor', a, b]
+                for a, b in (('HEAD~1', 'HEAD'), ('HEAD', 'HEAD~1'))),
+                [True, False])
+            with self.assertRaises(aux.GitUnexpectedError):
+                aux.check_01_many([['git', 'rev-parse', 'missing']])
+        self.assertEqual(aux.run_many([]).results, [])
+
+
+class BytesOutputTests(AuxTest):
+    def test_bytes_and_lines(self):
+        with aux.working_dir(self.path):
+            log = ['git', 'log', '--format=%s']
+            self.assertEqual(aux.get_output_bytes(log), b'second\nfirst\n')
+            self.assertEqual(list(aux.iter_lines(log)), [b'second', b'first'])
+            self.assertEqual(list(aux.iter_lines(log + ['-z'], b'\0',
+                                                 'ascii')),
+                             ['second', 'first'])
+            old_size, aux.CHUNK_SIZE = aux.CHUNK_SIZE, 3
+            try:
+                self.assertEqual(list(aux.iter_lines(log, encoding='ascii')),
+                                 ['second', 'first'])
+            finally:
+                aux.CHUNK_SIZE = old_size
+            lines = aux.iter_lines(['git', 'rev-list', 'HEAD'])
+            self.assertEqual(next(lines), self.head.encode())
+            lines.close()
+
+    def test_stderr_is_separate(self):
+        with aux.working_dir(self.path):
+            with self.assertRaisesRegex(aux.GitUnexpectedError, 'missing'):
+                aux.get_output_bytes(['git', 'rev-parse', 'missing'])
+            with self.assertRaisesRegex(aux.GitUnexpectedError, 'missing'):
+                list(aux.iter_lines(['git', 'rev-list', 'missing']))
+
+
+class FastSpawnTests(AuxTest):
+    def setUp(self):
+        super().setUp()
+        aux.fast_spawn = True
+
+    def tearDown(self):
+        aux.fast_spawn = False
+        super().tearDown()
+
+    def test_environment(self):
+        os.environ['AFLOW_TEST_UNRELATED'] = '1'
+        try:
+            command, p_args = aux._prepare(['git', 'rev-parse', 'HEAD'], {})
+        finally:
+            del os.environ['AFLOW_TEST_UNRELATED']
+        self.assertTrue(os.path.isabs(command[0]))
+        self.assertEqual(command[-2:], ['rev-parse', 'HEAD'])
+        self.assertFalse(p_args['close_fds'])
+        self.assertEqual(p_args['env']['LC_ALL'], 'C')
+        self.assertEqual(p_args['env']['GIT_OPTIONAL_LOCKS'], '0')
+        self.assertNotIn('AFLOW_TEST_UNRELATED', p_args['env'])
+        self.assertEqual(aux._prepare(['git'], {'env': {}})[1]['env'], {})
+        # commands changing repository get the whole environment
+        command, p_args = aux._prepare(['git', 'commit', '-m', 'x'], {})
+        self.assertTrue(os.path.isabs(command[0]))
+        self.assertNotIn('env', p_args)
+
+    def test_commands(self):
+        with aux.working_dir(self.path):
+            self.assertEqual(aux.get_output(['git', 'rev-parse', 'HEAD']),
+                             self.head)
+            self.assertFalse(aux.check_01(['git', 'merge-base',
+                                           '--is-ancestor', 'HEAD', 'HEAD~1']))
+
+
+class CoalescingTests(AuxTest):
+    def test_same_command_runs_once(self):
+        spawned = []
+        check_output = subprocess.check_output
+
+        def slow_check_output(*args, **kwargs):
+            spawned.append(args[0])
+            time.sleep(0.2)
+            return check_output(*args, **kwargs)
+
+        barrier = threading.Barrier(4)
+        results = []
+
+        def query():
+            barrier.wait()
+            with aux.working_dir(self.path):
+                results.append(aux.get_output(['git', 'rev-parse', 'HEAD']))
+
+        coalesced = aux.coalesce_stats['coalesced']
+        subprocess.check_output = slow_check_output
+        try:
+            threads = [threading.Thread(target=query) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            subprocess.check_output = check_output
+        self.assertEqual(results, [self.head] * 4)
+        self.assertEqual(len(spawned), 1)
+        self.assertEqual(aux.coalesce_stats['coalesced'] - coalesced, 3)
+
+
+@cache()
+def cached_head():
+    return aux.get_output(['git', 'rev-parse', 'HEAD'])
+
+
+class TraceTests(AuxTest):
+    def test_trace(self):
+        trace_path = os.path.join(self.path, 'trace.json')
+        trace.enable(trace_path)
+        try:
+            with aux.working_dir(self.path):
+                cached_head()
+                cached_head()
+                aux.get_exit_code(['git', 'rev-parse', 'missing'])
+        finally:
+            trace.disable()
+        with open(trace_path) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([r['type'] for r in records],
+                         ['call', 'cache_hit', 'call'])
+        call, hit, failed = records
+        self.assertEqual(call['argv'], ['git', 'rev-parse', 'HEAD'])
+        self.assertEqual(call['cwd'], self.path)
+        self.assertEqual((call['exit_code'], call['output_size']), (0, 40))
+        self.assertEqual(call['caller'], 'test_aux.cached_head')
+        self.assertEqual(hit['function'], 'test_aux.cached_head')
+        self.assertEqual(hit['caller'], 'test_aux.TraceTests.test_trace')
+        self.assertEqual(failed['exit_code'], 128)
+        self.assertIsNone(failed['output_size'])
+
+        summary = io.StringIO()
+        trace.print_summary(summary)
+        self.assertRegex(summary.getvalue(), 'rev-parse +[0-9]+ ')
+
+
+class CassetteTests(AuxTest):
+    def calls(self):
+        def error_of(command):
+            try:
+                aux.get_output(command)
+            except Exception as error:
+                return type(error).__name__
+
+        with aux.working_dir(self.path):
+            return [
+                aux.get_output(['git', 'rev-parse', 'HEAD']),
+                aux.get_output_01(['git', 'rev-parse', '-q', '--verify',
+                                   'HEAD~5']),
+                aux.check_01(['git', 'merge-base', '--is-ancestor', 'HEAD~1',
+                              'HEAD']),
+                aux.get_output_and_exit_code(['git', 'rev-parse', 'x']),
+                aux.get_output_bytes(['git', 'log', '--format=%s']),
+                list(aux.iter_lines(['git', 'log', '--format=%s'],
+                                    encoding='utf-8')),
+                aux.run_many([['git', 'rev-parse', 'HEAD~1']]).results,
+                error_of(['git', 'rev-parse', 'x'])] + (
+                run_concurrently(aux_async.get_output(
+                    ['git', 'log', '-n1', '--format=%s']))
+                if sys.version_info >= (3, 5) else [])
+
+    def test_record_and_replay(self):
+        path = os.path.join(self.path, 'calls.json.gz')
+        cassette.record(path)
+        try:
+            recorded = self.calls()
+        finally:
+            cassette.stop()
+        shutil.rmtree(os.path.join(self.path, '.git'))  # no git to ask
+        cassette.replay(path)
+        try:
+            self.assertEqual(self.calls(), recorded)
+            with aux.working_dir(self.path):
+                self.assertRaises(cassette.CassetteMiss, aux.get_output,
+                                  ['git', 'status'])
+        finally:
+            cassette.stop()
+        self.assertEqual(recorded[0], self.head)
+
+
+if __name__ == '__main__':
+    unittest.main(module='test_aux')
@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from thingitwrapper import aux, backend, firstparent, memory, pure, trace
+from thingitwrapper.cached import commit
+
+
+class RepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory(prefix=self.id() + '_')
+        self.path = self.temp_dir.name
+        self.working_dir = aux.working_dir(self.path)
+        self.working_dir.__enter__()
+        self.git('init')
+        self.git('checkout', '-b', 'master')
+        self.git('commit', '--allow-empty', '-m', 'first\n\nbody')
+        self.git('tag', 'light')
+        self.git('tag', '-a', '-m', 'annotated', 'annotated')
+        self.git('checkout', '-b', 'side/topic')
+        self.git('commit', '--allow-empty', '-m',
+                 '  \nmulti line\n  subject  \n\nbody\n')
+        self.git('checkout', 'master')
+        self.git('commit', '--allow-empty', '-m', 'third')
+        self.git('merge', '--no-ff', '--no-edit', 'side/topic')
+        self.head = self.git('rev-parse', 'HEAD')
+
+    def tearDown(self):
+        self.working_dir.__exit__(None, None, None)
+        self.temp_dir.cleanup()
+
+    def git(self, *args):
+        return aux.get_output(['git'] + list(args))
+
+
+class BackendTest(RepositoryTest):
+    def answers(self, instance):
+        treeishes = ['HEAD', 'master', 'side/topic', 'light', 'annotated',
+                     'HEAD^', 'HEAD^2', 'HEAD~2', 'HEAD^^', 'annotated^{}',
+                     'master~1^0', 'annotated^{commit}', 'side/topic~1',
+                     self.head[:7], self.head[:5]]
+        return ([instance.rev_parse(t) for t in treeishes] +
+                [instance.headline(t) for t in treeishes] +
+                [instance.full_message(t) for t in treeishes] +
+                [instance.parents(t) for t in treeishes] +
+                [instance.parent(t, n) for t in treeishes for n in (0, 1, 2)] +
+                [instance.branch_list(), instance.branch_list(['side/*']),
+                 instance.branch_exists('master'),
+                 instance.branches_exist(['side', 'side/topic']),
+                 instance.branch_sha('side/topic'), instance.current_branch(),
+                 instance.tag_list(), instance.tag_list('a*'),
+                 instance.tag_exists('light'), instance.tag_exists('x'),
+                 instance.tag_sha('annotated'),
+                 instance.tags_pointing_at('HEAD~2'),
+                 instance.rev_parse_many(t for t in treeishes),
+                 instance.check_ref_format('refs/heads/a..b'),
+                 instance.check_ref_format_many(
+                     'refs/heads/' + name for name in
+                     ('a/b', '.a', 'a.lock/b', 'a b', 'a@{', '@', 'a//b',
+                      'a.', 'ü'))])
+
+    def check_same_answers(self):
+        expected = self.answers(backend.SubprocessBackend(None))
+        python = pure.PythonBackend(os.path.join(self.path, '.git'))
+        trace.collect()
+        calls = sum(c for c, _ in trace.summary.values())
+        try:
+            self.assertEqual(self.answers(python), expected)
+        finally:
+            trace.disable()
+        self.assertEqual(sum(c for c, _ in trace.summary.values()), calls,
+                         'Python backend called git: ' + str(trace.summary))
+
+    def test_loose(self):
+        self.check_same_answers()
+
+    def test_packed(self):
+        self.git('gc', '--aggressive', '--prune=now')
+        self.assertFalse(os.path.exists(os.path.join(
+            self.path, '.git', 'refs', 'heads', 'master')))
+        self.check_same_answers()
+
+    def test_detached_and_fallback(self):
+        self.git('checkout', '--detach', 'HEAD~1')
+        python = pure.PythonBackend(os.path.join(self.path, '.git'))
+        self.assertIsNone(python.current_branch())
+        # syntax pure backend doesn't know is passed to git
+        self.assertEqual(python.rev_parse('master@{0}'),
+                         self.git('rev-parse', 'master'))
+        self.assertIsNone(python.parent('HEAD', 2))
+        # keyword arguments are passed to git along with the rest
+        self.assertEqual(python.sort(['side/topic', 'HEAD'], reverse=True),
+                         backend.SubprocessBackend(None).sort(
+                             ['side/topic', 'HEAD'], reverse=True))
+        self.assertEqual(python.find(['master'], first_parent=True),
+                         self.git('rev-list', '--first-parent',
+                                  'master').split())
+
+    def walks(self, instance):
+        treeishes = ('master', 'master~1', 'side/topic', 'light', 'o1', 'o2',
+                     'annotated', 'octopus', 'octopus^3')
+        pairs = [(a, d) for a in treeishes for d in treeishes]
+        return [(instance.is_ancestor(a, d),
+                 list(instance.first_parent_walk(a, d)),
+                 instance.commits_between(a, d),
+                 instance.commits_between(a, d, True, ['^o', '^M']),
+                 instance.merge_base([a, d]))
+                for a, d in pairs] + instance.is_ancestor_many(pairs) + [
+            (instance.find([d]), instance.find([d, 'side/topic'], True),
+             instance.find([d], regexps=['^o', '^M']),
+             instance.find([d], regexps=['^M', 'o1'], match_all=True))
+            for d in treeishes] + [
+            instance.sort(['light', 'master', 'master~1', 'annotated',
+                           'light'], by_date, reverse)
+            for by_date in (False, True) for reverse in (False, True)]
+
+    def check_same_walks(self):
+        expected = self.walks(backend.SubprocessBackend(None))
+        python = pure.PythonBackend(os.path.join(self.path, '.git'))
+        self.assertIsNotNone(python.graph)
+        trace.collect()
+        calls = sum(c for c, _ in trace.summary.values())
+        try:
+            self.assertEqual(self.walks(python), expected)
+        finally:
+            trace.disable()
+        self.assertEqual(sum(c for c, _ in trace.summary.values()), calls,
+                         'Python backend called git: ' + str(trace.summary))
+
+    def test_commit_graph(self):
+        for name in 'o1', 'o2':
+            self.git('checkout', '-b', name, 'master~1')
+            self.git('commit', '--allow-empty', '-m', name)
+        self.git('checkout', 'master')
+        self.git('merge', '--no-ff', '--no-edit', 'o1', 'o2')
+        self.git('tag', 'octopus')
+        self.git('commit-graph', 'write', '--reachable')
+        self.check_same_walks()
+        # commits commit-graph doesn't have
+        self.git('commit', '--allow-empty', '-m', 'after graph')
+        self.git('merge', '--no-ff', '--no-edit', 'side/topic~0', '-s',
+                 'ours')
+        self.check_same_walks()
+        self.git('commit-graph', 'write', '--reachable', '--split')
+        self.git('commit', '--allow-empty', '-m', 'after split')
+        self.git('commit-graph', 'write', '--reachable', '--split',
+                 '--size-multiple=1000')
+        self.assertTrue(os.path.exists(os.path.join(
+            self.path, '.git', 'objects', 'info', 'commit-graphs',
+            'commit-graph-chain')))
+        self.check_same_walks()
+
+    def test_first_parent(self):
+        self.git('checkout', '-b', 'second', 'side/topic')
+        for message in 'a', 'b', 'c':
+            self.git('commit', '--allow-empty', '-m', message)
+        self.git('checkout', 'master')
+        self.git('merge', '--no-ff', '--no-edit', 'second~1')
+        treeishes = ('master', 'master~1', 'master~2', 'master^2', 'second',
+                     'second~2', 'side/topic', 'light')
+        pairs = [(a, d) for a in treeishes for d in treeishes]
+        expected = [commit.is_based_on(a, d) for a, d in pairs]
+        numpy = firstparent.numpy
+        try:
+            for firstparent.numpy in {numpy, None}:
+                firstparent.forget()
+                self.assertEqual(firstparent.is_based_on_many(pairs), expected)
+                self.assertEqual(
+                    firstparent.positions(treeishes, 'master'),
+                    [4, 3, 2, None, None, None, None, 1])
+                on_master = ['light', 'master', 'annotated', 'master~2']
+                self.assertEqual(firstparent.sort(on_master),
+                                 ('master', 'master~2', 'light', 'annotated'))
+                self.assertEqual(firstparent.sort(on_master, True),
+                                 ('light', 'annotated', 'master~2', 'master'))
+                self.assertIsNone(firstparent.sort(['master', 'second']))
+        finally:
+            firstparent.numpy = numpy
+            firstparent.forget()
+
+    def test_many(self):
+        self.git('checkout', '-b', 'second', 'side/topic')
+        self.git('commit', '--allow-empty', '-m', 'second')
+        self.git('checkout', 'master')
+        self.git('merge', '--no-ff', '--no-edit', 'second')
+        # tags are peeled, while single queries compare annotated tag SHA
+        treeishes = ('master', 'master~1', 'master^2', 'side/topic', 'light')
+        pairs = [(a, d) for a in treeishes for d in treeishes]
+        firstparent.forget()
+        self.assertEqual(commit.is_based_on_many(pairs),
+                         dict((p, commit.is_based_on(*p)) for p in pairs))
+        treeishes += ('second', 'annotated', 'master~1^2')
+        pairs = [(a, d) for a in treeishes for d in treeishes]
+        self.assertEqual(commit.is_ancestor_many(pairs),
+                         dict((p, commit.is_ancestor(*p)) for p in pairs))
+
+    def test_selection(self):
+        backend.forget()
+        self.git('config', 'thingitwrapper.backend', 'python')
+        if not os.environ.get('GIT_WRAPPER_BACKEND'):
+            self.assertIsInstance(backend.get(), pure.PythonBackend)
+        backend.forget()
+
+
+class MemoryBackendTest(RepositoryTest):
+    def setUp(self):
+        super().setUp()
+        self.memory = memory.MemoryBackend()
+        self.memory.commit('first\n\nbody')
+        self.memory.set_tag('light', 'HEAD')
+        self.memory.set_tag('annotated', 'HEAD', 'annotated')
+        self.memory.set_branch('side/topic', 'master')
+        self.memory.commit('  \nmulti line\n  subject  \n\nbody\n',
+                           branch='side/topic')
+        self.memory.commit('third')
+        self.memory.merge('side/topic', "Merge branch 'side/topic'")
+
+    def queries(self, instance):
+        treeishes = ['HEAD', 'master', 'side/topic', 'light', 'annotated',
+                     'HEAD^', 'HEAD^2', 'HEAD~2', 'annotated^{}', 'master~1^0']
+        return ([instance.rev_parse(t) for t in treeishes] +
+                [instance.headline(t) for t in treeishes] +
+                [instance.parents(t) for t in treeishes] +
+                [instance.parent(t, n) for t in treeishes for n in (0, 1, 2)] +
+                [instance.branch_list(['side/*']), instance.current_branch(),
+                 instance.tag_list(), instance.tags_pointing_at('HEAD~2'),
+                 instance.merge_base(['HEAD^1', 'HEAD^2']),
+                 instance.is_ancestor('side/topic', 'master'),
+                 instance.is_ancestor('master', 'side/topic'),
+                 instance.is_ancestor_many([('side/topic', 'master'),
+                                            ('master', 'side/topic'),
+                                            ('light', 'side/topic')]),
+                 list(instance.first_parent_walk('light', 'master')),
+                 list(instance.first_parent_walk('side/topic', 'master')),
+                 # commits of test have the same date, so order is arbitrary
+                 set(instance.find()), set(instance.find(['master'], True)),
+                 set(instance.find(regexps=['^third$', 'subject'])),
+                 instance.find(regexps=['^third$', 'subject'], match_all=True),
+                 instance.commits_between('light', 'master'),
+                 instance.commits_between('side/topic', 'master', True),
+                 instance.commits_between('light', 'master', regexps=['^M']),
+                 instance.sort(['light', 'master', 'HEAD~1']),
+                 instance.sort(['light', 'master', 'HEAD'], reverse=True),
+                 instance.check_ref_format_many(
+                     'refs/heads/' + name for name in
+                     ('a', 'a/b', '.a', 'a.lock', 'a..b', 'a b', 'a~', 'a:',
+                      'a?', 'a[', 'a\\b', 'a@{', '@', 'a/', 'a//b', 'a.',
+                      'a/.b', 'iter/develop', 'ü'))])
+
+    def test_same_as_git(self):
+        # commits are told apart by headlines, SHAs are different
+        to_git = {self.memory.rev_parse('annotated'):
+                  self.git('rev-parse', 'annotated')}
+        by_headline = dict(line.rsplit(' ', 1) for line in self.git(
+            'log', '--all', '--format=%s %H').splitlines())
+        for sha in self.memory.commits:
+            to_git[sha] = by_headline[self.memory.headline(sha)]
+
+        def translate(answer):
+            if isinstance(answer, (list, tuple)):
+                return [translate(a) for a in answer]
+            if isinstance(answer, set):
+                return sorted(translate(list(answer)))
+            return to_git.get(answer, answer)
+
+        self.assertEqual(translate(self.queries(self.memory)),
+                         translate(self.queries(backend.SubprocessBackend())))
+
+    def test_use(self):
+        backend.use(self.memory)
+        try:
+            backend.forget()
+            self.assertIs(backend.get(), self.memory)
+        finally:
+            backend.use(None)
+        self.assertIsNot(backend.get(), self.memory)
+
+    def test_detached(self):
+        self.memory.checkout('HEAD~1')
+        self.assertIsNone(self.memory.current_branch())
+        sha = self.memory.commit('detached')
+        self.assertEqual(self.memory.rev_parse('HEAD'), sha)
+        self.assertEqual(self.memory.parent('HEAD', 1),
+                         self.memory.rev_parse('master~1'))
+
+
+if __name__ == '__main__':
+    unittest.main(module='test_backend')
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import json
+import os
+from tempfile import TemporaryDirectory
+import threading
+import unittest
+
+from thingitwrapper import grouped_cache, aux
+from thingitwrapper.cached import branch, commit, misc
+
+
+@grouped_cache.cache('test', maxsize=2)
+def square(x):
+    return x * x
+
+
+class CacheStatsTests(unittest.TestCase):
+    def setUp(self):
+        grouped_cache.invalidate('test', dont_print_info=True)
+        self.before = grouped_cache.get_cache_stats()['functions'].get(
+            'test_cache.square', dict.fromkeys(('hits', 'misses', 'evictions'),
+                                               0))
+
+    def delta(self, stats, key):
+        return stats['functions']['test_cache.square'][key] - self.before[key]
+
+    def test_counters_survive_invalidation(self):
+        for x in 1, 2, 3, 3, 1:
+            square(x)
+        grouped_cache.invalidate('test', dont_print_info=True)
+        square(1)
+        stats = grouped_cache.get_cache_stats()
+        self.assertEqual(self.delta(stats, 'hits'), 1)
+        self.assertEqual(self.delta(stats, 'misses'), 5)
+        self.assertEqual(self.delta(stats, 'evictions'), 2)
+        self.assertEqual(stats['functions']['test_cache.square']['groups'],
+                         ['test'])
+        self.assertIn('test', stats['groups'])
+
+    def test_export(self):
+        square(5)
+        with TemporaryDirectory() as temp_dir:
+            json_path = os.path.join(temp_dir, 'stats.json')
+            grouped_cache.export_cache_stats(json_path)
+            with open(json_path) as json_file:
+                stats = json.load(json_file)
+            self.assertEqual(self.delta(stats, 'misses'), 1)
+            prom_path = os.path.join(temp_dir, 'stats.prom')
+            grouped_cache.export_cache_stats(prom_path)
+            with open(prom_path) as prom_file:
+                lines = prom_file.read().splitlines()
+            self.assertIn('# TYPE thingitwrapper_cache_misses_total counter',
+                          lines)
+            self.assertIn('thingitwrapper_cache_group_misses_total'
+                          '{group="test"} ' +
+                          str(stats['groups']['test']['misses']), lines)
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['stats.json', 'stats.prom'])
+
+
+class ThreadSafetyTests(unittest.TestCase):
+    def test_single_flight(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        @grouped_cache.cache('test')
+        def slow(x):
+            calls.append(x)
+            started.set()
+            release.wait()
+            return x + 1
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow(1)))
+                   for _ in range(8)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [2] * 8)
+
+    def test_invalidation_during_fill(self):
+        started, release = threading.Event(), threading.Event()
+        values = iter(('stale', 'fresh'))
+
+        @grouped_cache.cache('test')
+        def value():
+            started.set()
+            release.wait()
+            return next(values)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(value()))
+        thread.start()
+        started.wait()
+        grouped_cache.invalidate('test', dont_print_info=True)
+        release.set()
+        thread.join()
+        self.assertEqual(results, ['stale'])
+        self.assertEqual(value(), 'fresh')
+
+
+class RepoNamespaceTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dirs = [TemporaryDirectory(prefix=self.id() + '_')
+                          for _ in range(2)]
+        self.repos = [d.name for d in self.temp_dirs]
+        for path in self.repos:
+            with aux.working_dir(path):
+                misc.init()
+                commit.commit('initialize', allow_empty=True)
+
+    def tearDown(self):
+        grouped_cache.invalidate(dont_print_info=True)
+        for temp_dir in self.temp_dirs:
+            temp_dir.cleanup()
+
+    def test_separate_caches(self):
+        with aux.working_dir(self.repos[0]):
+            branch.create('only_in_first')
+        results = []
+        for path in self.repos:
+            with aux.working_dir(path):
+                results.append(branch.exists('only_in_first'))
+                self.assertEqual(misc.get_git_dir(),
+                                 os.path.realpath(os.path.join(path, '.git')))
+        self.assertEqual(results, [True, False])
+
+        hits = branch.exists.cache_info().hits
+        with aux.working_dir(self.repos[1]):
+            branch.create('only_in_second')
+        with aux.working_dir(self.repos[0]):
+            self.assertTrue(branch.exists('only_in_first'))
+        self.assertEqual(branch.exists.cache_info().hits, hits + 1)
+        with aux.working_dir(self.repos[1]):
+            self.assertTrue(branch.exists('only_in_second'))
+        self.assertEqual(branch.exists.cache_info().hits, hits + 1)
+
+    def test_stores(self):
+        forgotten = []
+        grouped_cache.register_store(forgotten.append, 'tags')
+        git_dirs = []
+        for path in self.repos:
+            with aux.working_dir(path):
+                git_dirs.append(misc.get_git_dir())
+        grouped_cache.invalidate('branches', repo_path=self.repos[0])
+        self.assertEqual(forgotten, [])
+        grouped_cache.invalidate('tags', repo_path=self.repos[0])
+        self.assertEqual(forgotten, [git_dirs[0]])
+        # repositories used before the third one are evicted
+        self.temp_dirs.append(TemporaryDirectory(prefix=self.id() + '_'))
+        max_repos = grouped_cache.max_repos
+        grouped_cache.max_repos = 1
+        try:
+            with aux.working_dir(self.temp_dirs[-1].name):
+                misc.init()
+                branch.exists('master')
+        finally:
+            grouped_cache.max_repos = max_repos
+        self.assertIn(git_dirs[0], forgotten[1:])
+        self.assertIn(git_dirs[1], forgotten[1:])
+        del forgotten[:]
+        grouped_cache.invalidate(dont_print_info=True)
+        self.assertEqual(forgotten, [None])
+
+
+if __name__ == '__main__':
+    unittest.main(module='test_cache')
@@ -4,7 +4,8 @@ import unittest
 
 from fixture import Fixture
 import utils
-from thingitwrapper.cached import misc, commit
+from gitaflow import topic
+from thingitwrapper.cached import misc, commit, branch
 
 
 class ListTests(utils.LocalTest):
@@ -55,5 +56,23 @@ master--------------Type |Ver| Description--------------------------------------
 1/develop-----------Type |Ver| Description--------------------------------------
 a                    EUF | 1 | N/A""", 'list', 'master', '1/develop')
 
+    def test_hand_made_merge(self):
+        Fixture.from_scheme("""1:
+                               d:-a1
+                               a:-1a""").actualize()
+        branch.create('side', '1/develop')
+        misc.checkout('side')
+        commit.commit('No matter', allow_empty=True)
+        misc.checkout('1/develop')
+        commit.merge('side', "Merge branch 'side' of example.com:repo")
+        hand_made = commit.get_current_sha()
+        for _ in range(2):
+            self.assert_aflow_returns_0("""\
+Using default topic source(s): develop
+1/develop-----------Type |Ver| Description--------------------------------------
+a                    EUF | 1 | N/A""", 'list')
+        if utils.debug:
+            self.assertIn(hand_made, topic.not_aflow_records)
+
 if __name__ == '__main__':
     unittest.main(module='test_list')
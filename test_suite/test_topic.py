@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from thingitwrapper import aux, backend, grouped_cache, memory, shared_cache
+from gitaflow import topic
+from gitaflow.topic import RevisionSet, Topic, TopicMerge, TopicRevision
+
+
+class RecordIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory(prefix=self.id() + '_')
+        for directory in 'objects', 'refs':
+            os.makedirs(os.path.join(self.temp_dir.name, '.git', directory))
+        with open(os.path.join(self.temp_dir.name, '.git', 'HEAD'), 'w') as f:
+            f.write('ref: refs/heads/master\n')
+        self.working_dir = aux.working_dir(self.temp_dir.name)
+        self.working_dir.__enter__()
+        self.history = memory.MemoryBackend()
+        self.history.commit('Initial commit')
+        self.history.set_tag('1', 'master')
+        self.history.set_branch('1/develop', 'master')
+        self.searched = []
+        commits_between = self.history.commits_between
+
+        def spy(treeish1, treeish2, *args, **kwargs):
+            self.searched.append((self.history.rev_parse(treeish1),
+                                  self.history.rev_parse(treeish2)))
+            return commits_between(treeish1, treeish2, *args, **kwargs)
+        self.history.commits_between = spy
+        backend.use(self.history)
+
+    def tearDown(self):
+        backend.use(None)
+        grouped_cache.invalidate(dont_print_info=True)
+        self.working_dir.__exit__(None, None, None)
+        self.temp_dir.cleanup()
+
+    def merge_topic(self, name):
+        self.history.set_branch('1/' + name, '1')
+        self.history.commit(name, branch='1/' + name)
+        return self.history.merge('1/' + name, "Merge branch '1/" + name +
+                                  "' into 1/develop\n\nDEV", '1/develop')
+
+    def effective_topics(self):
+        grouped_cache.invalidate('branches', 'tags', dont_print_info=True)
+        return [m.rev.topic.name
+                for m in TopicMerge.get_effective_merges_in('1/develop')]
+
+    def test_incremental(self):
+        merge = self.merge_topic('a')
+        self.merge_topic('b')
+        self.assertEqual(self.effective_topics(), ['a', 'b'])
+        old_tip = self.history.rev_parse('1/develop')
+        self.searched.clear()
+        self.assertEqual(self.effective_topics(), ['a', 'b'])
+        self.assertEqual(self.searched, [])
+        # SHA tips are searched directly and don't replace index of develop
+        self.assertEqual(topic.get_records_between('1', merge),
+                         ((merge, False),))
+        self.assertEqual(self.effective_topics(), ['a', 'b'])
+        self.assertEqual(set(self.searched),
+                         {(self.history.rev_parse('1'), merge)})
+        self.searched.clear()
+        self.merge_topic('c')
+        self.history.commit('Revert "Merge branch \'1/a\' into 1/develop"\n\n'
+                            'This reverts commit ' + merge + '.',
+                            branch='1/develop')
+        self.assertEqual(self.effective_topics(), ['b', 'c'])
+        new_tip = self.history.rev_parse('1/develop')
+        self.assertEqual(set(self.searched), {(old_tip, new_tip)})
+        self.assertEqual(topic.get_records_between('1', '1/develop'),
+                         tuple((sha, False) for sha in self.history.find(
+                             ['1/develop~1'], True, ['^Merge'])[::-1]) +
+                         ((new_tip, True),))
+        # index is dropped along with all caches, unless shared cache keeps it
+        grouped_cache.invalidate(dont_print_info=True)
+        self.searched.clear()
+        topic.get_records_between('1', '1/develop')
+        if shared_cache.enabled:
+            self.assertEqual(self.searched, [])
+        else:
+            self.assertIn((self.history.rev_parse('1'), new_tip),
+                          self.searched)
+
+    def test_revert_line_in_body(self):
+        self.history.set_branch('1/a', '1')
+        self.history.commit('a', branch='1/a')
+        merge = self.history.merge(
+            '1/a', "Merge branch '1/a' into 1/develop\n\nDEV\n"
+            "Revert \"Merge branch '1/b' into 1/develop\"", '1/develop')
+        self.assertEqual(topic.get_records_between('1', '1/develop'),
+                         ((merge, False),))
+        self.assertEqual(self.effective_topics(), ['a'])
+
+    def test_reset(self):
+        for name in 'a', 'b':
+            self.merge_topic(name)
+        self.assertEqual(self.effective_topics(), ['a', 'b'])
+        self.history.set_branch('1/develop', '1/develop~1')
+        self.merge_topic('c')
+        self.assertEqual(self.effective_topics(), ['a', 'c'])
+        self.assertIn((self.history.rev_parse('1'),
+                       self.history.rev_parse('1/develop')), self.searched)
+
+    def test_topic_index(self):
+        self.merge_topic('a')
+        self.merge_topic('b')
+        self.history.merge('1/a', "Merge branch '1/a'\n\nDEV", 'master')
+        topic_a = Topic('a')
+        self.assertEqual(sorted(m.merge_target
+                                for m in topic_a.get_all_merges()),
+                         ['1/develop', 'master'])
+        self.history.set_branch('1/a_v2', '1/a')
+        self.history.commit('a_v2', branch='1/a_v2')
+        self.history.merge('1/a_v2', "Merge branch '1/a_v2' into 1/develop"
+                           "\n\nFIX", '1/develop')
+        grouped_cache.invalidate('branches', 'tags', dont_print_info=True)
+        self.searched.clear()
+        self.assertEqual(sorted(m.rev.version
+                                for m in topic_a.get_all_merges()), [1, 1, 2])
+        self.assertEqual(set(self.searched), {(
+            self.history.rev_parse('1/develop~1'),
+            self.history.rev_parse('1/develop'))})
+        self.assertEqual([m.rev.version
+                          for m in topic_a.get_all_merges_in('1/develop')],
+                         [1, 2])
+        self.assertEqual(topic.get_topic_index('1', '1/develop')['b'][0][1:],
+                         (1, '1', '1/develop', False))
+
+    def test_merge_order(self):
+        self.history.set_branch('1/a', '1')
+        self.history.commit('a', branch='1/a')
+        self.history.merge('1/a', "Merge branch '1/a'\n\nDEV", 'master')
+        self.history.commit('b', branch='1/develop')
+        develop_merge = self.history.merge(
+            '1/a', "Merge branch '1/a' into 1/develop\n\nDEV", '1/develop')
+        topic_a = Topic('a')
+        merges = topic_a.get_all_merges()
+        self.assertEqual([m.SHA for m in merges], self.history.find(
+            ['master', '1/develop'], True, ["^Merge branch '1/a'"]))
+        self.assertEqual(topic_a.get_latest_merge(merges).SHA, develop_merge)
+
+    def test_checkpoints(self):
+        self.merge_topic('a')
+        self.merge_topic('b')
+        for name in 'a', 'b':
+            self.history.merge('1/' + name, "Merge branch '1/" + name +
+                               "'\n\nDEV", 'master')
+        self.history.commit('Revert "Merge branch \'1/b\'"\n\nThis reverts '
+                            'commit ' + self.history.rev_parse('master') + '.',
+                            branch='master')
+        self.history.set_tag('2', 'master')
+        self.history.set_branch('2/develop', 'master')
+        self.history.set_branch('2/c', '2')
+        self.history.commit('c', branch='2/c')
+        self.history.merge('2/c', "Merge branch '2/c' into 2/develop\n\nDEV",
+                           '2/develop')
+        grouped_cache.invalidate(dont_print_info=True)
+        merges = TopicMerge.get_effective_merges_in('2/develop',
+                                                    treeish1='1')
+        self.assertEqual([m.rev.topic.name for m in merges], ['a', 'c'])
+        self.assertIn((self.history.rev_parse('1'),
+                       self.history.rev_parse('2')),
+                      [key[1:] for key in topic._checkpoints])
+        self.searched.clear()
+        self.history.set_branch('2/d', '2')
+        self.history.commit('d', branch='2/d')
+        self.history.merge('2/d', "Merge branch '2/d' into 2/develop\n\nDEV",
+                           '2/develop')
+        grouped_cache.invalidate('branches', 'tags', dont_print_info=True)
+        merges = TopicMerge.get_effective_merges_in('2/develop',
+                                                    treeish1='1')
+        self.assertEqual([m.rev.topic.name for m in merges], ['a', 'c', 'd'])
+        self.assertNotIn(self.history.rev_parse('1'),
+                         [start for start, _ in self.searched])
+
+    def test_dependencies(self):
+        merges = [self.merge_topic('a')]
+        for name in 'b', 'c':
+            self.history.set_branch('1/' + name, '1/develop')
+            self.history.commit(name, branch='1/' + name)
+            merges.append(self.history.merge(
+                '1/' + name, "Merge branch '1/" + name +
+                "' into 1/develop\n\nDEV", '1/develop'))
+        head = self.history.rev_parse('1/c')
+        self.assertEqual(topic.get_dependencies(head),
+                         (tuple(merges[:2]), tuple(merges[:2])))
+        grouped_cache.invalidate('branches', 'tags', dont_print_info=True)
+        self.searched.clear()
+        self.assertEqual([m.rev.topic.name for m in TopicMerge.from_treeish(
+            merges[2]).rev.get_own_effective_merges(True)], ['a', 'b'])
+        self.assertEqual(self.searched, [])
+        # iteration tagged again
+        self.history.set_tag('1', merges[0])
+        grouped_cache.invalidate(dont_print_info=True)
+        self.assertEqual(topic.get_dependencies(head),
+                         ((merges[1],), (merges[1],)))
+
+
+class RevisionSetTests(unittest.TestCase):
+    def test_set(self):
+        a1, a2, b1 = (TopicRevision(Topic(name), None, version, None)
+                      for name, version in (('a', 1), ('a', 2), ('b', 1)))
+        revisions = RevisionSet([a2])
+        self.assertIn(a2, revisions)
+        self.assertNotIn(a1, revisions)
+        self.assertFalse(revisions.is_newest(a1))
+        self.assertTrue(revisions.is_newest(b1))
+        joined = revisions | RevisionSet([b1, a1])
+        self.assertTrue(all(r in joined for r in (a1, a2, b1)))
+        self.assertEqual(joined.get_latest_version(Topic('a')), 2)
+        self.assertEqual(joined.get_latest_version(Topic('c')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(module='test_topic')
@@ -1,23 +1,270 @@
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import logging
+import multiprocessing
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+
+from thingitwrapper import cassette, trace
 
 
 try:
     from subprocess import DEVNULL
 except ImportError:
     DEVNULL = open(os.devnull, 'w')
+# time.perf_counter appeared in Python 3.3
+perf_counter = getattr(time, 'perf_counter', time.time)
 
 
 debug_mode = os.environ.get('GIT_WRAPPER_DEBUG') == '1'
+# maximum number of git processes run_many runs at once
+concurrency = (int(os.environ.get('GIT_WRAPPER_CONCURRENCY', '0')) or
+               multiprocessing.cpu_count())
+
+# Fast spawn mode: git is spawned by posix_spawn instead of fork+exec where
+# Python allows it, read-only commands run with minimal fixed environment
+fast_spawn = os.environ.get('GIT_WRAPPER_FAST_SPAWN') == '1'
+READ_ONLY_COMMANDS = frozenset((
+    'cat-file', 'check-ref-format', 'diff', 'for-each-ref', 'log', 'ls-tree',
+    'merge-base', 'rev-list', 'rev-parse', 'show', 'show-ref'))
+FAST_SPAWN_ENV = {'LC_ALL': 'C', 'GIT_OPTIONAL_LOCKS': '0',
+                  'GIT_PAGER': 'cat', 'PAGER': 'cat'}
+# variables passed to read-only commands in fast spawn mode as is, along with
+# GIT_*
+FAST_SPAWN_KEEP = ('PATH', 'HOME', 'XDG_CONFIG_HOME', 'TMPDIR',
+                   'SSH_AUTH_SOCK')
+__git_path = None
 
 
 class GitUnexpectedError(Exception):
     """Git subprocess returns unexpected error"""
 
 
+__thread_state = threading.local()
+
+
+@contextlib.contextmanager
+def working_dir(path):
+    """Makes commands called by current thread run in path instead of process
+    CWD. Use it to work with several repositories simultaneously.
+    """
+    previous = getattr(__thread_state, 'cwd', None)
+    __thread_state.cwd = os.path.abspath(path)
+    try:
+        yield
+    finally:
+        __thread_state.cwd = previous
+
+
+def get_cwd():
+    """Returns directory commands called by current thread are run in"""
+    cwd = getattr(__thread_state, 'cwd', None)
+    return cwd if cwd else os.getcwd()
+
+
+def __fast_spawn_env():
+    env = dict((k, v) for k, v in os.environ.items()
+               if k in FAST_SPAWN_KEEP or k.startswith('GIT_'))
+    env.update(FAST_SPAWN_ENV)
+    return env
+
+
+def __fast_spawn_command(command_and_args):
+    """CPython uses posix_spawn only for executables given with directory"""
+    global __git_path
+    if command_and_args[0] != 'git':
+        return command_and_args
+    if __git_path is None:
+        # shutil.which appeared in Python 3.3, which has no posix_spawn anyway
+        which = getattr(shutil, 'which', None)
+        __git_path = (which('git') if which else None) or 'git'
+    return [__git_path, '-c', 'color.ui=false'] + list(command_and_args[1:])
+
+
+def _popen_args(p_args, command_and_args=()):
+    cwd = getattr(__thread_state, 'cwd', None)
+    if cwd and p_args.get('cwd') is None:
+        p_args = dict(p_args, cwd=cwd)
+    if fast_spawn:
+        p_args = dict(p_args)
+        p_args.setdefault('close_fds', False)
+        # other commands may need the whole environment: committer identity
+        # (EMAIL), signing (GNUPGHOME, GPG_TTY), editors
+        if (p_args.get('env') is None and len(command_and_args) > 1 and
+                command_and_args[0] == 'git' and
+                command_and_args[1] in READ_ONLY_COMMANDS):
+            p_args['env'] = __fast_spawn_env()
+    return p_args
+
+
+def _prepare(command_and_args, p_args):
+    """Returns command and Popen arguments to actually run"""
+    p_args = _popen_args(p_args, command_and_args)
+    if fast_spawn:
+        command_and_args = __fast_spawn_command(command_and_args)
+    return command_and_args, p_args
+
+
+# Identical read-only commands running at the same time in the same directory
+# are run once, other callers wait for the result of the first one
+coalescing = os.environ.get('GIT_WRAPPER_COALESCE', '1') != '0'
+COALESCED_COMMANDS = READ_ONLY_COMMANDS
+coalesce_stats = {'calls': 0, 'coalesced': 0}
+__flights = dict()  # {(function name, command, cwd): _Flight}
+__flights_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def __coalesced(func):
+    @functools.wraps(func)
+    def wrapper(command_and_args, **p_args):
+        if (not coalescing or len(command_and_args) < 2 or
+                command_and_args[0] != 'git' or
+                command_and_args[1] not in COALESCED_COMMANDS or
+                set(p_args) - {'cwd'}):
+            return func(command_and_args, **p_args)
+        key = (func.__name__, tuple(command_and_args),
+               os.path.abspath(p_args['cwd']) if p_args.get('cwd')
+               else get_cwd())
+        with __flights_lock:
+            coalesce_stats['calls'] += 1
+            flight = __flights.get(key)
+            if flight is None:
+                flight = __flights[key] = _Flight()
+                owner = True
+            else:
+                coalesce_stats['coalesced'] += 1
+                owner = False
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func(command_and_args, **p_args)
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with __flights_lock:
+                del __flights[key]
+            flight.done.set()
+        return flight.result
+    return wrapper
+
+
+def __traced(outcome):
+    """Reports calls to trace module. outcome(result) returns exit code and
+    output size of command from result of decorated function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(command_and_args, **p_args):
+            # in debug mode functions call each other, trace outermost only
+            if not trace.active or getattr(__thread_state, 'tracing', False):
+                return func(command_and_args, **p_args)
+            __thread_state.tracing = True
+            exit_code = size = None
+            start = perf_counter()
+            try:
+                result = func(command_and_args, **p_args)
+                exit_code, size = outcome(result)
+                return result
+            except subprocess.CalledProcessError as error:
+                exit_code = error.returncode
+                raise
+            finally:
+                __thread_state.tracing = False
+                trace.record_call(command_and_args,
+                                  p_args.get('cwd') or get_cwd(),
+                                  perf_counter() - start, exit_code, size)
+        return wrapper
+    return decorator
+
+
+def _encode(value):
+    """Makes result of aux function JSON-serializable"""
+    if isinstance(value, bytes):
+        return {'bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, tuple):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    """Reverts _encode"""
+    if isinstance(value, dict):
+        return base64.b64decode(value['bytes'])
+    if isinstance(value, list):
+        return tuple(_decode(v) for v in value)
+    return value
+
+
+def __recorded(func):
+    """Stores outcomes of calls to cassette when recording, takes them from
+    cassette instead of running commands when replaying
+    """
+    @functools.wraps(func)
+    def wrapper(command_and_args, **p_args):
+        # in debug mode functions call each other, record outermost only
+        if cassette.mode is None or getattr(__thread_state, 'recording',
+                                            False):
+            return func(command_and_args, **p_args)
+        cwd = os.path.abspath(p_args['cwd']) if p_args.get('cwd') \
+            else get_cwd()
+        env = p_args.get('env')
+        if cassette.mode == 'replay':
+            outcome = cassette.load(func.__name__, command_and_args, cwd, env)
+            if 'returncode' in outcome:
+                raise subprocess.CalledProcessError(
+                    outcome['returncode'], command_and_args,
+                    _decode(outcome['output']))
+            if 'message' in outcome:
+                raise GitUnexpectedError(outcome['message'])
+            return _decode(outcome['result'])
+        __thread_state.recording = True
+        try:
+            result = func(command_and_args, **p_args)
+        except subprocess.CalledProcessError as error:
+            cassette.store(func.__name__, command_and_args, cwd, env,
+                           {'returncode': error.returncode,
+                            'output': _encode(error.output)})
+            raise
+        except GitUnexpectedError as error:
+            cassette.store(func.__name__, command_and_args, cwd, env,
+                           {'message': str(error)})
+            raise
+        finally:
+            __thread_state.recording = False
+        cassette.store(func.__name__, command_and_args, cwd, env,
+                       {'result': _encode(result)})
+        return result
+    return wrapper
+
+
+def __output_outcome(output):
+    return (1, 0) if output is None else (0, len(output))
+
+
+@__coalesced
+@__traced(__output_outcome)
+@__recorded
 def get_output_01(command_and_args, **p_args):
     """Returns command output if it runs successfully, None if it returns 1"""
+    command_and_args, p_args = _prepare(command_and_args, p_args)
     if debug_mode:
         output, exit_code = get_output_and_exit_code(command_and_args, **p_args)
         if exit_code == 0:
@@ -40,7 +287,11 @@ def get_output_01(command_and_args, **p_args):
                 raise
 
 
+@__coalesced
+@__traced(lambda result: (0 if result else 1, None))
+@__recorded
 def check_01(command_and_args, **p_args):
+    command_and_args, p_args = _prepare(command_and_args, p_args)
     if debug_mode:
         output, exit_code = get_output_and_exit_code(command_and_args, **p_args)
         if exit_code == 0:
@@ -65,7 +316,11 @@ def check_01(command_and_args, **p_args):
                                      str(exit_code) + '. 0 or 1 expected.')
 
 
+@__coalesced
+@__traced(lambda result: (0, None))
+@__recorded
 def call(command_and_args, **p_args):
+    command_and_args, p_args = _prepare(command_and_args, p_args)
     if debug_mode:
         output, exit_code = get_output_and_exit_code(command_and_args, **p_args)
         if exit_code != 0:
@@ -79,7 +334,11 @@ def call(command_and_args, **p_args):
                               **p_args)
 
 
+@__coalesced
+@__traced(__output_outcome)
+@__recorded
 def get_output(command_and_args, **p_args):
+    command_and_args, p_args = _prepare(command_and_args, p_args)
     if debug_mode:
         output, exit_code = get_output_and_exit_code(command_and_args, **p_args)
         if exit_code != 0:
@@ -93,7 +352,11 @@ def get_output(command_and_args, **p_args):
             command_and_args, stderr=subprocess.STDOUT, **p_args).decode()[:-1]
 
 
+@__coalesced
+@__traced(lambda result: (result, None))
+@__recorded
 def get_exit_code(command_and_args, **p_args):
+    command_and_args, p_args = _prepare(command_and_args, p_args)
     if debug_mode:
         return get_output_and_exit_code(command_and_args, **p_args)[1]
     else:
@@ -103,7 +366,11 @@ def get_exit_code(command_and_args, **p_args):
                                **p_args)
 
 
+@__coalesced
+@__traced(lambda result: (result[1], len(result[0])))
+@__recorded
 def get_output_and_exit_code(command_and_args, **p_args):
+    command_and_args, p_args = _prepare(command_and_args, p_args)
     if debug_mode:
         logging.debug('Calling ' + ' '.join(command_and_args) +
                       ('. Popen args: ' + str(p_args) if p_args else ''))
@@ -119,3 +386,161 @@ def get_output_and_exit_code(command_and_args, **p_args):
     if debug_mode:
         logging.debug('Result: ' + str(result[1]) + ' Output:' + result[0])
     return result
+
+
+CHUNK_SIZE = 1 << 16
+
+
+def __unexpected_exit(command_and_args, exit_code, errors):
+    return GitUnexpectedError(' '.join(command_and_args) + ' returns ' +
+                              str(exit_code) + '. Zero expected. Stderr: ' +
+                              errors.decode(errors='replace'))
+
+
+@__coalesced
+@__traced(__output_outcome)
+@__recorded
+def get_output_bytes(command_and_args, **p_args):
+    """Returns stdout of command as bytes, as is. Unlike get_output, stderr is
+    not mixed in, it is only used for error message if command fails.
+    """
+    command_and_args, p_args = _prepare(command_and_args, p_args)
+    if debug_mode:
+        logging.debug('Calling ' + ' '.join(command_and_args) +
+                      ('. Popen args: ' + str(p_args) if p_args else ''))
+    process = subprocess.Popen(command_and_args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, **p_args)
+    output, errors = process.communicate()
+    if debug_mode:
+        logging.debug('Result: ' + str(process.returncode) + ' Output: ' +
+                      str(len(output)) + ' bytes')
+    if process.returncode != 0:
+        raise __unexpected_exit(command_and_args, process.returncode, errors)
+    return output
+
+
+def __split(chunks, separator, encoding):
+    tail = b''
+    for chunk in chunks:
+        lines = (tail + chunk if tail else chunk).split(separator)
+        tail = lines.pop()
+        for line in lines:
+            yield line.decode(encoding) if encoding else line
+    if tail:
+        yield tail.decode(encoding) if encoding else tail
+
+
+def iter_lines(command_and_args, separator=b'\n', encoding=None, **p_args):
+    """Yields output of command split by separator (use b'\0' for -z output
+    of git) while it is being read, so the whole output is never held in
+    memory. Lines are bytes, unless encoding is given: decode SHAs as 'ascii'
+    and paths as 'utf-8'. Stderr is kept apart like in get_output_bytes.
+    """
+    argv = command_and_args
+    cwd = os.path.abspath(p_args['cwd']) if p_args.get('cwd') else get_cwd()
+    env = p_args.get('env')
+    if cassette.mode == 'replay':
+        output, exit_code, errors = _decode(cassette.load(
+            'iter_lines', argv, cwd, env)['result'])
+        for line in __split((output,), separator, encoding):
+            yield line
+        if exit_code:
+            raise __unexpected_exit(argv, exit_code, errors)
+        return
+    # abandoned generator leaves partial output recorded with no exit code
+    recorded = [] if cassette.mode == 'record' else None
+    exit_code = None
+    command_and_args, p_args = _prepare(command_and_args, p_args)
+    if debug_mode:
+        logging.debug('Calling ' + ' '.join(command_and_args) +
+                      ('. Popen args: ' + str(p_args) if p_args else ''))
+    with tempfile.TemporaryFile() as errors:
+        # stderr goes to file: pipe could get full while we read stdout
+        process = subprocess.Popen(command_and_args, stdout=subprocess.PIPE,
+                                   stderr=errors, **p_args)
+        start = perf_counter()
+        size = 0
+
+        def read():
+            nonlocal size
+            chunk = process.stdout.read(CHUNK_SIZE)
+            while chunk:
+                size += len(chunk)
+                if recorded is not None:
+                    recorded.append(chunk)
+                yield chunk
+                chunk = process.stdout.read(CHUNK_SIZE)
+
+        try:
+            for line in __split(read(), separator, encoding):
+                yield line
+            exit_code = process.wait()
+            errors.seek(0)
+            error_output = errors.read()
+        finally:
+            process.stdout.close()
+            if process.poll() is None:  # generator wasn't exhausted
+                process.kill()
+                process.wait()
+            if recorded is not None:
+                cassette.store('iter_lines', argv, cwd, env, {
+                    'result': _encode((b''.join(recorded), exit_code,
+                                        error_output if exit_code else b''))})
+        if debug_mode:
+            logging.debug('Result: ' + str(exit_code))
+        if trace.active:
+            trace.record_call(argv, p_args.get('cwd') or get_cwd(),
+                              perf_counter() - start, exit_code, size)
+        if exit_code != 0:
+            raise __unexpected_exit(command_and_args, exit_code, error_output)
+
+
+BatchResult = collections.namedtuple('BatchResult',
+                                     ('results', 'wall_time', 'busy_time'))
+
+
+def __run_timed(command_and_args, p_args):
+    start = time.time()
+    output, exit_code = get_output_and_exit_code(command_and_args, **p_args)
+    return output, exit_code, time.time() - start
+
+
+def run_many(commands, max_workers=None, **p_args):
+    """Runs commands (list of command_and_args lists) on a pool of at most
+    max_workers threads (concurrency by default). Returns BatchResult:
+    results - list of (output, exit code) tuples in order of commands,
+    wall_time - seconds the whole batch took,
+    busy_time - sum of run times of individual commands.
+    """
+    p_args = _popen_args(p_args)
+    commands = list(commands)
+    start = time.time()
+    if len(commands) < 2:
+        timed = [__run_timed(c, p_args) for c in commands]
+    else:
+        workers = min(max_workers or concurrency, len(commands))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            timed = list(pool.map(lambda c: __run_timed(c, p_args), commands))
+    result = BatchResult([(output, code) for output, code, _ in timed],
+                         time.time() - start, sum(t[2] for t in timed))
+    if debug_mode:
+        logging.debug('Ran ' + str(len(commands)) + ' commands in ' +
+                      '%.3f' % result.wall_time + 's, busy ' +
+                      '%.3f' % result.busy_time + 's')
+    return result
+
+
+def check_01_many(commands, **p_args):
+    """Batch version of check_01. Returns list of booleans in order of
+    commands.
+    """
+    commands = list(commands)
+    results = []
+    for command_and_args, (output, exit_code) in zip(
+            commands, run_many(commands, **p_args).results):
+        if exit_code not in (0, 1):
+            raise GitUnexpectedError(' '.join(command_and_args) + ' returns ' +
+                                     str(exit_code) +
+                                     '. 0 or 1 expected. Output: ' + output)
+        results.append(exit_code == 0)
+    return results
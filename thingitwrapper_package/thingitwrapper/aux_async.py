@@ -0,0 +1,120 @@
+"""asyncio twin of aux module. Functions here are coroutines with the same
+names, arguments and exit code semantics as their aux counterparts, so
+independent git queries may be run concurrently, e.g.:
+    outputs = await asyncio.gather(*(get_output(c) for c in commands))
+Number of git processes running at once is limited by a semaphore, see
+set_concurrency(). Requires Python 3.5+, unlike the rest of thingitwrapper.
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+import time
+import weakref
+
+from thingitwrapper import cassette, trace
+from thingitwrapper.aux import GitUnexpectedError, debug_mode, _prepare, \
+    get_cwd, _encode, _decode
+
+
+concurrency = int(os.environ.get('GIT_WRAPPER_CONCURRENCY', '0')) or \
+    os.cpu_count() or 4
+__semaphores = weakref.WeakKeyDictionary()  # semaphores by event loop
+
+
+def set_concurrency(limit):
+    """Sets maximum number of git processes run at once. Affects semaphores
+    of event loops which haven't run any command yet.
+    """
+    global concurrency
+    concurrency = limit
+
+
+def __get_semaphore():
+    loop = asyncio.get_event_loop()
+    semaphore = __semaphores.get(loop)
+    if semaphore is None:
+        semaphore = __semaphores[loop] = asyncio.Semaphore(concurrency)
+    return semaphore
+
+
+async def __run(command_and_args, capture, p_args):
+    """Returns (output bytes or None, exit code)"""
+    argv = command_and_args
+    cwd = os.path.abspath(p_args['cwd']) if p_args.get('cwd') else get_cwd()
+    env = p_args.get('env')
+    function = 'async_output' if capture else 'async_exit_code'
+    if cassette.mode == 'replay':
+        return _decode(cassette.load(function, argv, cwd, env)['result'])
+    command_and_args, p_args = _prepare(command_and_args, p_args)
+    if debug_mode:
+        logging.debug('Calling ' + ' '.join(command_and_args) +
+                      ('. Popen args: ' + str(p_args) if p_args else ''))
+    output = subprocess.PIPE if capture else subprocess.DEVNULL
+    errors = subprocess.STDOUT if capture else subprocess.DEVNULL
+    async with __get_semaphore():
+        start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command_and_args, stdout=output, stderr=errors, **p_args)
+        except FileNotFoundError:
+            logging.critical('Command ' + command_and_args[0] + ' not found!')
+            raise
+        stdout, _ = await process.communicate()
+    if trace.active:
+        trace.record_call(argv, p_args.get('cwd') or get_cwd(),
+                          time.perf_counter() - start, process.returncode,
+                          len(stdout) if capture else None)
+    if cassette.mode == 'record':
+        cassette.store(function, argv, cwd, env,
+                       {'result': _encode((stdout, process.returncode))})
+    if debug_mode:
+        logging.debug('Result: ' + str(process.returncode) +
+                      (' Output:' + stdout.decode()[:-1] if capture else ''))
+    return stdout, process.returncode
+
+
+async def get_output_and_exit_code(command_and_args, **p_args):
+    output, code = await __run(command_and_args, True, p_args)
+    return output.decode()[:-1], code
+
+
+async def get_output(command_and_args, **p_args):
+    output, code = await __run(command_and_args, True, p_args)
+    if code != 0:
+        raise subprocess.CalledProcessError(code, command_and_args, output)
+    return output.decode()[:-1]
+
+
+async def get_output_01(command_and_args, **p_args):
+    """Returns command output if it runs successfully, None if it returns 1"""
+    output, code = await __run(command_and_args, True, p_args)
+    if code == 0:
+        return output.decode()[:-1]
+    elif code == 1:
+        return None
+    else:
+        raise subprocess.CalledProcessError(code, command_and_args, output)
+
+
+async def check_01(command_and_args, **p_args):
+    _, code = await __run(command_and_args, False, p_args)
+    if code == 0:
+        return True
+    elif code == 1:
+        return False
+    else:
+        raise GitUnexpectedError(' '.join(command_and_args) + ' returns ' +
+                                 str(code) + '. 0 or 1 expected.')
+
+
+async def call(command_and_args, **p_args):
+    _, code = await __run(command_and_args, False, p_args)
+    if code != 0:
+        raise subprocess.CalledProcessError(code, command_and_args)
+
+
+async def get_exit_code(command_and_args, **p_args):
+    _, code = await __run(command_and_args, False, p_args)
+    return code
@@ -0,0 +1,405 @@
+"""Backends answer read-only queries of branch, tag, commit and misc modules.
+
+SubprocessBackend asks git. PythonBackend (see pure module) reads refs and
+objects directly and asks git only for what it can't do itself.
+Backend is chosen per repository by GIT_WRAPPER_BACKEND environment variable
+or by thingitwrapper.backend key of repository config: 'subprocess' (default)
+or 'python'. A backend instance may also be installed with use(), e.g. an
+in-memory repository of memory module. Git calls are recorded and replayed by
+cassette module, so while it is on, subprocess backend is always chosen.
+Modifying commands are always run by git, backends don't deal with them.
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import os
+import re
+import threading
+
+from thingitwrapper import cassette, repo
+from thingitwrapper.aux import get_output, check_01, get_output_01, \
+    iter_lines, check_01_many
+
+
+_bad_ref_re = re.compile(r'(^|/)\.|\.lock(/|$)|\.\.|[\x00-\x20\x7f~^:?*[\\]|'
+                         r'@\{|^/|/$|//|\.$|^@$')
+
+
+class Unsupported(Exception):
+    """Backend can't answer this query, it should be asked to git"""
+
+
+class Backend:
+    """Interface of backends. Treeish arguments accept whatever git
+    rev-parse accepts, names are short names of branches or tags.
+    """
+    def rev_parse(self, treeish):
+        raise NotImplementedError
+
+    def rev_parse_many(self, list_of_treeish):
+        return [self.rev_parse(treeish) for treeish in list_of_treeish]
+
+    def sort(self, list_of_treeish, by_date=False, reverse=False):
+        """Returns tuple of treeish in topological order (descendants first)
+        or by date (newer first)
+        """
+        raise NotImplementedError
+
+    def check_ref_format(self, ref):
+        """Like git check-ref-format, ref is a full ref name"""
+        raise NotImplementedError
+
+    def check_ref_format_many(self, refs):
+        """Returns list of booleans"""
+        return [self.check_ref_format(ref) for ref in refs]
+
+    def merge_base(self, shas):
+        """Returns best common ancestor of all commits"""
+        raise NotImplementedError
+
+    def branch_list(self, patterns=None):
+        """Returns sorted names of branches matching any of shell wildcard
+        patterns, all branches if there are no patterns
+        """
+        raise NotImplementedError
+
+    def branch_exists(self, name):
+        raise NotImplementedError
+
+    def branches_exist(self, names):
+        """Returns list of booleans"""
+        return [self.branch_exists(name) for name in names]
+
+    def branch_sha(self, name):
+        raise NotImplementedError
+
+    def current_branch(self):
+        """Returns None in detached HEAD state"""
+        raise NotImplementedError
+
+    def tag_list(self, pattern=''):
+        raise NotImplementedError
+
+    def tag_exists(self, name):
+        raise NotImplementedError
+
+    def tags_exist(self, names):
+        return [self.tag_exists(name) for name in names]
+
+    def tag_sha(self, name):
+        """Returns SHA tag ref points to (SHA of tag object for annotated
+        tags)
+        """
+        raise NotImplementedError
+
+    def tags_pointing_at(self, treeish):
+        raise NotImplementedError
+
+    def headline(self, treeish):
+        """Returns subject of commit as git log --format=%s does"""
+        raise NotImplementedError
+
+    def full_message(self, treeish):
+        raise NotImplementedError
+
+    def parent(self, treeish, number):
+        """Returns SHA of parent number of commit, None if there is no such
+        parent
+        """
+        raise NotImplementedError
+
+    def parents(self, treeish):
+        raise NotImplementedError
+
+    def is_ancestor(self, ancestor, descendant):
+        """Like git merge-base --is-ancestor, commit is ancestor of itself"""
+        raise NotImplementedError
+
+    def is_ancestor_many(self, pairs):
+        """Batch version of is_ancestor. Returns list of booleans in order of
+        (ancestor, descendant) pairs.
+        """
+        return [self.is_ancestor(a, d) for a, d in pairs]
+
+    def first_parent_walk(self, ancestor, descendant):
+        """Iterates over SHAs of git rev-list --first-parent
+        ancestor..descendant
+        """
+        raise NotImplementedError
+
+    def find(self, start_commits=None, first_parent=False, regexps=None,
+             match_all=False):
+        raise NotImplementedError
+
+    def commits_between(self, treeish1, treeish2, reverse=False,
+                        regexps=None, match_all=False):
+        raise NotImplementedError
+
+
+class SubprocessBackend(Backend):
+    def __init__(self, git_dir=None):
+        self.git_dir = git_dir
+
+    def rev_parse(self, treeish):
+        return get_output(['git', 'rev-parse', treeish])
+
+    def rev_parse_many(self, list_of_treeish):
+        list_of_treeish = list(list_of_treeish)
+        if not list_of_treeish:
+            return []
+        # rev-parse echoes '--' back
+        return get_output(['git', 'rev-parse'] + list_of_treeish +
+                          ['--']).splitlines()[:-1]
+
+    def sort(self, list_of_treeish, by_date=False, reverse=False):
+        list_of_treeish = list(list_of_treeish)
+        if not list_of_treeish:
+            return ()
+        sha_treeish = collections.defaultdict(list)
+        for treeish, sha in zip(list_of_treeish,
+                                self.rev_parse_many(list_of_treeish)):
+            sha_treeish[sha.encode()].append(treeish)
+        shas = iter_lines(['git', 'rev-list'] +
+                          ['--date-order' if by_date else '--topo-order'] +
+                          (['--reverse'] if reverse else []) +
+                          list_of_treeish + ['--'])
+        return tuple(t for sha in shas for t in sha_treeish.get(sha, ()))
+
+    def check_ref_format(self, ref):
+        return check_01(['git', 'check-ref-format', ref])
+
+    def check_ref_format_many(self, refs):
+        return check_01_many(['git', 'check-ref-format', ref] for ref in refs)
+
+    def merge_base(self, shas):
+        return get_output(["git", "merge-base", "--octopus"] + list(shas))
+
+    def branch_list(self, patterns=None):
+        output = get_output(['git', 'branch', '--list'] +
+                            (list(patterns) if patterns else []))
+        return re.sub('[ *]', '', output).splitlines()
+
+    def branch_exists(self, name):
+        return check_01(['git', 'show-ref', '--verify', '-q',
+                         'refs/heads/' + name])
+
+    def branches_exist(self, names):
+        return check_01_many(['git', 'show-ref', '--verify', '-q',
+                              'refs/heads/' + name] for name in names)
+
+    def branch_sha(self, name):
+        return get_output(['git', 'show-ref', '--verify', '--hash',
+                           'refs/heads/' + name])
+
+    def current_branch(self):
+        return get_output_01(['git', 'symbolic-ref', '--short', '--q', 'HEAD'])
+
+    def tag_list(self, pattern=''):
+        return get_output(['git', 'tag', '--list'] +
+                          ([] if pattern == '' else [pattern])).splitlines()
+
+    def tag_exists(self, name):
+        return check_01(['git', 'show-ref', '--verify', '-q',
+                         'refs/tags/' + name])
+
+    def tags_exist(self, names):
+        return check_01_many(['git', 'show-ref', '--verify', '-q',
+                              'refs/tags/' + name] for name in names)
+
+    def tag_sha(self, name):
+        return get_output(['git', 'show-ref', '--verify', '--hash',
+                           'refs/tags/' + name])
+
+    def tags_pointing_at(self, treeish):
+        return get_output(['git', 'tag', '--points-at', treeish]).splitlines()
+
+    def headline(self, treeish):
+        return get_output(['git', 'log', '--format=%s', '-n1', treeish, '--'])
+
+    def full_message(self, treeish):
+        raw = get_output(['git', 'rev-list', '--format=%B', '-s', '-n1',
+                          treeish])
+        # git returns empty line at the end. Splitlines removes last empty line
+        return os.linesep.join(raw.splitlines()[1:])
+
+    def parent(self, treeish, number):
+        return get_output_01(['git', 'rev-parse', '-q', '--verify',
+                              treeish + '^' + str(number)])
+
+    def parents(self, treeish):
+        return re.findall(' (\w+)', get_output(['git', 'rev-list', '-n1',
+                                                '--parents', treeish, '--']))
+
+    def is_ancestor(self, ancestor, descendant):
+        return check_01(['git', 'merge-base', '--is-ancestor', ancestor,
+                         descendant])
+
+    def is_ancestor_many(self, pairs):
+        return check_01_many(['git', 'merge-base', '--is-ancestor', a, d]
+                             for a, d in pairs)
+
+    def first_parent_walk(self, ancestor, descendant):
+        return iter_lines(['git', 'rev-list', '--first-parent',
+                           ancestor + '..' + descendant, '--'],
+                          encoding='ascii')
+
+    def find(self, start_commits=None, first_parent=False, regexps=None,
+             match_all=False):
+        return list(iter_lines(
+            ['git', 'rev-list'] +
+            (['--first-parent'] if first_parent else []) +
+            (['--all-match'] if match_all else []) +
+            (['-E'] + ['--grep=' + r for r in regexps] if regexps else []) +
+            (start_commits if start_commits else ['--all']) + ['--'],
+            encoding='ascii'))
+
+    def commits_between(self, treeish1, treeish2, reverse=False,
+                        regexps=None, match_all=False):
+        return list(iter_lines(
+            ['git', 'rev-list', '--ancestry-path', '--topo-order'] +
+            ['--first-parent'] + (['--reverse'] if reverse else []) +
+            (['-E'] + ['--grep=' + r for r in regexps] if regexps else []) +
+            (['--all-match'] if match_all else []) +
+            [treeish1 + '..' + treeish2] + ['--'], encoding='ascii'))
+
+
+def read_config(path):
+    """Returns {'section.key' or 'section.subsection.key': value} read from
+    git config file. Section and key names are lowercased, includes are not
+    followed. Returns empty dict if file can't be read.
+    """
+    result = dict()
+    section = ''
+    try:
+        with open(path, encoding='utf-8', errors='replace') as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return result
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        match = re.match(r'\[\s*([\w.-]+)\s*(?:"(.*)")?\s*\]', line)
+        if match:
+            section = match.group(1).lower()
+            if match.group(2) is not None:
+                section += '.' + match.group(2)
+            continue
+        key, equals, value = line.partition('=')
+        value = re.sub(r'\s[#;].*$', '', value).strip().strip('"')
+        result[section + '.' + key.strip().lower()] = (value if equals
+                                                        else 'true')
+    return result
+
+
+def is_valid_ref(ref):
+    """Checks full ref name by the rules of git check-ref-format"""
+    return '/' in ref and not _bad_ref_re.search(ref)
+
+
+def subject(message):
+    """Returns subject of commit message as git log --format=%s does:
+    first paragraph joined into a single line
+    """
+    lines = message.split('\n')
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    result = []
+    for line in lines:
+        if not line.strip():
+            break
+        result.append(line.rstrip())
+    return ' '.join(result)
+
+
+class Reachable:
+    """Set of commits reachable from start commits. Commits are discovered
+    lazily, highest generations first, so asking for a commit of a close
+    generation doesn't walk the whole history. parents(commit) returns
+    parents, generation(commit) must be greater than generations of parents.
+    Commits may be anything hashable, e.g. SHAs or positions in commit-graph.
+    """
+    def __init__(self, starts, parents, generation):
+        self.parents = parents
+        self.generation = generation
+        self.seen = set(starts)
+        self.counter = itertools.count()  # commits themselves aren't compared
+        self.queue = [(-generation(c), next(self.counter), c)
+                      for c in self.seen]
+        heapq.heapify(self.queue)
+
+    def __contains__(self, commit):
+        generation = self.generation(commit)
+        while self.queue and -self.queue[0][0] >= generation:
+            current = heapq.heappop(self.queue)[2]
+            for parent in self.parents(current):
+                if parent not in self.seen:
+                    self.seen.add(parent)
+                    heapq.heappush(self.queue, (-self.generation(parent),
+                                                next(self.counter), parent))
+        return commit in self.seen
+
+
+backends = {'subprocess': SubprocessBackend}
+__instances = dict()  # backends by git dir
+__installed = dict()  # backends given to use() by git dir
+__lock = threading.Lock()
+
+
+def __create(git_dir):
+    if cassette.mode is not None:
+        return SubprocessBackend(git_dir)  # cassettes hold git calls only
+    name = os.environ.get('GIT_WRAPPER_BACKEND') or read_config(
+        os.path.join(repo.get_common_dir(git_dir), 'config')).get(
+            'thingitwrapper.backend', 'subprocess')
+    if name == 'python' and 'python' not in backends:
+        from thingitwrapper import pure  # registers itself
+    if name not in backends:
+        logging.warning('Unknown thingitwrapper backend ' + name +
+                        ', using subprocess')
+        name = 'subprocess'
+    try:
+        return backends[name](git_dir)
+    except Unsupported as error:
+        logging.info('Backend ' + name + ' is not usable for ' + git_dir +
+                     ': ' + str(error) + '. Using subprocess')
+        return SubprocessBackend(git_dir)
+
+
+def get():
+    """Returns backend of current repository"""
+    git_dir = repo.get_git_dir()
+    if git_dir is None:
+        return SubprocessBackend()  # let git complain
+    backend = __installed.get(git_dir) or __instances.get(git_dir)
+    if backend is None:
+        backend = __create(git_dir)
+        with __lock:
+            backend = __instances.setdefault(git_dir, backend)
+    return backend
+
+
+def forget(git_dir=None):
+    """Drops backend of repository, of all repositories if git_dir is None.
+    Next get() will choose backend again.
+    """
+    with __lock:
+        if git_dir:
+            __instances.pop(git_dir, None)
+        else:
+            __instances.clear()
+
+
+def use(backend, git_dir=None):
+    """Makes get() return backend for repository of git_dir, current
+    repository by default, until use(None) is called for it. Installed
+    backends aren't dropped by forget().
+    """
+    git_dir = git_dir or repo.get_git_dir()
+    with __lock:
+        if backend is None:
+            __installed.pop(git_dir, None)
+        else:
+            __installed[git_dir] = backend
@@ -3,39 +3,46 @@
 import re
 import sys
 
-from thingitwrapper.aux import get_output, call, check_01, get_output_01
+from thingitwrapper import backend
+from thingitwrapper.aux import get_output, call
 
 
 if 'thingitwrapper.cached' in sys.modules:
-    from thingitwrapper.grouped_cache import cache, invalidate
+    from thingitwrapper.grouped_cache import cache, \
+        invalidate_current_repo as invalidate
 else:
-    from thingitwrapper.stub_cache import cache, invalidate
+    from thingitwrapper.stub_cache import cache, \
+        invalidate_current_repo as invalidate
 
 
 def get_list(patterns=None):
     """ List all branches if pattern is empty list, branches matching any
     pattern (shell wildcard) otherwise
     """
-    output = get_output(['git', 'branch', '--list'] +
-                        (patterns if patterns else []))
-    return re.sub('[ *]', '', output).splitlines()
+    return backend.get().branch_list(patterns)
 
 
 @cache('branches')
 def get_current():
     """Returns current branch name or None if in detached HEAD state"""
-    return get_output_01(['git', 'symbolic-ref', '--short', '--q', 'HEAD'])
+    return backend.get().current_branch()
 
 
 @cache('branches')
 def get_head_sha(name):
-    return get_output(['git', 'show-ref', '--verify', '--hash',
-                       'refs/heads/' + name])
+    return backend.get().branch_sha(name)
 
 
 @cache('branches')
 def exists(name):
-    return check_01(['git', 'show-ref', '--verify', '-q', 'refs/heads/' + name])
+    return backend.get().branch_exists(name)
+
+
+def exists_many(names):
+    """Returns list of booleans telling whether branches exist. Names are
+    checked in parallel.
+    """
+    return backend.get().branches_exist(names)
 
 
 def get_branches_containing(treeish):
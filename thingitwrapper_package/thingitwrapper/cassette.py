@@ -0,0 +1,123 @@
+"""Recording and replaying of git calls.
+
+Set GIT_WRAPPER_RECORD=path to write outcome of every command run by aux and
+aux_async to path, GIT_WRAPPER_REPLAY=path to take outcomes from such file
+instead of running commands. Replay needs neither git nor repository, so
+recorded run may be reproduced elsewhere and time spent outside git measured.
+File is gzipped JSON lines, one per call:
+    {"function": ..., "argv": [...], "cwd": ..., "env": {...},
+     "outcome": ...}
+cwd is relative to process CWD at the moment recording started, env holds
+GIT_* variables of environment command was explicitly given. Calls are
+matched by all of these, calls matching the same record are answered in the
+order they were recorded, the last answer is repeated when recorded ones are
+exhausted. Backends reading repository themselves aren't used meanwhile.
+"""
+
+import atexit
+import collections
+import gzip
+import io
+import json
+import os
+import threading
+
+
+class CassetteMiss(Exception):
+    """Command being replayed wasn't recorded"""
+
+
+__lock = threading.Lock()
+__file = None
+__base = None  # directory recorded paths are relative to
+__outcomes = dict()  # {key: deque of outcomes}
+__last = dict()  # {key: outcome answered last}
+mode = None  # None, 'record' or 'replay'
+
+
+def record(path):
+    """Starts writing outcomes of commands to path"""
+    global __file, __base, mode
+    stop()
+    with __lock:
+        # text modes of gzip.open appeared in Python 3.3
+        __file = io.TextIOWrapper(gzip.open(path, 'wb'), encoding='utf-8')
+        __base = os.getcwd()
+        mode = 'record'
+
+
+def replay(path):
+    """Starts answering commands by outcomes read from path"""
+    global __base, mode
+    stop()
+    with io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    with __lock:
+        __base = os.getcwd()
+        for item in records:
+            __outcomes.setdefault(
+                __key(item['function'], item['argv'], item['cwd'],
+                      item['env']), collections.deque()).append(
+                item['outcome'])
+        mode = 'replay'
+
+
+def stop():
+    """Stops recording or replaying, flushing recorded file"""
+    global __file, mode
+    with __lock:
+        mode = None
+        if __file is not None:
+            __file.close()
+            __file = None
+        __outcomes.clear()
+        __last.clear()
+
+
+def __key(function, argv, cwd, env):
+    return json.dumps([function, argv, cwd, env], sort_keys=True)
+
+
+def __git_env(env):
+    """Environment of process is the same for all calls, so only explicitly
+    given one tells calls apart
+    """
+    return dict((k, v) for k, v in (env or {}).items()
+                if k.startswith('GIT_') and not k.startswith('GIT_WRAPPER_'))
+
+
+def __relative(cwd):
+    return os.path.relpath(cwd, __base)
+
+
+def store(function, argv, cwd, env, outcome):
+    """Writes JSON-serializable outcome of function(argv) run in cwd with
+    environment env (None for environment of process)
+    """
+    line = json.dumps({'function': function, 'argv': list(argv),
+                       'cwd': __relative(cwd), 'env': __git_env(env),
+                       'outcome': outcome}, sort_keys=True) + '\n'
+    with __lock:
+        if __file is not None:
+            __file.write(line)
+
+
+def load(function, argv, cwd, env):
+    """Returns outcome stored for function(argv), raises CassetteMiss if
+    there is none
+    """
+    key = __key(function, list(argv), __relative(cwd), __git_env(env))
+    with __lock:
+        outcomes = __outcomes.get(key)
+        if outcomes:
+            __last[key] = outcomes.popleft()
+        if key not in __last:
+            raise CassetteMiss(function + ' ' + ' '.join(argv) + ' in ' + cwd)
+        return __last[key]
+
+
+if os.environ.get('GIT_WRAPPER_REPLAY'):
+    replay(os.environ['GIT_WRAPPER_REPLAY'])
+elif os.environ.get('GIT_WRAPPER_RECORD'):
+    record(os.environ['GIT_WRAPPER_RECORD'])
+atexit.register(stop)
@@ -1,19 +1,21 @@
 """Commit-related functionality wrapper"""
 
 import logging
-import os
 import re
 import sys
 
 from thingitwrapper.aux import get_output, get_output_and_exit_code,\
-    GitUnexpectedError, call, check_01, get_output_01
-from thingitwrapper import misc
+    GitUnexpectedError, call, check_01, iter_lines
+from thingitwrapper import backend, firstparent, misc
 
 
 if 'thingitwrapper.cached' in sys.modules:
-    from thingitwrapper.grouped_cache import cache, invalidate
+    from thingitwrapper.grouped_cache import cache, \
+        invalidate_current_repo as invalidate
+    from thingitwrapper.shared_cache import persistent
 else:
-    from thingitwrapper.stub_cache import cache, invalidate
+    from thingitwrapper.stub_cache import cache, persistent, \
+        invalidate_current_repo as invalidate
 
 
 class AlreadyMergedError(Exception):
@@ -23,15 +25,15 @@ class AlreadyMergedError(Exception):
 
 
 @cache('branches', 'tags', 'commits')  # any ref may be given
+@persistent(0)
 def get_headline(treeish):
-    return get_output(['git', 'log', '--format=%s', '-n1', treeish, '--'])
+    return backend.get().headline(treeish)
 
 
 @cache('branches', 'tags', 'commits')  # any ref may be given
+@persistent(0)
 def get_full_message(treeish):
-    raw = get_output(['git', 'rev-list', '--format=%B', '-s', '-n1', treeish])
-    # git returns empty line at the end. Splitlines removes last empty line
-    return os.linesep.join(raw.splitlines()[1:])
+    return backend.get().full_message(treeish)
 
 
 def find(start_commits=None, first_parent=False, regexps=None, match_all=False):
@@ -41,20 +43,16 @@ def find(start_commits=None, first_parent=False, regexps=None, match_all=False):
     given regexps, unless match_all is set to True.
     If first_parent is set to True, exclude merged branches from search.
     Returns list of SHA"""
-    return get_output(
-        ['git', 'rev-list'] +
-        (['--first-parent'] if first_parent else []) +
-        (['--all-match'] if match_all else []) +
-        (['-E'] + ['--grep=' + r for r in regexps] if regexps else []) +
-        (start_commits if start_commits else ['--all']) + ['--']).splitlines()
+    return backend.get().find(start_commits, first_parent, regexps, match_all)
 
 
 @cache('branches')
 def get_current_sha():
-    return get_output(['git', 'rev-parse', 'HEAD'])
+    return backend.get().rev_parse('HEAD')
 
 
 @cache('branches', 'tags', 'commits')  # any ref may be given
+@persistent(0, 1)
 def is_ancestor(ancestor, descendant):
     """Works with Git1.8+"""
     # I'd say a commit is rather not ancestor of itself, although git does
@@ -62,39 +60,61 @@ def is_ancestor(ancestor, descendant):
     if misc.rev_parse(ancestor) == misc.rev_parse(descendant):
         return False
     else:
-        return check_01(['git', 'merge-base', '--is-ancestor', ancestor,
-                         descendant])
+        return backend.get().is_ancestor(ancestor, descendant)
 
 
 @cache('branches', 'tags', 'commits')  # any ref may be given
+@persistent(0, 1)
 def is_based_on(ancestor, descendant):
     """This checks whether ancestor is reachable from descendant via
     first-parent tree traversal.
     """
-    rev_list = get_output(['git', 'rev-list', '--first-parent',
-                           ancestor + '..' + descendant, '--']).splitlines()
-    if not rev_list:
+    last = None
+    for last in backend.get().first_parent_walk(ancestor, descendant):
+        pass
+    if last is None:
         return False
     else:
         # git rev-list --first-parent will print some commits even if ancestor
         # is not reachable via traverse by first parent, so check if ancestor
         # is indeed first parent of last commit rev-list returned
-        return misc.rev_parse(ancestor) == get_parent(rev_list[-1], 1)
+        return misc.rev_parse(ancestor) == get_parent(last, 1)
+
+
+def is_ancestor_many(pairs):
+    """Returns {(ancestor, descendant): is_ancestor(ancestor, descendant)}.
+    Pairs are answered by a single batch of backend: git processes run at
+    once, in-process backends walk every descendant once.
+    """
+    pairs = list(set(pairs))
+    shas = misc.rev_parse_many(t for pair in pairs for t in pair)
+    asked = [(a, d) for a, d in zip(shas[::2], shas[1::2]) if a != d]
+    answers = dict(zip(asked, backend.get().is_ancestor_many(asked)))
+    return dict((pair, answers.get((a, d), False))
+                for pair, a, d in zip(pairs, shas[::2], shas[1::2]))
+
+
+def is_based_on_many(pairs):
+    """Returns {(ancestor, descendant): is_based_on(ancestor, descendant)}.
+    First-parent chain of every descendant is read once, see firstparent
+    module. Annotated tags are peeled.
+    """
+    pairs = list(set(pairs))
+    return dict(zip(pairs, firstparent.is_based_on_many(pairs)))
 
 
 @cache('branches', 'tags', 'commits')  # any ref may be given
+@persistent(0)
 def get_parent(treeish, number):
     """Get parent commit SHA. If commit is merge commit, use number to select
     which parent to return. Parent #1 belongs to merge target. If specified
     parent doesn't exist, returns None
     """
-    return get_output_01(['git', 'rev-parse', '-q', '--verify',
-                          treeish + '^' + str(number)])
+    return backend.get().parent(treeish, number)
 
 
 def get_parents(treeish):
-    return re.findall(' (\w+)', get_output(['git', 'rev-list', '-n1',
-                                            '--parents', treeish, '--']))
+    return backend.get().parents(treeish)
 
 
 def get_commits_between(treeish1, treeish2, reverse=False, regexps=None,
@@ -108,12 +128,8 @@ def get_commits_between(treeish1, treeish2, reverse=False, regexps=None,
     Results matching any of regexps will be produced if match_all==False,
     matching all regexps otherwise.
     """
-    return get_output(
-        ['git', 'rev-list', '--ancestry-path', '--topo-order'] +
-        ['--first-parent'] + (['--reverse'] if reverse else []) +
-        (['-E'] + ['--grep=' + r for r in regexps] if regexps else []) +
-        (['--all-match'] if match_all else []) +
-        [treeish1 + '..' + treeish2] + ['--']).splitlines()
+    return backend.get().commits_between(treeish1, treeish2, reverse,
+                                         regexps, match_all)
 
 
 def merge(treeish, description=None):
@@ -132,15 +148,13 @@ def merge(treeish, description=None):
             return True
     else:
         if code == 1:
-            if not merge.conflict_re:
-                merge.conflict_re = re.compile(
-                    '^CONFLICT .*: Merge conflict in .*$', re.MULTILINE)
             if merge.conflict_re.search(output):
                 invalidate('index')
                 return False
             raise GitUnexpectedError('Git merge returned ' + str(code) +
                                      '. Output: ' + output)
-merge.conflict_re = None
+merge.conflict_re = re.compile('^CONFLICT .*: Merge conflict in .*$',
+                               re.MULTILINE)
 
 
 def abort_merge():
@@ -187,6 +201,6 @@ def commit(message=None, allow_empty=False):
 
 def get_root_commits():
     """Requires Git 1.7.4.2"""
-    return get_output(
-        ['git', 'rev-list', '--max-parents=0', 'HEAD']).splitlines()
+    return list(iter_lines(['git', 'rev-list', '--max-parents=0', 'HEAD'],
+                           encoding='ascii'))
 
@@ -0,0 +1,233 @@
+"""First-parent ancestry kept in arrays.
+
+Commits get dense numbers in the order they are met. First parent of every
+commit (-1 for roots) and length of its first-parent chain (depth) are kept
+in array('i'), jump tables (2^k-th first parent) are built on demand. So
+"is commit A on first-parent chain of commit B" takes O(log n) steps: B is
+lifted by depth(B) - depth(A) first parents and compared to A. Chain of a
+commit is read when the commit is asked about first time, down to the
+commits reachable from the commit added before it if that leads to a known
+one, whole chain otherwise.
+If NumPy is installed batches of such questions are answered by vectorized
+lookups at once, otherwise they are answered one by one by the same
+algorithm.
+Commits lying on a single first-parent chain (iteration tags usually do) are
+sorted topologically by their depths.
+Graphs are dropped along with caches of the repository, see
+grouped_cache.register_store.
+"""
+
+from array import array
+import sys
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from thingitwrapper import backend, repo
+
+if 'thingitwrapper.cached' in sys.modules:
+    from thingitwrapper.grouped_cache import register_store
+else:
+    from thingitwrapper.stub_cache import register_store
+
+
+class FirstParentGraph:
+    """First-parent chains of commits of a single repository"""
+    def __init__(self):
+        self.numbers = dict()  # {SHA: number}
+        self.shas = []  # SHAs by numbers
+        self.parents = array('i')  # first parents by numbers
+        self.depths = array('i')  # chain lengths by numbers, roots have 1
+        self.jumps = []  # [array of 2^k-th first parents]
+        self.vectors = None  # (jumps, depths) as NumPy arrays
+        self.last = None  # SHA added last
+        self.lock = threading.Lock()
+
+    def add(self, sha):
+        """Numbers first-parent chain of commit SHA sha"""
+        if sha in self.numbers:
+            return
+        instance = backend.get()
+        chain = None
+        if self.last:
+            chain = list(instance.first_parent_walk(self.last, sha))
+            parent = instance.parent(chain[-1], 1) if chain else None
+            if chain and parent in self.numbers:
+                chain.append(parent)
+            elif not chain or parent:
+                chain = None  # chain goes aside of known commits
+        if chain is None:
+            chain = instance.find([sha], True)
+        with self.lock:
+            self.last = sha
+            # new commits are on top of the chain, the rest is known
+            top = 0
+            while top < len(chain) and chain[top] not in self.numbers:
+                top += 1
+            parent = self.numbers[chain[top]] if top < len(chain) else -1
+            for new in reversed(chain[:top]):
+                self.numbers[new] = len(self.shas)
+                self.shas.append(new)
+                self.parents.append(parent)
+                self.depths.append(self.depths[parent] + 1
+                                   if parent >= 0 else 1)
+                parent = self.numbers[new]
+            if top:
+                self.jumps = []
+                self.vectors = None
+
+    def __get_jumps(self):
+        with self.lock:
+            if not self.jumps:
+                jumps = [self.parents]
+                while 1 << len(jumps) < len(self.shas):
+                    last = jumps[-1]
+                    jumps.append(array('i', (last[p] if p >= 0 else -1
+                                             for p in last)))
+                self.jumps = jumps
+            return self.jumps
+
+    def __get_vectors(self):
+        with self.lock:
+            if self.vectors is None:
+                parents = numpy.array(self.parents, dtype=numpy.intc)
+                jumps = [parents]
+                while 1 << len(jumps) < len(self.shas):
+                    last = jumps[-1]
+                    jumps.append(numpy.where(last >= 0, last[last], -1))
+                self.vectors = (jumps, numpy.array(self.depths,
+                                                   dtype=numpy.intc))
+            return self.vectors
+
+    def __lift(self, number, steps):
+        jumps = self.__get_jumps()
+        k = 0
+        while steps and number >= 0:
+            if steps & 1:
+                number = jumps[k][number]
+            steps >>= 1
+            k += 1
+        return number
+
+    def position(self, sha, tip):
+        """Returns depth of numbered commit sha if it is on first-parent
+        chain of numbered commit tip (tip included), None otherwise
+        """
+        number, tip_number = self.numbers.get(sha), self.numbers[tip]
+        if number is None:
+            return None
+        steps = self.depths[tip_number] - self.depths[number]
+        if steps < 0 or self.__lift(tip_number, steps) != number:
+            return None
+        return self.depths[number]
+
+    def positions_many(self, shas, tips):
+        """Same as position for every pair of shas and tips, vectorized if
+        NumPy is available
+        """
+        shas, tips = list(shas), list(tips)
+        if numpy is None or not shas:
+            return [self.position(sha, tip) for sha, tip in zip(shas, tips)]
+        jumps, depths = self.__get_vectors()
+        numbers = numpy.array([self.numbers.get(sha, -1) for sha in shas],
+                              dtype=numpy.intc)
+        lifted = numpy.array([self.numbers[tip] for tip in tips],
+                             dtype=numpy.intc)
+        known = numbers >= 0
+        steps = numpy.where(known, depths[lifted] - depths[numbers], -1)
+        on_chain = steps >= 0
+        for k, jump in enumerate(jumps):
+            move = on_chain & ((steps >> k) & 1).astype(bool)
+            lifted[move] = jump[lifted[move]]
+            on_chain &= lifted >= 0
+        on_chain &= lifted == numbers
+        return [int(depths[n]) if found else None
+                for n, found in zip(numbers, on_chain)]
+
+
+__repositories = dict()  # {git dir: FirstParentGraph}
+__lock = threading.Lock()
+
+
+def get_graph():
+    """Returns FirstParentGraph of current repository"""
+    git_dir = repo.get_git_dir()
+    with __lock:
+        graph = __repositories.get(git_dir)
+        if graph is None:
+            graph = __repositories[git_dir] = FirstParentGraph()
+    return graph
+
+
+def __prepare(list_of_treeish, tips):
+    list_of_treeish = list(list_of_treeish)
+    resolved = backend.get().rev_parse_many(
+        t + '^{commit}' for t in list_of_treeish + list(tips))
+    shas, tip_shas = (resolved[:len(list_of_treeish)],
+                      resolved[len(list_of_treeish):])
+    graph = get_graph()
+    for tip in set(tip_shas):
+        graph.add(tip)
+    return graph, shas, tip_shas
+
+
+def positions(list_of_treeish, tip):
+    """Returns positions of commits on first-parent chain of tip: length of
+    chain below a commit, counting the commit. None for commits which aren't
+    on the chain. Positions don't change when tip moves forward.
+    """
+    list_of_treeish = list(list_of_treeish)
+    graph, shas, tips = __prepare(list_of_treeish,
+                                  [tip] * len(list_of_treeish))
+    return graph.positions_many(shas, tips)
+
+
+def is_based_on_many(pairs):
+    """Returns list of booleans telling if ancestor is on first-parent chain
+    of descendant for each (ancestor, descendant) pair, commit isn't based on
+    itself. Works like commit.is_based_on, but all pairs are answered at once.
+    """
+    pairs = list(pairs)
+    graph, ancestors, descendants = __prepare([a for a, _ in pairs],
+                                              [d for _, d in pairs])
+    return [position is not None and ancestor != descendant
+            for position, ancestor, descendant in zip(
+                graph.positions_many(ancestors, descendants), ancestors,
+                descendants)]
+
+
+def sort(list_of_treeish, reverse=False):
+    """Returns tuple of treeish ordered like misc.sort does (descendants
+    first, ancestors first if reverse) if all of them are on first-parent
+    chain of the newest one, None otherwise
+    """
+    list_of_treeish = list(list_of_treeish)
+    if not list_of_treeish:
+        return ()
+    shas = backend.get().rev_parse_many(t + '^{commit}'
+                                        for t in list_of_treeish)
+    graph = get_graph()
+    for sha in shas:
+        graph.add(sha)
+    tip = max(shas, key=lambda sha: graph.depths[graph.numbers[sha]])
+    depths = graph.positions_many(shas, [tip] * len(shas))
+    if None in depths:
+        return None
+    order = sorted(range(len(shas)),
+                   key=lambda i: depths[i] if reverse else -depths[i])
+    return tuple(list_of_treeish[i] for i in order)
+
+
+def forget(git_dir=None):
+    """Drops graph of repository, of all repositories if git_dir is None"""
+    with __lock:
+        if git_dir:
+            __repositories.pop(git_dir, None)
+        else:
+            __repositories.clear()
+
+
+register_store(forget)
@@ -1,15 +1,32 @@
-""" This module is a superstructure on top of the functools.lru_cache. It adds
-an ability to group function caches and clear them by group or all at once.
+""" This module implements LRU caches of function results which are grouped
+and could be cleared by group or all at once. Caches are safe to use from
+multiple threads: concurrent calls with same arguments compute the value only
+once, and values computed while the cache was being invalidated are returned to
+their callers, but never stored.
+Values are kept separately for every repository (see aux.working_dir), so a
+process may work with several repositories without invalidating caches on
+every switch. Caches of least recently used repositories are dropped when
+there are more than GIT_WRAPPER_CACHE_REPOS (16 by default) of them.
 The caching is safe for immutable objects only.
+
+Set GIT_WRAPPER_CACHE_STATS=path to dump cache statistics at exit. Statistics
+are written in Prometheus textfile format if path ends with '.prom' and as
+JSON otherwise.
 """
 
 
 import functools
 import collections
 import inspect
+import json
 import os
 import atexit
 import itertools
+import threading
+import time
+
+from thingitwrapper import backend, repo, shared_cache, trace
+from thingitwrapper.aux import get_cwd, coalesce_stats, perf_counter
 
 
 __lru_funcs_by_group = collections.defaultdict(list)
@@ -19,42 +36,251 @@ __lru_funcs_by_group = collections.defaultdict(list)
 # - commits
 # - index (includes working tree state)
 
+__lrus = dict()  # _LRU objects by decorated function
+# forget functions of stores kept outside of LRUs by groups, see
+# register_store. Stores registered without groups are under None.
+__stores_by_group = collections.defaultdict(list)
+# git dirs of repositories having cached values, least recently used first
+__repos = collections.OrderedDict()
+max_repos = int(os.environ.get('GIT_WRAPPER_CACHE_REPOS', '16'))
+# guards __lru_funcs_by_group and __repos, makes multi-group invalidation
+# atomic
+__registry_lock = threading.RLock()
+# Nesting depth of cache misses being computed by current thread. Used to
+# count wall time of outermost misses only, so nested cached calls are not
+# counted twice
+_miss_nesting = threading.local()
+_miss_time = {'total': 0.0}
+_miss_time_lock = threading.Lock()
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+
+class _Flight:
+    """Value being computed by some thread. Other threads asking for the same
+    key wait for it instead of computing it again.
+    """
+    def __init__(self, generation):
+        self.generation = generation
+        self.owner = threading.current_thread()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _LRU:
+    __kwargs_mark = object()
+
+    def __init__(self, func, maxsize):
+        self.func = func
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.values = dict()  # OrderedDicts of values by repository git dir
+        self.flights = dict()
+        # generation of repository cache is incremented by clear(). Values
+        # computed by flights of previous generations are considered stale.
+        self.generations = collections.defaultdict(int)
+        # hits and misses since last clear(), like functools.lru_cache does
+        self.hits = self.misses = 0
+        # counters accumulated since import
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'coalesced': 0,
+                      'miss_time': 0.0}
+
+    def __call__(self, args, kwargs):
+        git_dir = _use_repo()
+        key = (git_dir, args + (self.__kwargs_mark,) +
+               tuple(sorted(kwargs.items())) if kwargs else args)
+        join = False
+        with self.lock:
+            values = self.values.get(git_dir)
+            hit = values is not None and key[1] in values
+            if hit:
+                values.move_to_end(key[1])
+                self.hits += 1
+                self.stats['hits'] += 1
+                value = values[key[1]]
+            else:
+                flight = self.flights.get(key)
+                # thread may ask for the value it is computing itself
+                # (recursion), computing it again is the only way to avoid
+                # deadlock then
+                join = (flight is not None and
+                        flight.generation == self.generations[git_dir] and
+                        flight.owner is not threading.current_thread())
+                if join:
+                    self.hits += 1
+                    self.stats['hits'] += 1
+                    self.stats['coalesced'] += 1
+                else:
+                    flight = _Flight(self.generations[git_dir])
+                    self.flights[key] = flight
+                    self.misses += 1
+                    self.stats['misses'] += 1
+        if (hit or join) and trace.active:
+            trace.record_cache_hit(_func_name(self.func))
+        if hit:
+            return value
+        if join:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        return self.__fill(key, flight, args, kwargs)
+
+    def __fill(self, key, flight, args, kwargs):
+        depth = getattr(_miss_nesting, 'depth', 0)
+        _miss_nesting.depth = depth + 1
+        start = perf_counter()
+        try:
+            flight.result = self.func(*args, **kwargs)
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            spent = perf_counter() - start
+            _miss_nesting.depth = depth
+            if not depth:
+                with _miss_time_lock:
+                    _miss_time['total'] += spent
+            git_dir = key[0]
+            with self.lock:
+                self.stats['miss_time'] += spent
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                if (flight.error is None and
+                        flight.generation == self.generations[git_dir]):
+                    values = self.values.setdefault(
+                        git_dir, collections.OrderedDict())
+                    values[key[1]] = flight.result
+                    if (self.maxsize is not None and
+                            len(values) > self.maxsize):
+                        values.popitem(last=False)
+                        self.stats['evictions'] += 1
+            flight.done.set()
+
+    def clear(self, git_dirs=None):
+        """Clears values of repositories with given git dirs, all values if
+        git_dirs is None"""
+        with self.lock:
+            for git_dir in (tuple(self.values) + tuple(self.generations)
+                            if git_dirs is None else git_dirs):
+                self.values.pop(git_dir, None)
+                self.generations[git_dir] += 1
+            self.hits = self.misses = 0
+
+    def evict(self, git_dir):
+        with self.lock:
+            self.stats['evictions'] += len(self.values.pop(git_dir, ()))
+            self.generations.pop(git_dir, None)
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             sum(len(v) for v in self.values.values()))
+
+
+def _use_repo():
+    """Returns git dir of current repository and marks it as recently used"""
+    git_dir = repo.get_git_dir()
+    with __registry_lock:
+        if git_dir in __repos:
+            __repos.move_to_end(git_dir)
+        else:
+            __repos[git_dir] = None
+            while len(__repos) > max_repos:
+                evicted = __repos.popitem(last=False)[0]
+                for lru in __lrus.values():
+                    lru.evict(evicted)
+                for forget in set(itertools.chain(
+                        *__stores_by_group.values())):
+                    forget(evicted)
+    return git_dir
+
 
 def cache(*groups, maxsize=128):
     def decorator(func):
-        lru = functools.lru_cache(maxsize)(func)
-        if groups:
-            for group in groups:
-                __lru_funcs_by_group[group].append(lru)
-        else:
-            # use lru_funcs_by_group[None] as a default group
-            __lru_funcs_by_group[None].append(lru)
-        return lru
+        lru = _LRU(func, maxsize)
+
+        @functools.wraps(func)
+        def cached(*args, **kwargs):
+            return lru(args, kwargs)
+        cached.cache_clear = lru.clear
+        cached.cache_info = lru.info
+
+        with __registry_lock:
+            __lrus[cached] = lru
+            if groups:
+                for group in groups:
+                    __lru_funcs_by_group[group].append(cached)
+            else:
+                # use lru_funcs_by_group[None] as a default group
+                __lru_funcs_by_group[None].append(cached)
+        return cached
     return decorator
 
 
-def invalidate(*groups, dont_print_info=False):
-    """Calling invalidate() will clear all caches"""
-    if output_info and not dont_print_info:
-        fs_to_print = set()
-        for group in groups if groups else __lru_funcs_by_group.keys():
-            fs_to_print.update(set(__lru_funcs_by_group[group]))
-        if fs_to_print:
-            fr = inspect.currentframe()
-            from_ = (' from ' + os.path.basename(fr.f_back.f_code.co_filename) +
-                     ':' + str(fr.f_back.f_lineno)) if fr else ''
-            print(('Cache being invalidated' + from_).ljust(80, '-'))
-            print_cache_info(
-                {f: i for f, i in get_cache_info().items() if f in fs_to_print})
-    for group in groups if groups else __lru_funcs_by_group.keys():
-        for lru_func in __lru_funcs_by_group.get(group, []):
-            lru_func.cache_clear()
+def register_store(forget, *groups):
+    """Registers values kept by repository outside of cached functions, e.g.
+    an index in a module level dict by git dir. forget(git_dir) drops values
+    of a repository, forget(None) drops values of all of them. Values are
+    dropped along with caches of evicted repositories, on invalidation of all
+    caches and on invalidation of any of groups.
+    """
+    with __registry_lock:
+        for group in groups or (None,):
+            __stores_by_group[group].append(forget)
+
+
+def invalidate(*groups, dont_print_info=False, repo_path=None):
+    """Calling invalidate() will clear all caches. If repo_path is given,
+    clears only caches of repository it belongs to.
+    """
+    git_dirs = None if repo_path is None else (repo.get_git_dir(repo_path),)
+    with __registry_lock:
+        if output_info and not dont_print_info:
+            fs_to_print = set()
+            for group in groups if groups else __lru_funcs_by_group.keys():
+                fs_to_print.update(set(__lru_funcs_by_group[group]))
+            if fs_to_print:
+                fr = inspect.currentframe()
+                while fr and fr.f_code.co_filename == __file__:
+                    fr = fr.f_back
+                from_ = (' from ' + os.path.basename(fr.f_code.co_filename) +
+                         ':' + str(fr.f_lineno)) if fr else ''
+                print(('Cache being invalidated' + from_).ljust(80, '-'))
+                print_cache_info({f: i for f, i in get_cache_info().items()
+                                  if f in fs_to_print})
+        for group in groups if groups else tuple(__lru_funcs_by_group.keys()):
+            for lru_func in __lru_funcs_by_group.get(group, []):
+                __lrus[lru_func].clear(git_dirs)
+        for forget in set(itertools.chain(*(
+                __stores_by_group.get(group, []) for group in
+                (groups if groups else tuple(__stores_by_group.keys()))))):
+            for git_dir in git_dirs or (None,):
+                forget(git_dir)
+        if repo_path is None:
+            backend.forget()
+            repo.forget()
+
+
+def invalidate_current_repo(*groups):
+    """Clears caches of the repository current thread works with. If no groups
+    given, repository location is resolved again on next call, as it might
+    have been just created.
+    """
+    invalidate(*groups, repo_path=get_cwd())
+    if not groups:
+        backend.forget(repo.get_git_dir())
+        repo.forget(get_cwd())
 
 
 def get_cache_info():
     """Returns dict of cache info dicts.
-    get_cache_info is the only piece of code that knows about
-    functools._CacheInfo structure
+    get_cache_info is the only piece of code that knows about CacheInfo
+    structure
     """
     result = dict()
     for func in set(itertools.chain(*__lru_funcs_by_group.values())):
@@ -66,6 +292,110 @@ def get_cache_info():
     return result
 
 
+def _func_name(func):
+    return func.__module__ + '.' + getattr(func, '__qualname__', func.__name__)
+
+
+def get_cache_stats():
+    """Returns statistics accumulated since module import. Unlike
+    get_cache_info, counters aren't reset by invalidate().
+    Per-function miss time is wall time spent computing missed values, it
+    includes time spent in nested cached functions. Total miss time counts
+    nested calls once.
+    """
+    groups_by_func = collections.defaultdict(list)
+    for group, funcs in __lru_funcs_by_group.items():
+        for func in funcs:
+            groups_by_func[func].append(
+                'default' if group is None else group)
+
+    functions = dict()
+    for func, lru in tuple(__lrus.items()):
+        with lru.lock:
+            func_stats = dict(lru.stats)
+        func_stats['groups'] = sorted(groups_by_func[func])
+        functions[_func_name(func)] = func_stats
+
+    groups = dict()
+    for func_stats in functions.values():
+        for group in func_stats['groups']:
+            group_stats = groups.setdefault(group, dict.fromkeys(
+                ('hits', 'misses', 'evictions', 'coalesced', 'miss_time'),
+                0))
+            for key in group_stats:
+                group_stats[key] += func_stats[key]
+
+    return {'pid': os.getpid(),
+            'time': time.time(),
+            'functions': functions,
+            'groups': groups,
+            'miss_time': _miss_time['total'],
+            'shared': dict(shared_cache.stats),
+            'commands': dict(coalesce_stats)}
+
+
+def format_prometheus(stats):
+    """Formats get_cache_stats() output for Prometheus textfile collector"""
+    lines = []
+    for label, section in ('function', 'functions'), ('group', 'groups'):
+        prefix = 'thingitwrapper_cache_' + (
+            '' if label == 'function' else 'group_')
+        for key, metric, help_ in (
+                ('hits', 'hits_total', 'Cache hits'),
+                ('misses', 'misses_total', 'Cache misses'),
+                ('evictions', 'evictions_total', 'Values evicted by LRU'),
+                ('coalesced', 'coalesced_total',
+                 'Hits which waited for concurrent computation'),
+                ('miss_time', 'miss_seconds_total',
+                 'Wall time spent computing missed values')):
+            lines.append('# HELP ' + prefix + metric + ' ' + help_ + ' per ' +
+                         label + '.')
+            lines.append('# TYPE ' + prefix + metric + ' counter')
+            for name in sorted(stats[section]):
+                lines.append(prefix + metric + '{' + label + '="' + name +
+                             '"} ' + repr(stats[section][name][key]))
+    lines.append('# HELP thingitwrapper_cache_total_miss_seconds Wall time '
+                 'spent computing missed values, nested calls counted once.')
+    lines.append('# TYPE thingitwrapper_cache_total_miss_seconds counter')
+    lines.append('thingitwrapper_cache_total_miss_seconds ' +
+                 repr(stats['miss_time']))
+    for key in sorted(stats['shared']):
+        metric = 'thingitwrapper_shared_cache_' + key + '_total'
+        lines.append('# HELP ' + metric + ' Shared cache ' + key + '.')
+        lines.append('# TYPE ' + metric + ' counter')
+        lines.append(metric + ' ' + str(stats['shared'][key]))
+    for key, help_ in (
+            ('calls', 'Read-only git calls eligible for coalescing.'),
+            ('coalesced', 'Git calls served by identical running call.')):
+        metric = 'thingitwrapper_commands_' + key + '_total'
+        lines.append('# HELP ' + metric + ' ' + help_)
+        lines.append('# TYPE ' + metric + ' counter')
+        lines.append(metric + ' ' + str(stats['commands'][key]))
+    return '\n'.join(lines) + '\n'
+
+
+def export_cache_stats(path=None, format_=None):
+    """Writes get_cache_stats() output to path (defaults to
+    GIT_WRAPPER_CACHE_STATS). format_ is 'json' or 'prometheus', it is guessed
+    by file extension if not given. File is replaced atomically so collectors
+    never read it half-written.
+    """
+    path = path if path else stats_path
+    if not path:
+        return
+    if format_ is None:
+        format_ = 'prometheus' if path.endswith('.prom') else 'json'
+    stats = get_cache_stats()
+    if format_ == 'prometheus':
+        contents = format_prometheus(stats)
+    else:
+        contents = json.dumps(stats, indent=1, sort_keys=True) + '\n'
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(contents)
+    os.rename(temp_path, path)
+
+
 def print_cache_info(info=None):
     groups_by_func = collections.defaultdict(list)
     for group in __lru_funcs_by_group:
@@ -89,3 +419,7 @@ def print_cache_info(info=None):
 output_info = os.environ.get('GIT_WRAPPER_CACHE_INFO') == '1'
 if output_info:
     atexit.register(print_cache_info)
+
+stats_path = os.environ.get('GIT_WRAPPER_CACHE_STATS')
+if stats_path:
+    atexit.register(export_cache_stats)
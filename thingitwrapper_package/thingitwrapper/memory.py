@@ -0,0 +1,344 @@
+"""Repository kept in memory. MemoryBackend answers queries of branch, tag,
+commit and misc modules without git, so algorithms built on them may be run
+and measured on large synthetic histories. History is built with commit(),
+merge(), set_branch(), set_tag() and checkout(), then backend is installed:
+    history = MemoryBackend()
+    history.commit('first')
+    backend.use(history)
+Repository still needs a git dir to be told apart from other ones, though
+nothing is read from it. Modifying commands of wrappers still call git, they
+don't change the model.
+Commits have no trees and dates are the order they were created in, so
+commits made later are considered newer.
+"""
+
+import collections
+import fnmatch
+import hashlib
+import heapq
+import os
+import re
+import subprocess
+
+from thingitwrapper.backend import Backend, Reachable, is_valid_ref, subject
+
+
+_sha_re = re.compile('^[0-9a-f]{40}$')
+_short_sha_re = re.compile('^[0-9a-f]{4,39}$')
+_suffix_re = re.compile(r'\^\{(commit)?\}|\^([0-9]*)|~([0-9]*)')
+DWIM_RULES = ('{}', 'refs/{}', 'refs/tags/{}', 'refs/heads/{}',
+              'refs/remotes/{}', 'refs/remotes/{}/HEAD')
+STALE = 4  # flag of merge base search
+
+
+Commit = collections.namedtuple('Commit', (
+    'parents', 'message', 'date', 'generation'))
+Tag = collections.namedtuple('Tag', ('target', 'message'))
+
+
+class MemoryBackend(Backend):
+    def __init__(self, git_dir=None):
+        self.git_dir = git_dir
+        self.commits = dict()  # SHA: Commit
+        self.tags = dict()  # SHA of annotated tag: Tag
+        self.refs = dict()  # full ref name: SHA
+        self.head = 'refs/heads/master'  # ref name or SHA if detached
+        self.clock = 0
+
+    def __fail(self, *command):
+        raise subprocess.CalledProcessError(128, ['git'] + list(command))
+
+    def __new_sha(self, *fields):
+        self.clock += 1
+        return hashlib.sha1('\0'.join(
+            (str(self.clock),) + fields).encode()).hexdigest()
+
+    def __head_ref(self, branch):
+        return 'refs/heads/' + branch if branch else self.head
+
+    def __tip(self, ref):
+        return self.refs.get(ref) if ref.startswith('refs/') else ref
+
+    def commit(self, message, parents=None, branch=None):
+        """Adds commit and moves branch (current branch if None) to it.
+        Parents default to branch head. Returns SHA of new commit.
+        """
+        ref = self.__head_ref(branch)
+        if parents is None:
+            parents = [self.__tip(ref)] if self.__tip(ref) else []
+        parents = tuple(self.__commit_sha(p) for p in parents)
+        sha = self.__new_sha(message, *parents)
+        self.commits[sha] = Commit(parents, message, self.clock, 1 + max(
+            [0] + [self.commits[p].generation for p in parents]))
+        if ref.startswith('refs/'):
+            self.refs[ref] = sha
+        else:
+            self.head = sha
+        return sha
+
+    def merge(self, treeish, message, branch=None):
+        """Adds merge of treeish into branch (current branch if None)"""
+        ref = self.__head_ref(branch)
+        return self.commit(message, [self.__tip(ref), treeish], branch)
+
+    def set_branch(self, name, treeish):
+        self.refs['refs/heads/' + name] = self.__commit_sha(treeish)
+
+    def set_tag(self, name, treeish, message=None):
+        """Creates annotated tag if message is given"""
+        sha = self.rev_parse(treeish)
+        if message is not None:
+            target, sha = sha, self.__new_sha(message, sha)
+            self.tags[sha] = Tag(target, message)
+        self.refs['refs/tags/' + name] = sha
+
+    def checkout(self, treeish):
+        """Checks out branch or detaches HEAD at treeish"""
+        if 'refs/heads/' + treeish in self.refs:
+            self.head = 'refs/heads/' + treeish
+        else:
+            self.head = self.__commit_sha(treeish)
+
+    def __resolve_name(self, name):
+        if _sha_re.match(name) and (name in self.commits or
+                                    name in self.tags):
+            return name
+        if name == 'HEAD':
+            return self.__tip(self.head)
+        for rule in DWIM_RULES:
+            sha = self.refs.get(rule.format(name))
+            if sha:
+                return sha
+        if _short_sha_re.match(name):
+            found = [sha for objects in (self.commits, self.tags)
+                     for sha in objects if sha.startswith(name)]
+            if len(found) == 1:
+                return found[0]
+        return None
+
+    def __peel(self, sha):
+        while sha in self.tags:
+            sha = self.tags[sha].target
+        return sha
+
+    def rev_parse(self, treeish):
+        match = re.search('[~^]', treeish)
+        name = treeish[:match.start()] if match else treeish
+        sha = self.__resolve_name(name)
+        if sha is None:
+            self.__fail('rev-parse', treeish)
+        position = len(name)
+        while position < len(treeish):
+            match = _suffix_re.match(treeish, position)
+            if not match:
+                self.__fail('rev-parse', treeish)
+            position = match.end()
+            if match.group(0).startswith('^{'):
+                sha = self.__peel(sha)
+            elif match.group(0).startswith('^'):
+                number = int(match.group(2) or 1)
+                sha = self.__peel(sha)
+                if number:
+                    parents = self.commits[sha].parents
+                    if number > len(parents):
+                        self.__fail('rev-parse', treeish)
+                    sha = parents[number - 1]
+            else:
+                for _ in range(int(match.group(3) or 1)):
+                    parents = self.commits[self.__peel(sha)].parents
+                    if not parents:
+                        self.__fail('rev-parse', treeish)
+                    sha = parents[0]
+        return sha
+
+    def __commit_sha(self, treeish):
+        return self.__peel(self.rev_parse(treeish))
+
+    def __first_parents(self, sha):
+        while sha is not None:
+            yield sha
+            parents = self.commits[sha].parents
+            sha = parents[0] if parents else None
+
+    def __reachable(self, starts):
+        return Reachable(starts, lambda sha: self.commits[sha].parents,
+                         lambda sha: self.commits[sha].generation)
+
+    def __grep(self, shas, regexps, match_all):
+        if not regexps:
+            return shas
+        compiled = [re.compile(r, re.MULTILINE) for r in regexps]
+        check = all if match_all else any
+        return [sha for sha in shas if check(
+            r.search(self.commits[sha].message) for r in compiled)]
+
+    def sort(self, list_of_treeish, by_date=False, reverse=False):
+        list_of_treeish = list(list_of_treeish)
+        shas = [self.__commit_sha(t) for t in list_of_treeish]
+        # generations give topological order, dates break ties
+        order = sorted(range(len(shas)), reverse=not reverse, key=lambda i: (
+            self.commits[shas[i]].date if by_date else
+            (self.commits[shas[i]].generation, self.commits[shas[i]].date)))
+        positions = dict()
+        for i in order:
+            positions.setdefault(shas[i], len(positions))
+        order = sorted(range(len(shas)), key=lambda i: positions[shas[i]])
+        return tuple(list_of_treeish[i] for i in order)
+
+    def check_ref_format(self, ref):
+        return is_valid_ref(ref)
+
+    def merge_base(self, shas):
+        """Reduces commits pairwise, so octopus result may differ from git's
+        when there are several best common ancestors
+        """
+        shas = [self.__commit_sha(sha) for sha in shas]
+        result = shas[0]
+        for sha in shas[1:]:
+            result = self.__merge_base(result, sha)
+            if result is None:
+                raise subprocess.CalledProcessError(
+                    1, ['git', 'merge-base', '--octopus'] + shas)
+        return result
+
+    def __merge_base(self, sha1, sha2):
+        flags = {sha1: 1}
+        flags[sha2] = flags.get(sha2, 0) | 2
+        queue = [(-self.commits[sha].generation, sha) for sha in flags]
+        heapq.heapify(queue)
+        found = []
+        while any(not flags[sha] & STALE for _, sha in queue):
+            _, sha = heapq.heappop(queue)
+            flag = flags[sha]
+            if flag & 3 == 3 and not flag & STALE:
+                found.append(sha)
+                flag |= STALE
+            for parent in self.commits[sha].parents:
+                if parent not in flags:
+                    heapq.heappush(queue, (-self.commits[parent].generation,
+                                           parent))
+                flags[parent] = flags.get(parent, 0) | flag
+        return max(found, key=lambda sha: self.commits[sha].date) \
+            if found else None
+
+    def branch_list(self, patterns=None):
+        names = sorted(ref[len('refs/heads/'):] for ref in self.refs
+                       if ref.startswith('refs/heads/'))
+        if patterns:
+            names = [n for n in names
+                     if any(fnmatch.fnmatchcase(n, p) for p in patterns)]
+        return names
+
+    def branch_exists(self, name):
+        return 'refs/heads/' + name in self.refs
+
+    def branch_sha(self, name):
+        if not self.branch_exists(name):
+            self.__fail('show-ref', '--verify', '--hash', 'refs/heads/' + name)
+        return self.refs['refs/heads/' + name]
+
+    def current_branch(self):
+        if self.head.startswith('refs/heads/'):
+            return self.head[len('refs/heads/'):]
+        return None
+
+    def tag_list(self, pattern=''):
+        names = sorted(ref[len('refs/tags/'):] for ref in self.refs
+                       if ref.startswith('refs/tags/'))
+        if pattern:
+            names = [n for n in names if fnmatch.fnmatchcase(n, pattern)]
+        return names
+
+    def tag_exists(self, name):
+        return 'refs/tags/' + name in self.refs
+
+    def tag_sha(self, name):
+        if not self.tag_exists(name):
+            self.__fail('show-ref', '--verify', '--hash', 'refs/tags/' + name)
+        return self.refs['refs/tags/' + name]
+
+    def tags_pointing_at(self, treeish):
+        sha = self.rev_parse(treeish)
+        return [name for name in self.tag_list()
+                if sha in (self.refs['refs/tags/' + name],
+                           self.tags.get(self.refs['refs/tags/' + name],
+                                         Tag(None, None)).target)]
+
+    def headline(self, treeish):
+        return subject(self.commits[self.__commit_sha(treeish)].message)
+
+    def full_message(self, treeish):
+        return os.linesep.join(
+            self.commits[self.__commit_sha(treeish)].message.splitlines())
+
+    def parent(self, treeish, number):
+        sha = self.__commit_sha(treeish)
+        if number == 0:
+            return sha
+        parents = self.commits[sha].parents
+        return parents[number - 1] if number <= len(parents) else None
+
+    def parents(self, treeish):
+        return list(self.commits[self.__commit_sha(treeish)].parents)
+
+    def is_ancestor(self, ancestor, descendant):
+        return self.__commit_sha(ancestor) in self.__reachable(
+            [self.__commit_sha(descendant)])
+
+    def is_ancestor_many(self, pairs):
+        # descendants are walked once for all of their ancestors
+        reachable = dict()
+        result = []
+        for ancestor, descendant in pairs:
+            sha = self.__commit_sha(descendant)
+            if sha not in reachable:
+                reachable[sha] = self.__reachable([sha])
+            result.append(self.__commit_sha(ancestor) in reachable[sha])
+        return result
+
+    def first_parent_walk(self, ancestor, descendant):
+        excluded = self.__reachable([self.__commit_sha(ancestor)])
+        for sha in self.__first_parents(self.__commit_sha(descendant)):
+            if sha in excluded:
+                return
+            yield sha
+
+    def find(self, start_commits=None, first_parent=False, regexps=None,
+             match_all=False):
+        if start_commits:
+            starts = [self.__commit_sha(t) for t in start_commits]
+        else:
+            starts = [self.__peel(sha) for sha in self.refs.values()]
+            head = self.__resolve_name('HEAD')
+            if head:
+                starts.append(head)
+        found = set()
+        stack = list(starts)
+        while stack:
+            sha = stack.pop()
+            if sha not in found:
+                found.add(sha)
+                parents = self.commits[sha].parents
+                stack.extend(parents[:1] if first_parent else parents)
+        shas = sorted(found, key=lambda sha: -self.commits[sha].date)
+        return self.__grep(shas, regexps, match_all)
+
+    def commits_between(self, treeish1, treeish2, reverse=False,
+                        regexps=None, match_all=False):
+        start = self.__commit_sha(treeish1)
+        excluded = self.__reachable([start])
+        result = []
+        for sha in self.__first_parents(self.__commit_sha(treeish2)):
+            if sha in excluded:
+                if sha != start:
+                    # first parents don't lead to start: keep descendants of
+                    # start only. Once a commit isn't one, its ancestors
+                    # aren't either.
+                    for i, kept in enumerate(result):
+                        if start not in self.__reachable([kept]):
+                            del result[i:]
+                            break
+                break
+            result.append(sha)
+        result = self.__grep(result, regexps, match_all)
+        return result[::-1] if reverse else result
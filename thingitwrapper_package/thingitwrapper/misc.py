@@ -2,18 +2,22 @@
 tag, branch and commit modules.
 """
 
-import collections
+import os
 import sys
 
 
+from thingitwrapper import backend, firstparent
 from thingitwrapper.aux import get_output, call, get_output_01,\
-    get_output_and_exit_code, GitUnexpectedError, check_01
+    get_output_and_exit_code, GitUnexpectedError, get_cwd, iter_lines
 
 
 if 'thingitwrapper.cached' in sys.modules:
-    from thingitwrapper.grouped_cache import cache, invalidate
+    from thingitwrapper.grouped_cache import cache, \
+        invalidate_current_repo as invalidate
+    from thingitwrapper.shared_cache import persistent
 else:
-    from thingitwrapper.stub_cache import cache, invalidate
+    from thingitwrapper.stub_cache import cache, persistent, \
+        invalidate_current_repo as invalidate
 
 
 def is_working_tree_clean(untracked=False):
@@ -41,9 +45,16 @@ def get_untracked_files():
 def list_files_differ(treeish1, treeish2):
     """Returns list of files which is different between treeish1 and treeish2
     """
-    diff = get_output(['git', 'diff', '--numstat', treeish1,
-                       treeish2, '--']).splitlines()
-    return [line.rsplit('\t', 1)[1] for line in diff if line]
+    return list(_get_files_differ(treeish1, treeish2))
+
+
+@cache('branches', 'tags', 'commits')  # any ref may be given
+@persistent(0, 1)
+def _get_files_differ(treeish1, treeish2):
+    """Returns tuple, so cached value can't be changed by callers"""
+    # only paths are decoded
+    return tuple(line.rsplit(b'\t', 1)[1].decode() for line in iter_lines(
+        ['git', 'diff', '--numstat', treeish1, treeish2, '--']) if line)
 
 
 @cache()
@@ -61,7 +72,9 @@ def in_git_repo():
 
 @cache()
 def get_git_dir():
-    return get_output(['git', 'rev-parse', '--git-dir'])
+    """Returns absolute path, so result doesn't depend on CWD"""
+    return os.path.normpath(os.path.join(
+        get_cwd(), get_output(['git', 'rev-parse', '--git-dir'])))
 
 
 def get_root_dir():
@@ -70,7 +83,12 @@ def get_root_dir():
 
 @cache('branches', 'commits', 'tags')
 def rev_parse(treeish):
-    return get_output(['git', 'rev-parse', treeish])
+    return backend.get().rev_parse(treeish)
+
+
+def rev_parse_many(list_of_treeish):
+    """Returns list of SHAs of given treeish resolved by a single git call"""
+    return backend.get().rev_parse_many(list_of_treeish)
 
 
 def sort(list_of_treeish, by_date=False, reverse=False):
@@ -78,20 +96,23 @@ def sort(list_of_treeish, by_date=False, reverse=False):
     If by_date - sorts by date, newer first.
     """
     list_of_treeish = list(list_of_treeish)
-    if not list_of_treeish:
-        return ()
-    shas = get_output(['git', 'rev-list'] +
-                      ['--date-order' if by_date else '--topo-order'] +
-                      (['--reverse'] if reverse else []) +
-                      list_of_treeish + ['--']).splitlines()
-    sha_treeish = collections.defaultdict(list)
-    for treeish in list_of_treeish:
-        sha_treeish[rev_parse(treeish)].append(treeish)
-    return tuple(t for sha in shas for t in sha_treeish.get(sha, ()))
+    if not by_date:
+        # commits on a single first-parent chain are ordered by their depths,
+        # without listing whole history
+        ordered = firstparent.sort(list_of_treeish, reverse)
+        if ordered is not None:
+            return ordered
+    return backend.get().sort(list_of_treeish, by_date, reverse)
 
 
 def is_valid_ref_name(name):
-    return check_01(['git', 'check-ref-format', 'refs/heads/' + name])
+    return backend.get().check_ref_format('refs/heads/' + name)
+
+
+def is_valid_ref_name_many(names):
+    """Returns list of booleans, names are checked in parallel"""
+    return backend.get().check_ref_format_many('refs/heads/' + name
+                                               for name in names)
 
 
 class MergeMsgError(Exception):
@@ -100,7 +121,8 @@ class MergeMsgError(Exception):
 
 def set_merge_msg(string):
     try:
-        with open(get_git_dir() + '/MERGE_MSG', 'w') as merge_msg_file:
+        with open(os.path.join(get_git_dir(), 'MERGE_MSG'),
+                  'w') as merge_msg_file:
             written = merge_msg_file.write(string)
     except OSError as error:
         raise MergeMsgError from error
@@ -112,7 +134,7 @@ def set_merge_msg(string):
 
 
 def get_merge_base(shas):
-    return get_output(["git", "merge-base", "--octopus"] + shas)
+    return backend.get().merge_base(shas)
 
 
 def get_diff(from_treeish, to_treeish, files=None, working_dir=None):
@@ -0,0 +1,982 @@
+"""Pure-Python read-only access to git repositories: refs, loose objects,
+packs and commit-graph. PythonBackend uses it to answer queries without
+starting git. Whatever
+it can't handle (unusual revision syntax, repository extensions, objects it
+fails to find) is passed to SubprocessBackend.
+History is walked with commit-graph only, without it ancestry, search and
+sorting queries are passed to git. So are sorting of commits which aren't on
+a single line of descent and merge bases of commits having several.
+"""
+
+import binascii
+import collections
+import fnmatch
+import functools
+import glob
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from thingitwrapper import repo
+from thingitwrapper.backend import SubprocessBackend, Unsupported, backends,\
+    read_config, subject, Reachable, is_valid_ref
+
+
+OBJ_COMMIT, OBJ_TREE, OBJ_BLOB, OBJ_TAG, OBJ_OFS_DELTA, OBJ_REF_DELTA = \
+    1, 2, 3, 4, 6, 7
+TYPE_NAMES = {b'commit': OBJ_COMMIT, b'tree': OBJ_TREE, b'blob': OBJ_BLOB,
+              b'tag': OBJ_TAG}
+BASES_CACHE_SIZE = 16 * 1024 * 1024
+COMMITS_CACHE_SIZE = 16384
+# extensions which don't change anything for readers of refs and objects
+HARMLESS_EXTENSIONS = ('noop', 'preciousobjects', 'worktreeconfig')
+# rules git uses to expand short ref names, see git help revisions
+DWIM_RULES = ('{}', 'refs/{}', 'refs/tags/{}', 'refs/heads/{}',
+              'refs/remotes/{}', 'refs/remotes/{}/HEAD')
+
+_sha_re = re.compile('^[0-9a-f]{40}$')
+_short_sha_re = re.compile('^[0-9a-f]{4,39}$')
+_pseudo_ref_re = re.compile('^[A-Z_]+$')
+_suffix_re = re.compile(r'\^\{(commit)?\}|\^([0-9]*)|~([0-9]*)')
+GRAPH_NO_PARENT = 0x70000000
+GRAPH_EXTRA_EDGES = 0x80000000
+STALE = 4  # flag of merge base search
+
+
+class ObjectMissing(Unsupported):
+    """Object not found. Git could still find it e.g. in a promisor remote"""
+
+
+class CorruptObject(Unsupported):
+    pass
+
+
+def _inflate(buffer, position):
+    """Decompresses zlib stream starting at position of buffer"""
+    decompressor = zlib.decompressobj()
+    chunks = []
+    chunk_size = 4096
+    while not decompressor.eof:
+        data = buffer[position:position + chunk_size]
+        if not data:
+            raise CorruptObject('Truncated zlib stream')
+        chunks.append(decompressor.decompress(data))
+        position += len(data)
+        chunk_size *= 2
+    return b''.join(chunks)
+
+
+def _read_varint(data, position):
+    """Reads size encoded in delta header"""
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, position
+
+
+def apply_delta(base, delta):
+    source_size, position = _read_varint(delta, 0)
+    target_size, position = _read_varint(delta, position)
+    if source_size != len(base):
+        raise CorruptObject('Delta base size mismatch')
+    result = bytearray()
+    while position < len(delta):
+        opcode = delta[position]
+        position += 1
+        if opcode & 0x80:  # copy from base
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= delta[position] << (8 * i)
+                    position += 1
+            for i in range(3):
+                if opcode & (0x10 << i):
+                    size |= delta[position] << (8 * i)
+                    position += 1
+            result += base[offset:offset + (size or 0x10000)]
+        elif opcode:  # insert
+            result += delta[position:position + opcode]
+            position += opcode
+        else:
+            raise CorruptObject('Delta opcode 0')
+    if len(result) != target_size:
+        raise CorruptObject('Delta result size mismatch')
+    return bytes(result)
+
+
+class Pack:
+    """Pack file with version 2 index. Both files are memory mapped, objects
+    are looked up by binary search in the range of index the fanout table
+    gives for the first byte of SHA.
+    """
+    def __init__(self, idx_path):
+        with open(idx_path, 'rb') as file:
+            self.index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.index[:8] != b'\377tOc\0\0\0\2':
+            raise Unsupported('Pack index version isn\'t 2: ' + idx_path)
+        self.fanout = struct.unpack_from('>256I', self.index, 8)
+        self.count = self.fanout[255]
+        self.shas_start = 8 + 256 * 4
+        self.offsets_start = self.shas_start + 24 * self.count
+        self.large_start = self.offsets_start + 4 * self.count
+        with open(idx_path[:-len('.idx')] + '.pack', 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __sha_at(self, position):
+        start = self.shas_start + 20 * position
+        return self.index[start:start + 20]
+
+    def __bisect(self, binary_sha):
+        """Returns position of first SHA not less than binary_sha in index"""
+        first = binary_sha[0]
+        low = self.fanout[first - 1] if first else 0
+        high = self.fanout[first]
+        while low < high:
+            middle = (low + high) // 2
+            if self.__sha_at(middle) < binary_sha:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, binary_sha):
+        """Returns offset of object in pack or None"""
+        position = self.__bisect(binary_sha)
+        if position == self.count or self.__sha_at(position) != binary_sha:
+            return None
+        offset = struct.unpack_from('>I', self.index,
+                                    self.offsets_start + 4 * position)[0]
+        if offset & 0x80000000:
+            offset = struct.unpack_from(
+                '>Q', self.index,
+                self.large_start + 8 * (offset & 0x7fffffff))[0]
+        return offset
+
+    def find_abbreviated(self, hex_prefix):
+        """Returns binary SHAs starting with hex_prefix"""
+        position = self.__bisect(binascii.unhexlify(
+            hex_prefix[:len(hex_prefix) // 2 * 2]))
+        result = []
+        while position < self.count:
+            sha = self.__sha_at(position)
+            head = binascii.hexlify(sha).decode()[:len(hex_prefix)]
+            if head > hex_prefix:
+                break
+            if head == hex_prefix:
+                result.append(sha)
+            position += 1
+        return result
+
+    def read_at(self, offset, store):
+        """Returns (type, data) of object at offset. store resolves REF_DELTA
+        bases
+        """
+        data = self.data
+        byte = data[offset]
+        type_ = (byte >> 4) & 7
+        position = offset + 1
+        while byte & 0x80:
+            byte = data[position]
+            position += 1
+        if type_ == OBJ_OFS_DELTA:
+            byte = data[position]
+            position += 1
+            base_distance = byte & 0x7f
+            while byte & 0x80:
+                byte = data[position]
+                position += 1
+                base_distance = ((base_distance + 1) << 7) | (byte & 0x7f)
+            base_type, base = store.read_base(self, offset - base_distance)
+            return base_type, apply_delta(base, _inflate(data, position))
+        elif type_ == OBJ_REF_DELTA:
+            base_type, base = store.read_binary(data[position:position + 20])
+            return base_type, apply_delta(base, _inflate(data, position + 20))
+        elif type_ in (OBJ_COMMIT, OBJ_TREE, OBJ_BLOB, OBJ_TAG):
+            return type_, _inflate(data, position)
+        else:
+            raise CorruptObject('Unknown object type ' + str(type_))
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class ObjectStore:
+    """Reads objects of a repository from its object directories"""
+    def __init__(self, objects_dir):
+        self.dirs = [objects_dir]
+        alternates = os.path.join(objects_dir, 'info', 'alternates')
+        if os.path.isfile(alternates):
+            with open(alternates) as file:
+                for line in file.read().splitlines():
+                    if line and not line.startswith('#'):
+                        self.dirs.append(os.path.join(objects_dir, line))
+        self.packs = dict()  # Packs by idx path
+        self.lock = threading.Lock()
+        # inflated delta bases: {(pack, offset): (type, data)}
+        self.bases = collections.OrderedDict()
+        self.bases_size = 0
+        self.__scan_packs()
+
+    def __scan_packs(self):
+        with self.lock:
+            for objects_dir in self.dirs:
+                for idx in glob.glob(os.path.join(objects_dir, 'pack',
+                                                  'pack-*.idx')):
+                    if idx not in self.packs:
+                        self.packs[idx] = Pack(idx)
+
+    def __read_loose(self, hex_sha):
+        for objects_dir in self.dirs:
+            path = os.path.join(objects_dir, hex_sha[:2], hex_sha[2:])
+            try:
+                with open(path, 'rb') as file:
+                    raw = zlib.decompress(file.read())
+            except FileNotFoundError:
+                continue
+            header, _, data = raw.partition(b'\0')
+            type_name = header.split(b' ', 1)[0]
+            if type_name not in TYPE_NAMES:
+                raise CorruptObject('Bad loose object ' + path)
+            return TYPE_NAMES[type_name], data
+        return None
+
+    def read_base(self, pack, offset):
+        """Returns (type, data) of object at offset of pack. Delta chains
+        often share bases, so these are kept in LRU of BASES_CACHE_SIZE bytes
+        """
+        key = (pack, offset)
+        with self.lock:
+            result = self.bases.get(key)
+            if result is not None:
+                self.bases.move_to_end(key)
+                return result
+        result = pack.read_at(offset, self)
+        with self.lock:
+            if key not in self.bases:
+                self.bases[key] = result
+                self.bases_size += len(result[1])
+                while self.bases_size > BASES_CACHE_SIZE and self.bases:
+                    self.bases_size -= len(self.bases.popitem(False)[1][1])
+        return result
+
+    def __read_packed(self, binary_sha):
+        for pack in tuple(self.packs.values()):
+            offset = pack.find(binary_sha)
+            if offset is not None:
+                return pack.read_at(offset, self)
+        return None
+
+    def read_binary(self, binary_sha):
+        """Returns (type, data) of object"""
+        result = self.__read_packed(binary_sha)
+        if result is None:
+            result = self.__read_loose(
+                binascii.hexlify(binary_sha).decode())
+        if result is None:
+            self.__scan_packs()  # git may have repacked repository
+            result = self.__read_packed(binary_sha)
+        if result is None:
+            raise ObjectMissing(binascii.hexlify(binary_sha).decode())
+        return result
+
+    def read(self, hex_sha):
+        return self.read_binary(bytes.fromhex(hex_sha))
+
+    def find_abbreviated(self, prefix):
+        """Returns list of SHAs starting with prefix"""
+        found = set()
+        for objects_dir in self.dirs:
+            directory = os.path.join(objects_dir, prefix[:2])
+            if os.path.isdir(directory):
+                found.update(prefix[:2] + name
+                             for name in os.listdir(directory)
+                             if name.startswith(prefix[2:]) and
+                             len(name) == 38)
+        for pack in tuple(self.packs.values()):
+            found.update(binascii.hexlify(sha).decode()
+                         for sha in pack.find_abbreviated(prefix))
+        return sorted(found)
+
+
+class _GraphLayer:
+    """Single commit-graph file, memory mapped"""
+    def __init__(self, path, first_position):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version, hash_version, chunks = struct.unpack_from(
+            '>4sBBB', self.data)
+        if signature != b'CGPH' or version != 1 or hash_version != 1:
+            raise Unsupported('Unknown commit-graph format: ' + path)
+        self.chunks = dict()
+        for i in range(chunks):
+            id_, offset = struct.unpack_from('>4sQ', self.data, 8 + 12 * i)
+            self.chunks[id_] = offset
+        if any(c not in self.chunks for c in (b'OIDF', b'OIDL', b'CDAT')):
+            raise Unsupported('Required chunks missing: ' + path)
+        self.fanout = struct.unpack_from('>256I', self.data,
+                                         self.chunks[b'OIDF'])
+        self.count = self.fanout[255]
+        self.first = first_position
+        self.shas_start = self.chunks[b'OIDL']
+        self.commits_start = self.chunks[b'CDAT']
+        self.edges_start = self.chunks.get(b'EDGE')
+
+    def sha_at(self, index):
+        start = self.shas_start + 20 * index
+        return self.data[start:start + 20]
+
+    def find(self, binary_sha):
+        """Returns index of commit in this file or None"""
+        first = binary_sha[0]
+        low = self.fanout[first - 1] if first else 0
+        high = self.fanout[first]
+        while low < high:
+            middle = (low + high) // 2
+            if self.sha_at(middle) < binary_sha:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.sha_at(low) == binary_sha:
+            return low
+        return None
+
+    def commit_at(self, index):
+        """Returns (parent positions, generation) of commit"""
+        parent1, parent2, generation = struct.unpack_from(
+            '>III', self.data, self.commits_start + 36 * index + 20)
+        parents = [] if parent1 == GRAPH_NO_PARENT else [parent1]
+        if parent2 & GRAPH_EXTRA_EDGES:
+            if self.edges_start is None:
+                raise CorruptObject('commit-graph has no EDGE chunk')
+            position = self.edges_start + 4 * (parent2 & ~GRAPH_EXTRA_EDGES)
+            while True:
+                edge = struct.unpack_from('>I', self.data, position)[0]
+                parents.append(edge & ~GRAPH_EXTRA_EDGES)
+                if edge & GRAPH_EXTRA_EDGES:
+                    break
+                position += 4
+        elif parent2 != GRAPH_NO_PARENT:
+            parents.append(parent2)
+        return parents, generation >> 2  # topological level
+
+    def date_at(self, index):
+        """Returns commit time of commit"""
+        high, low = struct.unpack_from('>II', self.data,
+                                       self.commits_start + 36 * index + 28)
+        return (high & 3) << 32 | low
+
+    def close(self):
+        self.data.close()
+
+
+class CommitGraph:
+    """Commit-graph file or chain of files git writes to speed up history
+    walks. Commits are identified by their positions: indexes in files of
+    chain counted consecutively, base file first. Parents are found in O(1)
+    and generation numbers tell that a commit can't be an ancestor of
+    commits of lower generations.
+    """
+    def __init__(self, objects_dir):
+        info = os.path.join(objects_dir, 'info')
+        chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+        if os.path.isfile(chain):
+            with open(chain) as file:
+                paths = [os.path.join(info, 'commit-graphs',
+                                      'graph-' + h + '.graph')
+                         for h in file.read().split()]
+        elif os.path.isfile(os.path.join(info, 'commit-graph')):
+            paths = [os.path.join(info, 'commit-graph')]
+        else:
+            raise Unsupported('No commit-graph')
+        self.layers = []
+        self.count = 0
+        for path in paths:
+            self.layers.append(_GraphLayer(path, self.count))
+            self.count += self.layers[-1].count
+        if self.count and not self.generation(0):
+            raise Unsupported('commit-graph has no generation numbers')
+
+    def find(self, hex_sha):
+        """Returns position of commit or None"""
+        binary_sha = bytes.fromhex(hex_sha)
+        for layer in self.layers:
+            index = layer.find(binary_sha)
+            if index is not None:
+                return layer.first + index
+        return None
+
+    def __locate(self, position):
+        for layer in reversed(self.layers):
+            if position >= layer.first:
+                return layer, position - layer.first
+        raise CorruptObject('No commit-graph position ' + str(position))
+
+    def sha(self, position):
+        layer, index = self.__locate(position)
+        return binascii.hexlify(layer.sha_at(index)).decode()
+
+    def parents(self, position):
+        layer, index = self.__locate(position)
+        return layer.commit_at(index)[0]
+
+    def generation(self, position):
+        layer, index = self.__locate(position)
+        return layer.commit_at(index)[1]
+
+    def date(self, position):
+        layer, index = self.__locate(position)
+        return layer.date_at(index)
+
+    def close(self):
+        for layer in self.layers:
+            layer.close()
+
+
+class Commit:
+    __slots__ = ('parents', 'date', 'message', 'encoding')
+
+    def __init__(self, data):
+        header, _, message = data.partition(b'\n\n')
+        self.parents = []
+        self.date = 0
+        self.encoding = None
+        for line in header.split(b'\n'):
+            if line.startswith(b'parent '):
+                self.parents.append(line[7:].decode('ascii'))
+            elif line.startswith(b'committer '):
+                # committer Name <email> timestamp timezone
+                self.date = int(line.rsplit(b' ', 2)[1])
+            elif line.startswith(b'encoding '):
+                self.encoding = line[9:].decode('ascii').lower()
+        self.message = message
+
+    def get_message(self):
+        if self.encoding not in (None, 'utf-8', 'utf8'):
+            raise Unsupported('Message encoding ' + self.encoding)
+        return self.message.decode()
+
+
+class Refs:
+    """Reads loose refs and packed-refs"""
+    def __init__(self, git_dir, common_dir):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.__packed = None
+        self.__packed_stat = None
+        self.lock = threading.Lock()
+
+    def __path(self, ref):
+        # refs shared by worktrees are stored in common dir
+        if '/' not in ref or ref.startswith(('refs/bisect/',
+                                             'refs/worktree/')):
+            return os.path.join(self.git_dir, ref)
+        return os.path.join(self.common_dir, ref)
+
+    def packed(self):
+        """Returns {ref: SHA} of packed-refs file"""
+        path = os.path.join(self.common_dir, 'packed-refs')
+        try:
+            stat = os.stat(path)
+            stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return dict()
+        with self.lock:
+            if stat != self.__packed_stat:
+                packed = dict()
+                with open(path, 'rb') as file:
+                    for line in file.read().decode().splitlines():
+                        if line and line[0] not in '#^':
+                            sha, ref = line.split(' ', 1)
+                            packed[ref] = sha
+                self.__packed, self.__packed_stat = packed, stat
+            return self.__packed
+
+    def read_raw(self, ref):
+        """Returns contents of ref: SHA, 'ref: target' or None"""
+        try:
+            with open(self.__path(ref), 'rb') as file:
+                return file.read().decode().strip()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return self.packed().get(ref)
+
+    def resolve(self, ref):
+        """Returns SHA ref points to, following symbolic refs, or None"""
+        for _ in range(5):
+            contents = self.read_raw(ref)
+            if contents is None:
+                return None
+            if contents.startswith('ref:'):
+                ref = contents[4:].strip()
+                continue
+            sha = contents[:40]
+            if not _sha_re.match(sha):
+                raise Unsupported('Bad ref ' + ref + ': ' + contents)
+            return sha
+        raise Unsupported('Too deep symbolic ref ' + ref)
+
+    def list(self, prefix):
+        """Returns sorted names of refs under prefix (ending with /), prefix
+        stripped
+        """
+        names = set(r[len(prefix):] for r in self.packed()
+                    if r.startswith(prefix))
+        root = os.path.join(self.common_dir, prefix)
+        for directory, _, files in os.walk(root):
+            relative = os.path.relpath(directory, root)
+            for file in files:
+                if not file.endswith('.lock'):
+                    names.add(file if relative == '.' else
+                              relative.replace(os.sep, '/') + '/' + file)
+        return sorted(names, key=lambda n: n.encode())
+
+
+def _fallback(method):
+    """Makes PythonBackend method ask SubprocessBackend when it can't answer"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except Unsupported as error:
+            logging.debug(method.__name__ + str(args) + ' asked to git: ' +
+                          str(error))
+        except (OSError, ValueError, IndexError, zlib.error,
+                struct.error) as error:
+            logging.warning(method.__name__ + str(args) + ' failed, asking '
+                            'git. Error: ' + repr(error))
+        return getattr(SubprocessBackend, method.__name__)(self, *args,
+                                                           **kwargs)
+    return wrapper
+
+
+class PythonBackend(SubprocessBackend):
+    def __init__(self, git_dir):
+        super().__init__(git_dir)
+        common_dir = repo.get_common_dir(git_dir)
+        config = read_config(os.path.join(common_dir, 'config'))
+        if config.get('core.repositoryformatversion', '0') != '0':
+            for key in config:
+                if key.startswith('extensions.') and \
+                        key[len('extensions.'):] not in HARMLESS_EXTENSIONS:
+                    raise Unsupported('Repository uses ' + key)
+        if os.path.isdir(os.path.join(common_dir, 'reftable')):
+            raise Unsupported('Repository uses reftable')
+        self.refs = Refs(git_dir, common_dir)
+        self.commits = collections.OrderedDict()
+        self.commits_lock = threading.Lock()
+        self.objects = ObjectStore(os.environ.get('GIT_OBJECT_DIRECTORY') or
+                                   os.path.join(common_dir, 'objects'))
+        self.graph = None
+        self.generations = dict()  # of commits commit-graph doesn't have
+        # git ignores commit-graph when history is altered by grafts or
+        # shallow clone
+        if config.get('core.commitgraph', 'true') != 'false' and not any(
+                os.path.exists(os.path.join(common_dir, name))
+                for name in ('shallow', os.path.join('info', 'grafts'))):
+            try:
+                self.graph = CommitGraph(self.objects.dirs[0])
+            except Unsupported as error:
+                logging.debug('Not using commit-graph: ' + str(error))
+            except (OSError, ValueError, struct.error) as error:
+                logging.warning('Failed to read commit-graph: ' + repr(error))
+
+    def read_commit(self, sha):
+        """Returns (SHA, Commit) of commit sha points to, tags are peeled.
+        Commits are kept in LRU of COMMITS_CACHE_SIZE items.
+        """
+        for _ in range(32):
+            with self.commits_lock:
+                commit = self.commits.get(sha)
+                if commit is not None:
+                    self.commits.move_to_end(sha)
+                    return sha, commit
+            type_, data = self.objects.read(sha)
+            if type_ == OBJ_TAG:
+                sha = data[7:47].decode('ascii')  # 'object <sha>' line
+                continue
+            if type_ != OBJ_COMMIT:
+                raise Unsupported(sha + ' is not a commit')
+            commit = Commit(data)
+            with self.commits_lock:
+                self.commits[sha] = commit
+                if len(self.commits) > COMMITS_CACHE_SIZE:
+                    self.commits.popitem(False)
+            return sha, commit
+        raise Unsupported('Too long tag chain')
+
+    def __peel(self, sha):
+        """Dereferences tags"""
+        for _ in range(32):
+            type_, data = self.objects.read(sha)
+            if type_ != OBJ_TAG:
+                return sha
+            sha = data[7:47].decode('ascii')
+        raise Unsupported('Too long tag chain')
+
+    def __resolve_name(self, name):
+        if _sha_re.match(name):
+            return name
+        for rule in DWIM_RULES:
+            ref = rule.format(name)
+            if ref == name and not _pseudo_ref_re.match(name):
+                continue  # only HEAD and alike are looked up in git dir
+            sha = self.refs.resolve(ref)
+            if sha:
+                return sha
+        if _short_sha_re.match(name):
+            found = self.objects.find_abbreviated(name)
+            if len(found) == 1:
+                return found[0]
+        raise Unsupported('Can\'t resolve ' + name)
+
+    @_fallback
+    def rev_parse(self, treeish):
+        return self.resolve(treeish)
+
+    def rev_parse_many(self, list_of_treeish):
+        return [self.rev_parse(treeish) for treeish in list_of_treeish]
+
+    def resolve(self, treeish):
+        """rev_parse raising Unsupported instead of asking git"""
+        match = re.search('[~^]', treeish)
+        name = treeish[:match.start()] if match else treeish
+        if not name or any(c in name for c in ': @{}\\') or '..' in name:
+            raise Unsupported('Revision syntax')
+        sha = self.__resolve_name(name)
+        suffixes = treeish[len(name):]
+        position = 0
+        while position < len(suffixes):
+            match = _suffix_re.match(suffixes, position)
+            if not match:
+                raise Unsupported('Revision syntax')
+            position = match.end()
+            if match.group(0) == '^{}':
+                sha = self.__peel(sha)
+            elif match.group(0) == '^{commit}':
+                sha = self.read_commit(sha)[0]
+            elif match.group(0).startswith('^'):
+                number = int(match.group(2) or 1)
+                sha, commit = self.read_commit(sha)
+                if number:
+                    if number > len(commit.parents):
+                        raise Unsupported('No parent ' + str(number))
+                    sha = commit.parents[number - 1]
+            else:
+                for _ in range(int(match.group(3) or 1)):
+                    parents = self.read_commit(sha)[1].parents
+                    if not parents:
+                        raise Unsupported('No first parent')
+                    sha = parents[0]
+        return sha
+
+    def __commit_of(self, treeish):
+        return self.read_commit(self.resolve(treeish))[1]
+
+    def check_ref_format(self, ref):
+        return is_valid_ref(ref)
+
+    def check_ref_format_many(self, refs):
+        return [is_valid_ref(ref) for ref in refs]
+
+    @_fallback
+    def branch_list(self, patterns=None):
+        names = self.refs.list('refs/heads/')
+        if patterns:
+            names = [n for n in names
+                     if any(fnmatch.fnmatchcase(n, p) for p in patterns)]
+        return names
+
+    @_fallback
+    def branch_exists(self, name):
+        return self.refs.resolve('refs/heads/' + name) is not None
+
+    def branches_exist(self, names):
+        return [self.branch_exists(name) for name in names]
+
+    @_fallback
+    def branch_sha(self, name):
+        sha = self.refs.resolve('refs/heads/' + name)
+        if sha is None:
+            raise Unsupported('No branch ' + name)  # git will complain
+        return sha
+
+    @_fallback
+    def current_branch(self):
+        head = self.refs.read_raw('HEAD')
+        if head is None:
+            raise Unsupported('No HEAD')
+        if not head.startswith('ref:'):
+            return None
+        target = head[4:].strip()
+        if not target.startswith('refs/heads/'):
+            raise Unsupported('HEAD points to ' + target)
+        return target[len('refs/heads/'):]
+
+    @_fallback
+    def tag_list(self, pattern=''):
+        names = self.refs.list('refs/tags/')
+        if pattern:
+            names = [n for n in names if fnmatch.fnmatchcase(n, pattern)]
+        return names
+
+    @_fallback
+    def tag_exists(self, name):
+        return self.refs.resolve('refs/tags/' + name) is not None
+
+    def tags_exist(self, names):
+        return [self.tag_exists(name) for name in names]
+
+    @_fallback
+    def tag_sha(self, name):
+        sha = self.refs.resolve('refs/tags/' + name)
+        if sha is None:
+            raise Unsupported('No tag ' + name)
+        return sha
+
+    @_fallback
+    def tags_pointing_at(self, treeish):
+        sha = self.resolve(treeish)
+        result = []
+        for name in self.refs.list('refs/tags/'):
+            target = self.refs.resolve('refs/tags/' + name)
+            if target == sha:
+                result.append(name)
+                continue
+            type_, data = self.objects.read(target)
+            if type_ == OBJ_TAG and data[7:47].decode('ascii') == sha:
+                result.append(name)
+        return result
+
+    @_fallback
+    def headline(self, treeish):
+        return subject(self.__commit_of(treeish).get_message())
+
+    @_fallback
+    def full_message(self, treeish):
+        return os.linesep.join(self.__commit_of(treeish).get_message()
+                               .splitlines())
+
+    @_fallback
+    def parent(self, treeish, number):
+        sha, commit = self.read_commit(self.resolve(treeish))
+        if number == 0:
+            return sha
+        return (commit.parents[number - 1] if number <= len(commit.parents)
+                else None)
+
+    @_fallback
+    def parents(self, treeish):
+        return list(self.__commit_of(treeish).parents)
+
+    def __node(self, treeish):
+        """Returns commit-graph position of commit treeish points to, SHA of
+        commit if commit-graph doesn't have it
+        """
+        if self.graph is None:
+            raise Unsupported('No commit-graph')
+        sha = self.resolve(treeish)
+        position = self.graph.find(sha)
+        if position is None:
+            sha = self.read_commit(sha)[0]
+            position = self.graph.find(sha)
+        return sha if position is None else position
+
+    def __parent_nodes(self, node):
+        if isinstance(node, int):
+            return self.graph.parents(node)
+        parents = []
+        for sha in self.read_commit(node)[1].parents:
+            position = self.graph.find(sha)
+            parents.append(sha if position is None else position)
+        return parents
+
+    def __generation(self, node):
+        if isinstance(node, int):
+            return self.graph.generation(node)
+        # commits made after commit-graph was written, usually there are few
+        generation = self.generations.get(node)
+        stack = [node]
+        while generation is None:
+            parents = self.__parent_nodes(stack[-1])
+            unknown = [p for p in parents
+                       if isinstance(p, str) and p not in self.generations]
+            if unknown:
+                stack.extend(unknown)
+            else:
+                self.generations[stack.pop()] = 1 + max(
+                    [self.__generation(p) for p in parents] or [0])
+                generation = self.generations.get(node)
+        return generation
+
+    def __date(self, node):
+        return (self.graph.date(node) if isinstance(node, int)
+                else self.read_commit(node)[1].date)
+
+    def __reachable(self, nodes):
+        return Reachable(nodes, self.__parent_nodes, self.__generation)
+
+    @_fallback
+    def is_ancestor(self, ancestor, descendant):
+        return self.__node(ancestor) in self.__reachable(
+            [self.__node(descendant)])
+
+    @_fallback
+    def is_ancestor_many(self, pairs):
+        # descendants are walked once for all of their ancestors
+        reachable = dict()
+        result = []
+        for ancestor, descendant in pairs:
+            node = self.__node(descendant)
+            if node not in reachable:
+                reachable[node] = self.__reachable([node])
+            result.append(self.__node(ancestor) in reachable[node])
+        return result
+
+    def __sha(self, node):
+        return node if isinstance(node, str) else self.graph.sha(node)
+
+    @_fallback
+    def first_parent_walk(self, ancestor, descendant):
+        excluded = self.__reachable([self.__node(ancestor)])
+        node = self.__node(descendant)
+        result = []
+        while node is not None and node not in excluded:
+            result.append(self.__sha(node))
+            parents = self.__parent_nodes(node)
+            node = parents[0] if parents else None
+        return result
+
+    def __grep(self, shas, regexps, match_all):
+        if not regexps:
+            return shas
+        compiled = [re.compile(r, re.MULTILINE) for r in regexps]
+        check = all if match_all else any
+        return [sha for sha in shas if check(
+            r.search(self.read_commit(sha)[1].get_message())
+            for r in compiled)]
+
+    @_fallback
+    def find(self, start_commits=None, first_parent=False, regexps=None,
+             match_all=False):
+        if not start_commits:
+            raise Unsupported('--all')  # HEADs of other worktrees count too
+        # git rev-list without ordering options lists newer commits first,
+        # commits of the same date in the order they were met
+        counter = itertools.count()
+        seen = set()
+        queue = []
+        for node in [self.__node(t) for t in start_commits]:
+            if node not in seen:
+                seen.add(node)
+                queue.append((-self.__date(node), next(counter), node))
+        heapq.heapify(queue)
+        shas = []
+        while queue:
+            node = heapq.heappop(queue)[2]
+            shas.append(self.__sha(node))
+            parents = self.__parent_nodes(node)
+            for parent in parents[:1] if first_parent else parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(queue, (-self.__date(parent),
+                                           next(counter), parent))
+        return self.__grep(shas, regexps, match_all)
+
+    @_fallback
+    def commits_between(self, treeish1, treeish2, reverse=False,
+                        regexps=None, match_all=False):
+        start = self.__node(treeish1)
+        excluded = self.__reachable([start])
+        result = []
+        node = self.__node(treeish2)
+        while node is not None:
+            if node in excluded:
+                if node != start:
+                    # first parents don't lead to start: keep descendants of
+                    # start only. Once a commit isn't one, its ancestors
+                    # aren't either.
+                    for i, kept in enumerate(result):
+                        if start not in self.__reachable([kept]):
+                            del result[i:]
+                            break
+                break
+            result.append(node)
+            parents = self.__parent_nodes(node)
+            node = parents[0] if parents else None
+        result = self.__grep([self.__sha(n) for n in result], regexps,
+                             match_all)
+        return result[::-1] if reverse else result
+
+    @_fallback
+    def sort(self, list_of_treeish, by_date=False, reverse=False):
+        """Answers for commits on a single line of descent only, they are
+        ordered by ancestry whatever by_date is. Order of other commits
+        depends on the way git walks history, so git is asked.
+        """
+        listed = []  # (node, treeish)
+        for treeish in list_of_treeish:
+            sha = self.resolve(treeish)
+            # git lists commits, so annotated tags given aren't found
+            if self.read_commit(sha)[0] == sha:
+                listed.append((self.__node(sha), treeish))
+        nodes = sorted(set(node for node, _ in listed), key=self.__generation,
+                       reverse=True)
+        for newer, elder in zip(nodes, nodes[1:]):
+            if elder not in self.__reachable([newer]):
+                raise Unsupported('Commits aren\'t on a single line of '
+                                  'descent')
+        if reverse:
+            nodes.reverse()
+        positions = dict((node, i) for i, node in enumerate(nodes))
+        return tuple(treeish for _, treeish in sorted(
+            listed, key=lambda item: positions[item[0]]))
+
+    def __merge_bases(self, node1, node2):
+        """Returns best common ancestors of two commits, as git merge-base
+        --all does
+        """
+        flags = {node1: 1}
+        flags[node2] = flags.get(node2, 0) | 2
+        counter = itertools.count()
+        queue = [(-self.__generation(n), next(counter), n) for n in flags]
+        heapq.heapify(queue)
+        found = []
+        while any(not flags[n] & STALE for _, _, n in queue):
+            node = heapq.heappop(queue)[2]
+            flag = flags[node]
+            if flag & 3 == 3 and not flag & STALE:
+                found.append(node)
+                flag |= STALE
+            for parent in self.__parent_nodes(node):
+                if parent not in flags:
+                    heapq.heappush(queue, (-self.__generation(parent),
+                                           next(counter), parent))
+                flags[parent] = flags.get(parent, 0) | flag
+        # of criss-cross merges some bases found may be ancestors of others
+        return [n for n in found if not any(
+            n != other and n in self.__reachable([other]) for other in found)]
+
+    @_fallback
+    def merge_base(self, shas):
+        nodes = [self.__node(sha) for sha in shas]
+        bases = nodes[:1]
+        for node in nodes[1:]:
+            bases = self.__merge_bases(bases[0], node)
+            if len(bases) != 1:
+                # git picks one of several bases in its own order, it also
+                # tells there's none
+                raise Unsupported(str(len(bases)) + ' merge bases')
+        return self.__sha(bases[0])
+
+
+backends['python'] = PythonBackend
@@ -0,0 +1,78 @@
+"""Locating repositories without calling git. This is used to tell
+repositories apart cheaply, e.g. to keep separate caches for them.
+"""
+
+import os
+import threading
+
+from thingitwrapper.aux import get_cwd
+
+
+__git_dirs = dict()  # resolved git dirs by working directory
+__lock = threading.Lock()
+
+
+def __looks_like_git_dir(path):
+    return (os.path.isfile(os.path.join(path, 'HEAD')) and
+            os.path.isdir(os.path.join(path, 'objects')) and
+            os.path.isdir(os.path.join(path, 'refs')))
+
+
+def __find_git_dir(path):
+    if os.environ.get('GIT_DIR'):
+        return os.path.realpath(os.path.join(path, os.environ['GIT_DIR']))
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return os.path.realpath(dot_git)
+        if os.path.isfile(dot_git):  # worktree or submodule
+            with open(dot_git) as file:
+                contents = file.read().strip()
+            if contents.startswith('gitdir:'):
+                return os.path.realpath(
+                    os.path.join(path, contents[len('gitdir:'):].strip()))
+        if __looks_like_git_dir(path):  # bare repository
+            return os.path.realpath(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def get_git_dir(path=None):
+    """Returns absolute real path of git dir of repository path belongs to or
+    None if path isn't inside a repository. Path defaults to the directory
+    current thread runs git commands in.
+    Results are memorized, call forget() after creating or removing
+    repository.
+    """
+    path = os.path.abspath(path) if path else get_cwd()
+    try:
+        return __git_dirs[path]
+    except KeyError:
+        pass
+    git_dir = __find_git_dir(path)
+    with __lock:
+        __git_dirs[path] = git_dir
+    return git_dir
+
+
+def forget(path=None):
+    """Forgets git dir resolved for path or for all paths if path is None"""
+    with __lock:
+        if path:
+            __git_dirs.pop(os.path.abspath(path), None)
+        else:
+            __git_dirs.clear()
+
+
+def get_common_dir(git_dir):
+    """Returns directory holding objects and refs shared by all worktrees of
+    repository, it is git_dir itself unless git_dir belongs to a worktree
+    """
+    try:
+        with open(os.path.join(git_dir, 'commondir')) as file:
+            common_dir = file.read().strip()
+    except OSError:
+        return git_dir
+    return os.path.realpath(os.path.join(git_dir, common_dir))
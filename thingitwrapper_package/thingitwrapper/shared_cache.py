@@ -0,0 +1,289 @@
+"""Cache shared between processes working with the same repository.
+
+Only immutable facts are stored here: results of functions called with full
+SHAs (commit messages, parents, ancestry, diffs between commits). Values live
+in SQLite database in WAL mode, so many processes may read it concurrently.
+Writes are batched and committed every FLUSH_SIZE values and at exit.
+
+ShaSet is a set of SHAs, persisted along with the other values. Use it to
+remember commits having some immutable property, e.g. commits which aren't
+worth parsing.
+
+States are the only mutable values: the latest version of something rebuilt
+as history grows, e.g. an index covering branch history up to its tip. New
+state replaces the old one, so a state should tell what it was built for.
+
+Set GIT_WRAPPER_SHARED_CACHE=1 to enable it. Database is stored in git dir
+as thingitwrapper-cache.sqlite unless GIT_WRAPPER_SHARED_CACHE is set to a
+path of a directory to put databases of all repositories to.
+In-process grouped_cache should be put in front of it, see commit.py.
+"""
+
+import ast
+import atexit
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from thingitwrapper import repo, trace
+
+
+FLUSH_SIZE = 256
+SCHEMA_VERSION = 2
+FILE_NAME = 'thingitwrapper-cache.sqlite'
+
+__setting = os.environ.get('GIT_WRAPPER_SHARED_CACHE')
+enabled = bool(__setting) and __setting != '0' and sqlite3 is not None
+__sha_re = re.compile('^[0-9a-f]{40}$')
+__connections = threading.local()  # connections by db path, per thread
+__pending = dict()  # {db_path: {(table, key): value}}
+__pending_states = dict()  # {db_path: {name: value}}
+__lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'writes': 0}
+
+
+def is_sha(value):
+    return isinstance(value, str) and bool(__sha_re.match(value))
+
+
+def __db_path(git_dir):
+    if __setting == '1':
+        return os.path.join(git_dir, FILE_NAME)
+    else:
+        # directory shared by many repositories
+        return os.path.join(__setting, hashlib.sha1(
+            git_dir.encode()).hexdigest() + '.sqlite')
+
+
+def __disable(error):
+    global enabled
+    enabled = False
+    logging.warning('Shared cache disabled: ' + str(error))
+
+
+def __connect(db_path):
+    connections = getattr(__connections, 'by_path', None)
+    if connections is None:
+        connections = __connections.by_path = dict()
+    connection = connections.get(db_path)
+    if connection is None:
+        connection = sqlite3.connect(db_path, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # several processes may get here simultaneously for a new database
+            with connection:
+                if version:
+                    connection.execute('DROP TABLE IF EXISTS facts')
+                    connection.execute('DROP TABLE IF EXISTS states')
+                connection.execute('CREATE TABLE IF NOT EXISTS facts (func '
+                                   'TEXT, key TEXT, value TEXT, PRIMARY KEY '
+                                   '(func, key)) WITHOUT ROWID')
+                connection.execute('CREATE TABLE IF NOT EXISTS states (name '
+                                   'TEXT PRIMARY KEY, value TEXT)')
+                connection.execute('PRAGMA user_version=' +
+                                   str(SCHEMA_VERSION))
+        connections[db_path] = connection
+    return connection
+
+
+def __current_db():
+    if not enabled:
+        return None
+    git_dir = repo.get_git_dir()
+    return __db_path(git_dir) if git_dir else None
+
+
+def get(table, key):
+    """Returns (True, value) if value is stored, (False, None) otherwise.
+    Key is a string.
+    """
+    db_path = __current_db()
+    if not db_path:
+        return False, None
+    with __lock:
+        pending = __pending.get(db_path)
+        if pending and (table, key) in pending:
+            return True, pending[(table, key)]
+    try:
+        row = __connect(db_path).execute(
+            'SELECT value FROM facts WHERE func=? AND key=?',
+            (table, key)).fetchone()
+    except sqlite3.Error as error:
+        __disable(error)
+        return False, None
+    if row is None:
+        return False, None
+    return True, ast.literal_eval(row[0])
+
+
+def put(table, key, value):
+    """Queues value for storing. Value should be a literal, i.e. consist of
+    strings, numbers, tuples, lists, dicts, sets, booleans and None.
+    """
+    db_path = __current_db()
+    if not db_path:
+        return
+    with __lock:
+        pending = __pending.setdefault(db_path, dict())
+        pending[(table, key)] = value
+        to_flush = len(pending) >= FLUSH_SIZE
+    if to_flush:
+        flush(db_path)
+
+
+def get_state(name):
+    """Returns (True, value) if state is stored, (False, None) otherwise"""
+    db_path = __current_db()
+    if not db_path:
+        return False, None
+    with __lock:
+        pending = __pending_states.get(db_path)
+        if pending and name in pending:
+            return True, pending[name]
+    try:
+        row = __connect(db_path).execute(
+            'SELECT value FROM states WHERE name=?', (name,)).fetchone()
+    except sqlite3.Error as error:
+        __disable(error)
+        return False, None
+    if row is None:
+        return False, None
+    return True, ast.literal_eval(row[0])
+
+
+def put_state(name, value):
+    """Queues state for storing, replacing the stored one. Value should be a
+    literal, see put.
+    """
+    db_path = __current_db()
+    if not db_path:
+        return
+    with __lock:
+        __pending_states.setdefault(db_path, dict())[name] = value
+
+
+def flush(db_path=None):
+    """Writes queued values of given database (all databases by default) in
+    a single transaction per database.
+    """
+    with __lock:
+        if db_path:
+            batches = {db_path: __pending.pop(db_path, dict())}
+            states = {db_path: __pending_states.pop(db_path, dict())}
+        else:
+            batches = dict(__pending)
+            states = dict(__pending_states)
+            __pending.clear()
+            __pending_states.clear()
+    for path in set(batches) | set(states):
+        batch = batches.get(path, dict())
+        path_states = states.get(path, dict())
+        if not (batch or path_states) or not enabled:
+            continue
+        try:
+            connection = __connect(path)
+            with connection:
+                connection.executemany(
+                    'INSERT OR IGNORE INTO facts VALUES (?, ?, ?)',
+                    ((t, k, repr(v)) for (t, k), v in batch.items()))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO states VALUES (?, ?)',
+                    ((n, repr(v)) for n, v in path_states.items()))
+        except sqlite3.Error as error:
+            __disable(error)
+        else:
+            with __lock:
+                stats['writes'] += len(batch) + len(path_states)
+
+
+def _load_keys(table):
+    db_path = __current_db()
+    if not db_path:
+        return set()
+    try:
+        rows = __connect(db_path).execute(
+            'SELECT key FROM facts WHERE func=?', (table,)).fetchall()
+    except sqlite3.Error as error:
+        __disable(error)
+        return set()
+    return set(row[0] for row in rows)
+
+
+class ShaSet:
+    """Set of SHAs of current repository. Contents are persisted in shared
+    cache if it's enabled and loaded by a single query on first use. Without
+    shared cache it works as in-process set.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.__sets = dict()  # sets by git dir
+        self.__lock = threading.Lock()
+
+    def __current(self):
+        git_dir = repo.get_git_dir()
+        shas = self.__sets.get(git_dir)
+        if shas is None:
+            loaded = _load_keys(self.name)
+            with self.__lock:
+                shas = self.__sets.setdefault(git_dir, loaded)
+        return shas
+
+    def __contains__(self, sha):
+        return is_sha(sha) and sha in self.__current()
+
+    def add(self, sha):
+        """Adds sha to set. Values other than full SHAs are ignored."""
+        if is_sha(sha):
+            shas = self.__current()
+            if sha not in shas:
+                with self.__lock:
+                    shas.add(sha)
+                if enabled:
+                    put(self.name, sha, None)
+
+
+def persistent(*sha_args):
+    """Stores results of decorated function in shared cache when arguments at
+    sha_args positions are given and are full SHAs, i.e. when result can't
+    ever change. Arguments left to their defaults may be refs, so such calls
+    aren't stored.
+    """
+    def decorator(func):
+        if not enabled:
+            return func
+        table = func.__module__ + '.' + getattr(func, '__qualname__',
+                                                func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if (kwargs or not enabled or
+                    not all(i < len(args) and is_sha(args[i])
+                            for i in sha_args)):
+                return func(*args, **kwargs)
+            key = repr(args)
+            found, value = get(table, key)
+            with __lock:
+                stats['hits' if found else 'misses'] += 1
+            if found:
+                if trace.active:
+                    trace.record_cache_hit(table, 'shared')
+                return value
+            value = func(*args)
+            put(table, key, value)
+            return value
+        return wrapper
+    return decorator
+
+
+if enabled:
+    atexit.register(flush)
@@ -2,5 +2,17 @@ def cache(*_):
     return lambda x: x
 
 
+def persistent(*_):
+    return lambda x: x
+
+
 def invalidate(*groups):
     pass
+
+
+def invalidate_current_repo(*groups):
+    pass
+
+
+def register_store(forget, *groups):
+    pass
@@ -9,28 +9,36 @@ search for refs/tags/tag_name/*
 
 import sys
 
-from thingitwrapper.aux import get_output, check_01, call
+from thingitwrapper import backend
+from thingitwrapper.aux import call
 
 if 'thingitwrapper.cached' in sys.modules:
-    from thingitwrapper.grouped_cache import cache, invalidate
+    from thingitwrapper.grouped_cache import cache, \
+        invalidate_current_repo as invalidate
 else:
-    from thingitwrapper.stub_cache import cache, invalidate
+    from thingitwrapper.stub_cache import cache, \
+        invalidate_current_repo as invalidate
 
 
 def get_list(pattern=''):
-    return get_output(['git', 'tag', '--list'] +
-                      ([] if pattern == '' else [pattern])).splitlines()
+    return backend.get().tag_list(pattern)
 
 
 @cache('tags')
 def get_sha(name):
-    return get_output(['git', 'show-ref', '--verify', '--hash',
-                       'refs/tags/' + name])
+    return backend.get().tag_sha(name)
 
 
 @cache('tags')
 def exists(name):
-    return check_01(['git', 'show-ref', '--verify', '-q', 'refs/tags/' + name])
+    return backend.get().tag_exists(name)
+
+
+def exists_many(names):
+    """Returns list of booleans telling whether tags exist. Names are checked
+    in parallel.
+    """
+    return backend.get().tags_exist(names)
 
 
 def create(name, target=None):
@@ -47,4 +55,4 @@ def delete(name):
 
 
 def find_by_target(treeish):
-    return get_output(['git', 'tag', '--points-at', treeish]).splitlines()
+    return backend.get().tags_pointing_at(treeish)
@@ -0,0 +1,123 @@
+"""Tracing of git calls.
+
+Set GIT_WRAPPER_TRACE=path to append one JSON line per git call to path:
+    {"type": "call", "argv": [...], "cwd": ..., "duration": seconds,
+     "exit_code": ..., "output_size": ..., "caller": ..., "pid": ...,
+     "time": ...}
+and one line per cache hit, i.e. per git call made unnecessary by cache:
+    {"type": "cache_hit", "function": ..., "cache": "memory" or "shared", ...}
+exit_code is null if it is unknown (command raised unexpected error),
+output_size is null for commands which output isn't captured.
+caller is the innermost function outside of thingitwrapper.
+
+Calls are also counted by git subcommand while tracing is on or after
+collect() is called, see print_summary().
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+
+__lock = threading.Lock()
+__file = None
+active = False  # are calls reported to this module
+summary = dict()  # {subcommand: [calls, seconds]}
+cache_hits = {'memory': 0, 'shared': 0}
+
+
+def enable(path):
+    """Starts writing trace to path"""
+    global __file, active
+    with __lock:
+        if __file is not None:
+            __file.close()
+        # lines are short, so appends of different processes don't mix
+        __file = open(path, 'a', buffering=1)
+    active = True
+
+
+def collect():
+    """Starts collecting summary without writing trace"""
+    global active
+    active = True
+
+
+def disable():
+    """Stops tracing and collecting summary. Summary is kept."""
+    global __file, active
+    active = False
+    with __lock:
+        if __file is not None:
+            __file.close()
+            __file = None
+
+
+def caller():
+    """Returns qualified name of the innermost function outside of
+    thingitwrapper in call stack of current thread
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith('thingitwrapper') and \
+                module not in ('functools', 'threading', 'concurrent.futures',
+                               'concurrent.futures.thread', 'contextlib'):
+            code = frame.f_code
+            return module + '.' + getattr(code, 'co_qualname', code.co_name)
+        frame = frame.f_back
+    return None
+
+
+def __write(record):
+    if __file is not None:
+        record.update(pid=os.getpid(), time=time.time(), caller=caller())
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with __lock:
+            __file.write(line)
+
+
+def __subcommand(argv):
+    return argv[1] if len(argv) > 1 else argv[0]
+
+
+def record_call(argv, cwd, duration, exit_code, output_size):
+    with __lock:
+        calls = summary.setdefault(__subcommand(argv), [0, 0.0])
+        calls[0] += 1
+        calls[1] += duration
+    __write({'type': 'call', 'argv': list(argv), 'cwd': cwd,
+             'duration': duration, 'exit_code': exit_code,
+             'output_size': output_size})
+
+
+def record_cache_hit(function, cache='memory'):
+    with __lock:
+        cache_hits[cache] += 1
+    __write({'type': 'cache_hit', 'function': function, 'cache': cache})
+
+
+def print_summary(file=None):
+    """Prints table of numbers of calls and time spent per git subcommand"""
+    file = sys.stderr if file is None else file
+    with __lock:
+        rows = sorted(summary.items(), key=lambda item: -item[1][1])
+        hits = dict(cache_hits)
+    print('{:<24}{:>8}{:>12}'.format('git command', 'calls', 'seconds'),
+          file=file)
+    for command, (calls, seconds) in rows:
+        print('{:<24}{:>8}{:>12.3f}'.format(command, calls, seconds),
+              file=file)
+    print('{:<24}{:>8}{:>12.3f}'.format(
+        'total', sum(r[1][0] for r in rows), sum(r[1][1] for r in rows)),
+        file=file)
+    print('Calls avoided by cache: ' + str(hits['memory']) + ' (memory), ' +
+          str(hits['shared']) + ' (shared)', file=file)
+
+
+if os.environ.get('GIT_WRAPPER_TRACE'):
+    enable(os.environ['GIT_WRAPPER_TRACE'])
+    atexit.register(disable)